@@ -14,16 +14,18 @@ PROCESS_VARS = ['directory',
                 'dataset_id',
                 'dataset_list',
                 'incoming',
-                'source_values',
                 'pattern',
                 'set_keys',
                 'facets',
-                'lock',
-                'progress',
                 'source_type',
-                'scan_data',
-                'scan_errors',
-                'nbsources']
+                'nbsources',
+                'attributes_cache']
+
+# Number of sources processed at once by each worker, between two progress updates
+CHUNKSIZE = 64
+
+# Number of dataset IDs harvested between two progress updates
+BATCH_SIZE = 4096
 
 # Status messages
 STATUS = {0: 'ALL USED VALUES ARE PROPERLY DECLARED',
@@ -39,5 +41,6 @@ WIDTH = FACET_WIDTH + STATUS_WIDTH + 4
 # Source type label
 SOURCE_TYPE = {
     'file': 'file(s)',
+    'directory': 'leaf directory(ies)',
     'dataset': 'dataset(s)'
 }
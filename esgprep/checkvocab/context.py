@@ -7,7 +7,7 @@
 """
 
 from constants import *
-from esgprep.utils.collectors import PathCollector, DatasetCollector, Collector
+from esgprep.utils.collectors import PathCollector, LeafPathCollector, DatasetCollector, Collector
 from esgprep.utils.context import MultiprocessingContext
 from esgprep.utils.custom_print import *
 
@@ -26,11 +26,11 @@ class ProcessingContext(MultiprocessingContext):
         super(ProcessingContext, self).__init__(args)
         # True if undeclared facets
         self.any_undeclared = False
-        # Add sources values to process manager
-        if self.use_pool:
-            self.source_values = self.manager.dict({})
-        else:
-            self.source_values = dict()
+        # One file per leaf directory
+        self.leaf_directories = args.leaf_directories
+        if self.leaf_directories and not self.directory:
+            Print.warning('"--leaf-directories" ignored')
+            self.leaf_directories = False
 
     def __enter__(self):
         super(ProcessingContext, self).__enter__()
@@ -42,8 +42,13 @@ class ProcessingContext(MultiprocessingContext):
         # Init data collector
         if self.directory:
             # The source is a list of directories
-            self.source_type = 'file'
-            self.sources = PathCollector(sources=self.directory)
+            if self.leaf_directories:
+                self.source_type = 'directory'
+                self.sources = LeafPathCollector(dir_format=self.cfg.translate('directory_format'),
+                                                 sources=self.directory)
+            else:
+                self.source_type = 'file'
+                self.sources = PathCollector(sources=self.directory)
             # Init file filter
             for regex, inclusive in self.file_filter:
                 self.sources.FileFilter.add(regex=regex, inclusive=inclusive)
@@ -76,4 +81,24 @@ class ProcessingContext(MultiprocessingContext):
             self.pattern = self.cfg.translate('dataset_id')
         # Get number of sources
         self.nbsources = len(self.sources)
+        self.select_executor()
         return self
+
+    def select_executor(self, nbsources=None, size=None):
+        """
+        Selects how to process the sources, dataset IDs being always harvested within the main process.
+
+        :param int nbsources: The number of sources to process, default is all the sources
+        :param int size: The total bytes to checksum, None if unknown
+        :returns: The selected executor
+        :rtype: *str*
+
+        """
+        if self.source_type != 'dataset':
+            return super(ProcessingContext, self).select_executor(nbsources, size)
+        # Dataset IDs are harvested without processes pool nor manager, whatever "--max-processes"
+        self.executor = 'serial'
+        self.use_pool = False
+        nbsources = self.nbsources if nbsources is None else nbsources
+        Print.info('Executor: serial ({} source(s), dataset IDs harvested in-process)'.format(nbsources))
+        return self.executor
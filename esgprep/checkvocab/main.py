@@ -8,94 +8,158 @@
 
 import itertools
 import traceback
-from multiprocessing import Pool
+from collections import OrderedDict
 
 from ESGConfigParser import split_map_header
 from ESGConfigParser.custom_exceptions import ExpressionNotMatch, NoConfigOptions
-from fuzzywuzzy.fuzz import partial_ratio
-from fuzzywuzzy.process import extractOne
 
 from constants import *
 from context import ProcessingContext
 from esgprep.utils.custom_print import *
-from esgprep.utils.misc import ProcessContext, ncopen
+from esgprep.utils.misc import ProcessContext, get_ncattrs, closest_attribute
 
 
-def process(source):
+def get_values(source, pctx):
+    """
+    Gets the value of each facet from file or directory attributes.
+
+    :param str source: The file full path to process or the dataset ID
+    :param esgprep.utils.misc.ProcessContext pctx: The process context
+    :returns: The value of each facet
+    :rtype: *dict*
+    :raises Error: If a facet cannot be deduced from the source
+
+    """
+    if pctx.directory or pctx.dataset_id or pctx.dataset_list:
+        # Get attributes from directory format or dataset_id format
+        attributes = re.match(pctx.pattern, source).groupdict()
+    else:
+        # Get attributes from NetCDF global attributes
+        attributes = dict(get_ncattrs(source, pctx.attributes_cache))
+        # Get attributes from filename, overwriting existing ones
+        match = re.search(pctx.pattern, source)
+        if not match:
+            raise ExpressionNotMatch(source, pctx.pattern)
+        attributes.update(match.groupdict())
+    # Get source values from attributes
+    values = dict()
+    for facet in pctx.facets:
+        if facet in pctx.set_keys.keys():
+            try:
+                # Rename attribute key
+                attributes[facet] = attributes.pop(pctx.set_keys[facet])
+            except KeyError:
+                raise NoNetCDFAttribute(pctx.set_keys[facet], source)
+        elif facet in attributes.keys():
+            # Facet exists in attribute keys
+            pass
+        else:
+            # Find closest NetCDF attributes in terms of partial string comparison
+            key, score = closest_attribute(facet, attributes.keys(), pctx.attributes_cache)
+            if score >= 80:
+                # Rename attribute key
+                attributes[facet] = attributes.pop(key)
+                Print.debug('Consider "{}" attribute instead of "{}" facet'.format(key, facet))
+            else:
+                raise NoNetCDFAttribute(pctx.set_keys[facet], source)
+        values[facet] = attributes[facet]
+    return values
+
+
+def process(sources):
     """
     process(collector_input)
 
     Data process that:
 
-     * Retrieve facet key, values pairs from file or directory attributes
+     * Retrieve facet key, values pairs from file or directory attributes of a chunk of sources
 
-    :param str source: The file full path to process or the dataset ID
+    The facet values are merged per chunk and sent back to the main process with the processed sources. The main
+    process prints them and the progress, instead of sharing the progress through the process manager.
+
+    :param list sources: The file full paths to process
+    :returns: The values of each facet, the deserialized sources and the failed sources with their traceback
+    :rtype: *tuple*
 
     """
     # Get process content from process global env
     assert 'pctx' in globals().keys()
     pctx = globals()['pctx']
-    # Block to avoid program stop if a thread fails
-    try:
-        if pctx.directory or pctx.dataset_id or pctx.dataset_list:
-            # Get attributes from directory format or dataset_id format
-            attributes = re.match(pctx.pattern, source).groupdict()
-        else:
-            # Get attributes from NetCDF global attributes
-            attributes = dict()
-            with ncopen(source) as nc:
-                for attr in nc.ncattrs():
-                    attributes[attr] = nc.getncattr(attr)
-            # Get attributes from filename, overwriting existing ones
-            match = re.search(pctx.pattern, source)
-            if not match:
-                raise ExpressionNotMatch(source, pctx.pattern)
-            attributes.update(match.groupdict())
-        # Get source values from attributes
-        for facet in pctx.facets:
-            if facet in pctx.set_keys.keys():
-                try:
-                    # Rename attribute key
-                    attributes[facet] = attributes.pop(pctx.set_keys[facet])
-                except KeyError:
-                    raise NoNetCDFAttribute(pctx.set_keys[facet], source)
-            elif facet in attributes.keys():
-                # Facet exists in attribute keys
-                pass
-            else:
-                # Find closest NetCDF attributes in terms of partial string comparison
-                key, score = extractOne(facet, attributes.keys(), scorer=partial_ratio)
-                if score >= 80:
-                    # Rename attribute key
-                    attributes[facet] = attributes.pop(key)
-                    Print.debug('Consider "{}" attribute instead of "{}" facet'.format(key, facet))
-                else:
-                    raise NoNetCDFAttribute(pctx.set_keys[facet], source)
-            with pctx.lock:
-                s = pctx.source_values[0]
-                s[facet].add(attributes[facet])
-                pctx.source_values[0] = s
-        msg = TAGS.SUCCESS + 'Deserialize {}'.format(COLORS.HEADER(source))
-        with pctx.lock:
-            Print.info(msg)
-        return 1
-    except KeyboardInterrupt:
-        raise
-    except Exception:
-        exc = traceback.format_exc().splitlines()
-        msg = TAGS.FAIL + COLORS.HEADER(source) + '\n'
-        msg += '\n'.join(exc)
-        with pctx.lock:
-            Print.exception(msg, buffer=True)
-        return 0
-    finally:
-        with pctx.lock:
-            pctx.progress.value += 1
-            percentage = int(pctx.progress.value * 100 / pctx.nbsources)
-            msg = COLORS.OKBLUE('\rHarvesting facets values from data: ')
-            msg += '{}% | {}/{} {}'.format(percentage, pctx.progress.value, pctx.nbsources,
-                                           SOURCE_TYPE[pctx.source_type])
-            Print.progress(msg)
+    source_values = dict((facet, set()) for facet in pctx.facets)
+    succeeded, failed = list(), list()
+    for source in sources:
+        # Block to avoid program stop if a thread fails
+        try:
+            values = get_values(source, pctx)
+        except KeyboardInterrupt:
+            raise
+        except Exception:
+            failed.append((source, traceback.format_exc().splitlines()))
+            continue
+        succeeded.append(source)
+        for facet, value in values.items():
+            source_values[facet].add(value)
+    return source_values, succeeded, failed
+
+
+def print_progress(progress, nbsources, source_type):
+    """
+    Prints the harvesting progress.
+
+    :param int progress: The number of processed sources
+    :param int nbsources: The number of sources
+    :param str source_type: The sources type
+
+    """
+    percentage = int(progress * 100 / nbsources)
+    msg = COLORS.OKBLUE('\rHarvesting facets values from data: ')
+    msg += '{}% | {}/{} {}'.format(percentage, progress, nbsources, SOURCE_TYPE[source_type])
+    Print.progress(msg)
+
+
+def harvest(sources, pctx):
+    """
+    Harvests the facet values of dataset IDs within the main process.
+
+    A dataset ID only requires a regular expression matching, which is far cheaper than sending it to a process.
+    Identical dataset IDs are matched once and the progress is printed once per batch.
+
+    :param iterable sources: The dataset IDs
+    :param esgprep.utils.misc.ProcessContext pctx: The process context
+    :returns: The values of each facet, the numbers of scanned and failed dataset IDs
+    :rtype: *tuple*
+
+    """
+    # Number of occurrences of each dataset ID
+    counts = OrderedDict()
+    for source in sources:
+        counts[source] = counts.get(source, 0) + 1
+    pctx.pattern = re.compile(pctx.pattern)
+    source_values = dict((facet, set()) for facet in pctx.facets)
+    scan_data, scan_errors, progress = 0, 0, 0
+    items = iter(counts.items())
+    batch = list(itertools.islice(items, BATCH_SIZE))
+    while batch:
+        for source, count in batch:
+            try:
+                values = get_values(source, pctx)
+                Print.info(TAGS.SUCCESS + 'Deserialize {}'.format(COLORS.HEADER(source)))
+            except KeyboardInterrupt:
+                raise
+            except Exception:
+                exc = traceback.format_exc().splitlines()
+                msg = TAGS.FAIL + COLORS.HEADER(source) + '\n'
+                msg += '\n'.join(exc)
+                Print.exception(msg, buffer=True)
+                scan_errors += count
+                continue
+            scan_data += count
+            for facet, value in values.items():
+                source_values[facet].add(value)
+        progress += sum(count for _, count in batch)
+        print_progress(progress, pctx.nbsources, pctx.source_type)
+        batch = list(itertools.islice(items, BATCH_SIZE))
+    return source_values, scan_data, scan_errors
 
 
 def initializer(keys, values):
@@ -128,27 +192,43 @@ def run(args):
     with ProcessingContext(args) as ctx:
         # Init process context
         cctx = {name: getattr(ctx, name) for name in PROCESS_VARS}
-        cctx['source_values'][0] = dict((facet, set()) for facet in ctx.facets)
-        if ctx.use_pool:
-            # Init processes pool
-            pool = Pool(processes=ctx.processes, initializer=initializer, initargs=(cctx.keys(), cctx.values()))
-            processes = pool.imap(process, ctx.sources)
+        if ctx.source_type == 'dataset':
+            # Harvest dataset IDs within the main process
+            source_values, ctx.scan_data, ctx.scan_errors = harvest(ctx.sources, ProcessContext(cctx))
         else:
-            initializer(cctx.keys(), cctx.values())
-            processes = itertools.imap(process, ctx.sources)
-        # Process supplied sources
-        results = [x for x in processes]
-        # Close pool of workers if exists
-        if 'pool' in locals().keys():
-            locals()['pool'].close()
-            locals()['pool'].join()
+            # Split the sources into chunks
+            sources = iter(ctx.sources)
+            chunks = iter(lambda: list(itertools.islice(sources, CHUNKSIZE)), [])
+            if ctx.use_pool:
+                # Init pool of workers
+                pool = ctx.pool(initializer, (cctx.keys(), cctx.values()))
+                processes = pool.imap(process, chunks)
+            else:
+                initializer(cctx.keys(), cctx.values())
+                processes = itertools.imap(process, chunks)
+            # Process supplied sources and merge the facet values sent back
+            source_values = dict((facet, set()) for facet in ctx.facets)
+            progress = 0
+            for values, succeeded, failed in processes:
+                for source in succeeded:
+                    Print.info(TAGS.SUCCESS + 'Deserialize {}'.format(COLORS.HEADER(source)))
+                for source, exc in failed:
+                    msg = TAGS.FAIL + COLORS.HEADER(source) + '\n'
+                    msg += '\n'.join(exc)
+                    Print.exception(msg, buffer=True)
+                for facet in ctx.facets:
+                    source_values[facet].update(values[facet])
+                ctx.scan_data += len(succeeded)
+                ctx.scan_errors += len(failed)
+                progress += len(succeeded) + len(failed)
+                print_progress(progress, ctx.nbsources, ctx.source_type)
+            # Close pool of workers if exists
+            if 'pool' in locals().keys():
+                locals()['pool'].close()
+                locals()['pool'].join()
         Print.progress('\n')
         # Flush buffer
         Print.flush()
-        ctx.scan_data = sum(results)
-        ctx.scan_errors = results.count(0)
-        # Get source values
-        source_values = cctx['source_values'][0]
         # Get facets values declared in configuration file
         config_values = {}
         progress = 0
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+"""
+    :platform: Unix
+    :synopsis: Writers of the Unix command-lines exported by esgdrs todo.
+
+"""
+
+import os
+import shutil
+import threading
+from tempfile import TemporaryFile
+
+from constants import COMMANDS_BUFFER, SCRIPT_HEADER, SCRIPT_EOF
+
+
+class CommandsWriter(object):
+    """
+    Thread-safe buffered writer of the command-lines file.
+    The file is opened once in append mode on first write and closed at the end of the DRS upgrade.
+
+    :param str path: The commands file path
+    :returns: The commands writer
+    :rtype: *CommandsWriter*
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        """
+        Opens the commands file.
+
+        :returns: The file object
+        :rtype: *file*
+
+        """
+        return open(self.path, 'a', COMMANDS_BUFFER)
+
+    def write(self, line):
+        """
+        Writes a command-line.
+
+        :param str line: The command-line
+
+        """
+        with self._lock:
+            if self._file is None:
+                self._file = self.open()
+            self._file.write('{}\n'.format(line))
+
+    def mkdir(self, directory):
+        """
+        Writes the creation of a destination directory.
+
+        :param str directory: The directory path
+
+        """
+        self.write('{} {}'.format('mkdir -p', directory))
+
+    def section(self, title):
+        """
+        Starts a new section of command-lines that can only run once the previous sections are complete.
+
+        :param str title: The section title
+
+        """
+        pass
+
+    def commit(self):
+        """
+        Ends the command-lines of a DRS leaf, that can run independently of the other leaves of the same section.
+
+        """
+        pass
+
+    def close(self):
+        """
+        Closes the commands file if opened.
+
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class CommandsScript(CommandsWriter):
+    """
+    Writer of the command-lines as a shell script running each section in parallel with ``xargs -P``.
+
+    Each section starts by creating its unique destination directories at once. Then, each line of the section gathers
+    the command-lines of a DRS leaf (e.g., "rm -f" before "ln -s") and the lines run in parallel with "$JOBS" jobs.
+    The lines are spooled into a temporary file until the directories of the section are known.
+
+    :param str path: The script path
+    :returns: The commands script writer
+    :rtype: *CommandsScript*
+
+    """
+
+    def __init__(self, path):
+        super(CommandsScript, self).__init__(path)
+        self._title = None
+        self._directories = set()
+        self._spool = None
+        self._lines = 0
+        self._job = list()
+
+    def open(self):
+        f = open(self.path, 'w', COMMANDS_BUFFER)
+        f.write(SCRIPT_HEADER)
+        return f
+
+    def write(self, line):
+        with self._lock:
+            self._job.append(line)
+
+    def mkdir(self, directory):
+        with self._lock:
+            self._directories.add(directory)
+
+    def commit(self):
+        with self._lock:
+            if self._job:
+                if self._spool is None:
+                    self._spool = TemporaryFile()
+                self._spool.write('{}\n'.format(' && '.join(self._job)))
+                self._lines += 1
+                self._job = list()
+
+    def section(self, title):
+        self.commit()
+        with self._lock:
+            self.flush()
+            self._title = title
+
+    def flush(self):
+        """
+        Writes the current section into the script.
+
+        """
+        if self._directories or self._lines:
+            if self._file is None:
+                self._file = self.open()
+            self._file.write('\n# {}\n'.format(self._title))
+            if self._directories:
+                self._file.write("xargs -d '\\n' mkdir -p <<'{}'\n".format(SCRIPT_EOF))
+                for directory in sorted(self._directories):
+                    self._file.write('{}\n'.format(directory))
+                self._file.write('{}\n'.format(SCRIPT_EOF))
+            if self._lines:
+                self._file.write("run <<'{}'\n".format(SCRIPT_EOF))
+                self._spool.seek(0)
+                shutil.copyfileobj(self._spool, self._file)
+                self._file.write('{}\n'.format(SCRIPT_EOF))
+        if self._spool is not None:
+            self._spool.close()
+        self._directories, self._spool, self._lines = set(), None, 0
+
+    def close(self):
+        self.section(None)
+        super(CommandsScript, self).close()
+        if os.path.exists(self.path):
+            os.chmod(self.path, os.stat(self.path).st_mode | 0o111)
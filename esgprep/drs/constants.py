@@ -6,10 +6,11 @@
 
 """
 
-from os import link, symlink, environ
-from shutil import copy2 as copy
+from os import link, symlink
 from shutil import move
 
+from esgprep.utils.copier import copy2 as copy
+
 # Facets ignored during checking
 IGNORED_KEYS = ['root', 'filename', 'version', 'period_start', 'period_end']
 
@@ -27,6 +28,40 @@ UNIX_COMMAND = {'symlink': symlink,
                 'copy': copy,
                 'move': move}
 
+# Upgrade phases: files payloads land before the version symlinks and the "latest" symlinks flip last
+UPGRADE_PHASES = ['files', 'version', 'latest']
+
+# Suffix of the temporary name of a file being migrated into the DRS tree
+MIGRATION_SUFFIX = '.esgdrs-part'
+
+# Maximum number of pending migrations per thread
+MIGRATION_QUEUE = 256
+
+# Buffer size of the exported command-lines file
+COMMANDS_BUFFER = 1 << 20
+
+# Header of the command-lines exported as a parallel shell script
+SCRIPT_HEADER = """#!/bin/bash
+# DRS upgrade exported by "esgdrs todo"
+# The sections run one after the other, the lines of a section run in parallel with $JOBS jobs (default: 8).
+set -e
+JOBS=${JOBS:-8}
+run() { xargs -d '\\n' -n 1 -P "$JOBS" sh -e -c; }
+"""
+
+# Delimiter of the "here documents" of the exported shell script
+SCRIPT_EOF = 'ESGDRS_EOF'
+
+# Hidden sibling directory where a dataset version is assembled before publication
+STAGING_DIR = '.{}.staging'
+
+# Journal filename template of the staged upgrades under the DRS root (incoming directories key)
+JOURNAL = '.esgdrs-journal-{}'
+
+# Publication states of a dataset version:
+# staged into the hidden directory, published by rename, "latest" symlink switched, or rolled back
+JOURNAL_STATES = ['stage', 'publish', 'latest', 'rollback']
+
 # Command-line parameter to ignore
 CONTROLLED_ARGS = ['directory',
                    'set_values',
@@ -36,12 +71,14 @@ CONTROLLED_ARGS = ['directory',
                    'root',
                    'no_checksum',
                    'checksums_from',
+                   'latest_checksums',
                    'upgrade_from_latest',
                    'ignore_from_latest',
                    'ignore_from_incoming']
 
 # List of variable required by each process
 PROCESS_VARS = ['root',
+                'attributes_cache',
                 'pattern',
                 'facets',
                 'set_values',
@@ -53,14 +90,24 @@ PROCESS_VARS = ['root',
                 'nbsources',
                 'no_checksum',
                 'checksums_from',
+                'latest_checksums',
                 'checksum_type',
                 'mode',
                 'upgrade_from_latest',
                 'ignore_from_latest',
                 'ignore_from_incoming']
 
-# Tree context file
-TREE_FILE = '/tmp/DRSTree_{}.pkl'.format(environ['USER'])
+# DRS plan store filename template (user, incoming directories key, arguments key and plan signature)
+PLAN_STORE = 'esgdrs-plan-{}-{}-{}-{}.db'
+
+# Seconds to wait for a concurrent run to release the plan store
+PLAN_STORE_TIMEOUT = 60
+
+# Separator of the path components of the plan store keys, lower than any character of a directory name
+PLAN_SEPARATOR = '\x01'
+
+# Version of the plan store schema
+PLAN_SCHEMA = 2
 
 # PID prefixes
 PID_PREFIXES = {'cmip6': 'hdl:21.14100',
@@ -6,6 +6,7 @@
 
 """
 
+from multiprocessing import cpu_count
 from uuid import uuid4 as uuid
 
 from constants import *
@@ -13,8 +14,8 @@ from custom_exceptions import *
 from esgprep.utils.collectors import Collector
 from esgprep.utils.context import MultiprocessingContext
 from esgprep.utils.custom_print import *
-from esgprep.utils.misc import load_checksums
-from handler import DRSTree, DRSPath
+from esgprep.utils.misc import load_checksums, load_mapfiles_checksums
+from handler import DRSPath
 
 
 class ProcessingContext(MultiprocessingContext):
@@ -54,6 +55,14 @@ class ProcessingContext(MultiprocessingContext):
             self.mode = 'symlink'
         else:
             self.mode = 'move'
+        # Maximum number of simultaneous migrations per filesystem
+        self.max_threads = args.max_threads or cpu_count()
+        # Filters of the DRS tree view
+        self.tree_pattern = args.dataset.pattern if getattr(args, 'dataset', None) else None
+        self.tree_depth = args.depth if hasattr(args, 'depth') else None
+        # Staged publication of the dataset versions
+        self.staging = args.staging
+        self.rollback = args.rollback if hasattr(args, 'rollback') else False
         # Specified version
         self.version = args.version
         DRSPath.TREE_VERSION = 'v{}'.format(args.version)
@@ -64,18 +73,33 @@ class ProcessingContext(MultiprocessingContext):
             self.commands_file = None
         if self.overwrite_commands_file and not self.commands_file:
             Print.warning('"--overwrite-commands-file" ignored')
+        self.commands_script = args.commands_script
+        if self.commands_script and not self.commands_file:
+            Print.warning('"--commands-script" ignored')
+            self.commands_script = False
         # Checksumming
         if hasattr(args, 'checksums_from'):
             if args.checksums_from:
                 self.checksums_from = load_checksums(args.checksums_from)
             else:
                 self.checksums_from = args.checksums_from
+        self.latest_checksums = None
+        if args.latest_mapfiles:
+            self.latest_checksums = load_mapfiles_checksums(args.latest_mapfiles)
         self.no_checksum = args.no_checksum
         if self.no_checksum:
             msg = 'Checksumming disabled, DRS breach could occur -- '
             msg += 'Duplicated files will not be detected properly -- '
             msg += 'It is highly recommend to activate checksumming processes.'
             Print.warning(msg)
+        # Checksums computed while copying files
+        self.checksums_to = args.checksums_to
+        if self.checksums_to and self.no_checksum:
+            Print.warning('"--checksums-to" ignored with "--no-checksum"')
+            self.checksums_to = None
+        if self.checksums_to and self.mode in ['link', 'symlink']:
+            Print.warning('"--checksums-to" ignored, no file is copied with "--link" or "--symlink"')
+            self.checksums_to = None
 
     def __enter__(self):
         super(ProcessingContext, self).__enter__()
@@ -103,8 +127,6 @@ class ProcessingContext(MultiprocessingContext):
                 # Add the uuid to the ignored keys
                 IGNORED_KEYS.append(key)
         self.pattern = self.cfg.translate('filename_format')
-        # Init DRS tree
-        self.tree = DRSTree(self.root, self.version, self.mode, self.commands_file)
         # Init data collector
         self.sources = Collector(sources=self.directory)
         # Init file filter
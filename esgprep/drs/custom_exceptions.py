@@ -130,6 +130,21 @@ class MigrationDenied(Exception):
         super(self.__class__, self).__init__(self.msg)
 
 
+class IncompleteCopy(Exception):
+    """
+    Raised when a copied file is smaller than its source.
+
+    """
+
+    def __init__(self, src, dst, size, copied):
+        self.msg = "Incomplete copy."
+        self.msg += "\n<src: '{}'>".format(src)
+        self.msg += "\n<dst: '{}'>".format(dst)
+        self.msg += "\n<size: '{}'>".format(size)
+        self.msg += "\n<copied: '{}'>".format(copied)
+        super(self.__class__, self).__init__(self.msg)
+
+
 class InconsistentDRSPath(Exception):
     """
     Raised when DRS path doesn't start with the project ID.
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""
+    :platform: Unix
+    :synopsis: Parallel migration of the DRS leaves during upgrade.
+
+"""
+
+import os
+import sys
+import time
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+from constants import MIGRATION_QUEUE
+
+
+class MigrationExecutor(object):
+    """
+    Thread pools migrating the DRS leaves with a concurrency limit per target filesystem.
+
+    Each filesystem, identified by the device of the closest existing parent of the destination, gets its own pool of
+    threads. With one thread the migrations are applied in the calling thread in the submission order.
+    After a failure, the pending migrations are completed but no more migration is started and the first error is
+    raised by :func:`join`.
+
+    :param int threads: The maximum number of simultaneous migrations per target filesystem
+    :returns: The migration executor
+    :rtype: *MigrationExecutor*
+
+    """
+
+    def __init__(self, threads=1):
+        self.threads = threads
+        # Thread pools by target device
+        self.pools = dict()
+        # Target devices by destination directory
+        self.devices = dict()
+        # Pending migrations
+        self.pending = deque()
+        # First error
+        self.error = None
+        # Migration counters
+        self.count = 0
+        self.size = 0
+        self.start = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for pool in self.pools.values():
+            pool.close()
+            pool.join()
+
+    def device(self, dst):
+        """
+        Gets the device of the filesystem where a destination path will be created.
+
+        :param str dst: The destination path
+        :returns: The device number
+        :rtype: *int*
+
+        """
+        directory = os.path.dirname(dst)
+        if directory not in self.devices:
+            parent = directory
+            while not os.path.exists(parent):
+                parent = os.path.dirname(parent)
+            self.devices[directory] = os.stat(parent).st_dev
+        return self.devices[directory]
+
+    def submit(self, func, dst, *args):
+        """
+        Submits a migration to the pool of the target filesystem.
+        The function returns the number of migrated bytes.
+
+        :param callable func: The migration function
+        :param str dst: The destination path
+        :param tuple args: The function arguments
+
+        """
+        if self.error:
+            return
+        if self.threads == 1:
+            try:
+                self.done(func(*args))
+            except Exception:
+                self.error = sys.exc_info()
+            return
+        device = self.device(dst)
+        if device not in self.pools:
+            self.pools[device] = ThreadPool(self.threads)
+        self.pending.append(self.pools[device].apply_async(func, args))
+        # Bound the pending migrations to stream the leaves
+        while len(self.pending) > MIGRATION_QUEUE * self.threads * len(self.pools):
+            self.collect()
+
+    def done(self, size):
+        """
+        Counts a completed migration.
+
+        :param int size: The number of migrated bytes
+
+        """
+        self.count += 1
+        self.size += size
+
+    def collect(self):
+        """
+        Waits for the oldest pending migration.
+
+        """
+        try:
+            self.done(self.pending.popleft().get())
+        except Exception:
+            self.error = self.error or sys.exc_info()
+
+    def join(self):
+        """
+        Waits for all the pending migrations, typically between two upgrade phases.
+
+        :raises Error: The first migration error
+
+        """
+        while self.pending:
+            self.collect()
+        if self.error:
+            raise self.error[0], self.error[1], self.error[2]
+
+    def throughput(self):
+        """
+        Returns the migration throughput since the executor start.
+
+        :returns: The number of migrations and bytes, the elapsed time and the rates per second
+        :rtype: *tuple*
+
+        """
+        elapsed = max(time.time() - self.start, 1e-6)
+        return self.count, self.size, elapsed, self.count / elapsed, self.size / elapsed
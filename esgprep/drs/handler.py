@@ -6,22 +6,27 @@
 
 """
 
+import errno
 import getpass
+import shutil
+import threading
 from collections import OrderedDict
 from os import remove
 from tempfile import NamedTemporaryFile
 
 from ESGConfigParser.custom_exceptions import ExpressionNotMatch, NoConfigOptions, NoConfigOption
-from fuzzywuzzy.fuzz import partial_ratio
-from fuzzywuzzy.process import extractOne
 from hurry.filesize import size
-from treelib import Tree
-from treelib.tree import DuplicatedNodeIdError
 
+from commands import CommandsWriter, CommandsScript
 from constants import *
 from custom_exceptions import *
 from esgprep.utils.custom_print import *
-from esgprep.utils.misc import ncopen
+from esgprep.utils.directories import DirectoryHandles, makedirs
+from esgprep.utils.misc import get_ncattrs, closest_attribute
+from executor import MigrationExecutor
+
+# Lock of the command-lines printed by the migration threads
+PRINT_LOCK = threading.Lock()
 
 
 class File(object):
@@ -66,7 +71,7 @@ class File(object):
         else:
             raise KeyNotFound(key, self.attributes.keys() + self.__dict__.keys())
 
-    def load_attributes(self, root, pattern, set_values):
+    def load_attributes(self, root, pattern, set_values, cache=None):
         """
         Loads DRS attributes catched from a regular expression match.
         The root facet is added by default.
@@ -76,17 +81,20 @@ class File(object):
         :param str root: The DRS tree root
         :param str pattern: The regular expression to match
         :param dict set_values: Key/value pairs of facet to set for the run
+        :param esgprep.utils.cache.AttributesCache cache: The netCDF attributes cache
         :raises Error: If regular expression matching fails
         :raises Error: If invalid NetCDF file.
 
         """
         # Get attributes from NetCDF global attributes
-        with ncopen(self.ffp) as nc:
-            for attr in nc.ncattrs():
-                # If attribute value is a separated list, pick up the first item as facet value
-                values = unicode(nc.getncattr(attr)).split()
-                if values:  # [test to ignore attributes containing only whitespace]
-                    self.attributes[attr] = values[0]
+        for attr, value in get_ncattrs(self.ffp, cache).items():
+            # Keep the raw tracking ID for further validation without reading the file again
+            if attr == 'tracking_id':
+                self.tracking_id = value
+            # If attribute value is a separated list, pick up the first item as facet value
+            values = unicode(value).split()
+            if values:  # [test to ignore attributes containing only whitespace]
+                self.attributes[attr] = values[0]
         # Get attributes from filename, overwriting existing ones
         match = re.search(pattern, self.filename)
         if not match:
@@ -99,7 +107,7 @@ class File(object):
         # Set version to None
         self.attributes['version'] = None
 
-    def check_facets(self, facets, config, set_keys):
+    def check_facets(self, facets, config, set_keys, cache=None):
         """
         Checks each facet against the controlled vocabulary.
         If a DRS attribute is missing regarding the list of facets,
@@ -110,6 +118,7 @@ class File(object):
         :param list facets: The list of facet to check
         :param ESGConfigParser.SectionParser config: The configuration parser
         :param dict set_keys: Key/Attribute pairs to map for the run
+        :param esgprep.utils.cache.AttributesCache cache: The attributes cache to share the closest attributes
         :raises Error: If one facet checkup fails
 
         """
@@ -128,7 +137,7 @@ class File(object):
                         raise NoNetCDFAttribute(set_keys[facet], self.ffp)
                 else:
                     # Find closest NetCDF attributes in terms of partial string comparison
-                    key, score = extractOne(facet, self.attributes.keys(), scorer=partial_ratio)
+                    key, score = closest_attribute(facet, self.attributes.keys(), cache)
                     if score >= 80:
                         # Rename attribute key
                         self.attributes[facet] = self.attributes.pop(key)
@@ -149,6 +158,140 @@ class File(object):
         """
         return OrderedDict(zip(facets, [self.attributes[facet] for facet in facets]))
 
+    def record(self):
+        """
+        Returns the compact record of the processed file to send back to the main process.
+
+        :returns: The file record
+        :rtype: *esgprep.drs.handler.FileRecord*
+
+        """
+        return FileRecord(ffp=self.ffp,
+                          filename=self.filename,
+                          size=self.size,
+                          parts=tuple(self.drs.d_parts.items() + [('version', None)] + self.drs.f_parts.items()),
+                          v_latest=self.drs.v_latest,
+                          is_duplicate=self.is_duplicate,
+                          checksum=self.checksum)
+
+
+class FileRecord(object):
+    """
+    Lightweight record of a processed file holding only what is required to build the DRS tree.
+    The netCDF attributes are dropped and the DRS parts are stored as a tuple of pairs.
+
+    """
+    __slots__ = ('ffp', 'filename', 'size', 'parts', 'v_latest', 'is_duplicate', 'checksum')
+
+    def __init__(self, ffp, filename, size, parts, v_latest, is_duplicate, checksum=None):
+        self.ffp = ffp
+        self.filename = filename
+        self.size = size
+        self.parts = parts
+        self.v_latest = v_latest
+        self.is_duplicate = is_duplicate
+        self.checksum = checksum
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+
+    def dataset(self):
+        """
+        Returns the DRS parts of the dataset directory, used to partition files per dataset.
+
+        :returns: The dataset facet values
+        :rtype: *tuple*
+
+        """
+        return tuple(value for _, value in self.parts[:[key for key, _ in self.parts].index('version')])
+
+    @property
+    def drs(self):
+        """
+        Rebuilds the DRS path handler without looking up the latest version again.
+
+        :returns: The DRS path handler
+        :rtype: *esgprep.drs.handler.DRSPath*
+
+        """
+        return DRSPath(OrderedDict(self.parts), v_latest=self.v_latest, lookup_latest=False)
+
+
+class DatasetState(object):
+    """
+    Per-process cache of the existing state of a dataset directory.
+    The dataset versions and the files of each version are lazily listed once per dataset.
+
+    :param str path: The dataset directory full path (without version)
+
+    """
+    # Dataset states by dataset path
+    CACHE = dict()
+    # Version directory pattern, excluding the hidden staging directories
+    VERSION_PATTERN = re.compile(r'^v[\d]+$')
+
+    def __init__(self, path):
+        self.path = path
+        self._versions = None
+        self._files = dict()
+
+    @classmethod
+    def get(cls, path):
+        """
+        Returns the cached state of a dataset directory.
+
+        :param str path: The dataset directory full path (without version)
+        :returns: The dataset state
+        :rtype: *esgprep.drs.handler.DatasetState*
+
+        """
+        if path not in cls.CACHE:
+            cls.CACHE[path] = cls(path)
+        return cls.CACHE[path]
+
+    @property
+    def versions(self):
+        """
+        Sorted list of the existing dataset versions.
+
+        """
+        if self._versions is None:
+            self._versions = list()
+            if os.path.isdir(self.path):
+                self._versions = sorted([v for v in os.listdir(self.path) if self.VERSION_PATTERN.match(v)])
+        return self._versions
+
+    @property
+    def latest(self):
+        """
+        The latest existing dataset version, None if no version exists.
+
+        """
+        return self.versions[-1] if self.versions else None
+
+    def files(self, version):
+        """
+        Lists the files of a dataset version recursively.
+        Each file comes with the target of the symbolic link (None if not a link).
+
+        :param str version: The dataset version
+        :returns: The list of (filename, full path, link target)
+        :rtype: *list*
+
+        """
+        if version not in self._files:
+            self._files[version] = list()
+            for root, _, filenames in os.walk(os.path.join(self.path, version)):
+                for filename in filenames:
+                    ffp = os.path.join(root, filename)
+                    link = os.readlink(ffp) if os.path.islink(ffp) else None
+                    self._files[version].append((filename, ffp, link))
+        return self._files[version]
+
 
 class DRSPath(object):
     """
@@ -159,7 +302,7 @@ class DRSPath(object):
     # Modified on the ProcessingContext instance
     TREE_VERSION = 'v{}'.format(datetime.now().strftime('%Y%m%d'))
 
-    def __init__(self, parts):
+    def __init__(self, parts, v_latest=None, lookup_latest=True):
         # Retrieve the dataset directory parts
         self.d_parts = OrderedDict(parts.items()[:parts.keys().index('version')])
         # Retrieve the file directory parts
@@ -167,8 +310,8 @@ class DRSPath(object):
         # Retrieve the upgrade version
         self.v_upgrade = DRSPath.TREE_VERSION
         # If the dataset path is not equivalent to the file diretcory (e.g., CMIP5 like)
-        # Get the physical files version
-        self.v_latest = self.get_latest_version()
+        # Get the physical files version (unless already known)
+        self.v_latest = self.get_latest_version() if lookup_latest else v_latest
         if self.path(f_part=False) != self.path():
             self.v_files = OrderedDict({'variable': '{}_{}'.format(self.get('variable'), self.v_upgrade[1:])})
         else:
@@ -245,18 +388,14 @@ class DRSPath(object):
         :raises Error: If latest version exists and is the same as upgrade version
 
         """
-        # Test if dataset path already exists
+        # Get all existing dataset versions once per dataset
         dset_path = self.path(f_part=False, version=False, root=True)
-        if os.path.isdir(dset_path) and os.listdir(dset_path):
-            # Get and sort all existing dataset versions
-            versions = sorted([v for v in os.listdir(dset_path) if re.compile(r'v[\d]+').search(v)])
-            # Upgrade version should not already exist
-            if self.v_upgrade in versions:
-                raise DuplicatedDataset(dset_path, self.v_upgrade)
-            # Pickup respectively previous, next and latest version
-            return versions[-1]
-        else:
-            return None
+        state = DatasetState.get(dset_path)
+        # Upgrade version should not already exist
+        if self.v_upgrade in state.versions:
+            raise DuplicatedDataset(dset_path, self.v_upgrade)
+        # Pickup the latest version
+        return state.latest
 
 
 class DRSLeaf(object):
@@ -264,23 +403,69 @@ class DRSLeaf(object):
     Handler providing methods to deal with DRS file.
 
     """
+    __slots__ = ('dst', 'label', 'src', 'mode', 'origin', 'phase')
 
-    def __init__(self, src, dst, mode, origin):
+    def __init__(self, dst, label, src, mode, origin, phase=None):
+        # Destination data path
+        self.dst = dst
+        # Leaf label for display
+        self.label = label
         # Retrieve source data path
         self.src = src
-        # Get destination data path
-        self.dst = dst
         # Retrieve migration mode
         self.mode = mode
         # Retrieve origin data/file (Default is None)
         self.origin = origin
+        # Upgrade phase (i.e., files payload, version or latest symlink)
+        self.phase = phase
+
+    def __getstate__(self):
+        return self.dst, self.label, self.src, self.mode, self.origin, self.phase
+
+    def __setstate__(self, state):
+        self.dst, self.label, self.src, self.mode, self.origin, self.phase = state
+
+    def migrated(self):
+        """
+        Checks if the leaf has already been migrated (e.g., by an interrupted upgrade).
+
+        :returns: True if the destination already holds the migrated data
+        :rtype: *boolean*
+
+        """
+        if self.mode == 'symlink':
+            return os.path.islink(self.dst) and os.readlink(self.dst) == self.src
+        if not os.path.exists(self.dst):
+            return False
+        if self.mode == 'move':
+            return not os.path.lexists(self.src)
+        if not os.path.exists(self.src):
+            return False
+        if self.mode == 'link':
+            return os.path.samefile(self.src, self.dst)
+        # Copied files keep the source size and modification time
+        src, dst = os.stat(self.src), os.stat(self.dst)
+        return src.st_size == dst.st_size and int(src.st_mtime) == int(dst.st_mtime)
+
+    def size(self):
+        """
+        Gets the size of the data to migrate.
+
+        :returns: The number of bytes, 0 for symbolic links
+        :rtype: *int*
 
-    def upgrade(self, todo_only=True, commands_file=None):
+        """
+        return 0 if self.mode == 'symlink' else os.path.getsize(self.src)
+
+    def upgrade(self, todo_only=True, commands=None, checksums=None, handles=None):
         """
         Upgrade the DRS tree.
+        If directory handles are submitted, the destination directory is expected to be already created.
 
-        :param str commands_file: The file to write command-lines statement if submitted
+        :param esgprep.drs.commands.CommandsWriter commands: The writer of the command-lines file if submitted
         :param boolean todo_only: True to only print Unix command-lines to apply (i.e., as dry-run)
+        :param esgprep.utils.checksums.ChecksumsWriter checksums: The writer of the checksums computed while copying
+        :param esgprep.utils.directories.DirectoryHandles handles: The handles of the destination directories
 
         """
         # BE CAREFUL: Avoid any changes in the print statements here
@@ -290,9 +475,12 @@ class DRSLeaf(object):
         # --commands-file writes print statements ONLY in the submitted file
 
         # Make directory for destination path if not exist
-        line = '{} {}'.format('mkdir -p', os.path.dirname(self.dst))
-        print_cmd(line, commands_file, todo_only)
-        if not todo_only:
+        if commands and todo_only:
+            commands.mkdir(os.path.dirname(self.dst))
+        else:
+            line = '{} {}'.format('mkdir -p', os.path.dirname(self.dst))
+            print_cmd(line, commands, todo_only)
+        if not todo_only and not handles:
             try:
                 os.makedirs(os.path.dirname(self.dst))
             except OSError:
@@ -300,22 +488,24 @@ class DRSLeaf(object):
         # Unlink symbolic link if already exists
         if self.mode == 'symlink' and os.path.lexists(self.dst):
             line = '{} {}'.format('rm -f', self.dst)
-            print_cmd(line, commands_file, todo_only)
+            print_cmd(line, commands, todo_only)
             if not todo_only:
                 os.remove(self.dst)
         # Print command-line to apply
         line = '{} {} {}'.format(UNIX_COMMAND_LABEL[self.mode], self.src, self.dst)
-        print_cmd(line, commands_file, todo_only)
+        print_cmd(line, commands, todo_only)
         # Make upgrade depending on the migration mode
         if not todo_only:
-            UNIX_COMMAND[self.mode](self.src, self.dst)
+            migrate(self.src, self.dst, self.mode, checksums, handles)
 
-    def has_permissions(self, root):
+    def has_permissions(self, root, probes=None):
         """
         Checks permissions for DRS leaf migration.
         Discards relative paths.
+        The write access to a destination directory is only checked once if a probes cache is submitted.
 
         :param str root: The DRS tree root
+        :param dict probes: The cache of the filesystem probes shared by the tree leaves
         :raises Error: If missing user privileges
 
         """
@@ -328,27 +518,40 @@ class DRSLeaf(object):
             if os.path.isabs(self.src) and not os.access(self.src, os.R_OK):
                 raise ReadAccessDenied(getpass.getuser(), self.src)
         # Check dst access (always write)
-        # Backward the DRS if path does not exist
-        dst = self.dst
-        while not os.path.exists(dst) and dst != root:
-            dst = os.path.split(dst)[0]
+        # An existing dst is checked by itself
+        if os.path.exists(self.dst):
+            dst = self.dst
+        else:
+            # Backward the DRS if path does not exist
+            dst = existing_parent(os.path.dirname(self.dst), root, probes)
+            if probes is not None and ('write', dst) in probes:
+                return
         if os.path.isabs(dst) and not os.access(dst, os.W_OK):
             raise WriteAccessDenied(getpass.getuser(), dst)
+        if probes is not None and dst != self.dst:
+            # A denied access raises an error, so only granted accesses are cached
+            probes[('write', dst)] = True
 
-    def migration_granted(self, root):
+    def migration_granted(self, root, probes=None):
         """
         Check if migration mode is allowed by filesystem.
         Bacially, copy or move will always succeed.
         Only hardlinks could fail depending on the filesystem partition.
+        The hardlink is only attempted once per source device, destination device and destination directory if a
+        probes cache is submitted.
 
         :param str root: The DRS tree root
+        :param dict probes: The cache of the filesystem probes shared by the tree leaves
         :raises Error: If migration is disallowed by filesystem configuration
         """
         if self.mode == 'link':
+            dst = existing_parent(os.path.dirname(self.dst), root, probes)
+            if probes is not None:
+                key = ('link', device(os.path.dirname(self.src), probes), device(dst, probes), dst)
+                # A disallowed migration raises an error, so only granted migrations are cached
+                if key in probes:
+                    return
             with NamedTemporaryFile(dir=os.path.dirname(self.src)) as f:
-                dst = os.path.dirname(self.dst)
-                while not os.path.exists(dst) and dst != root:
-                    dst = os.path.split(dst)[0]
                 dst = os.path.join(dst, os.path.basename(f.name))
                 try:
                     UNIX_COMMAND[self.mode](f.name, dst)
@@ -362,19 +565,33 @@ class DRSLeaf(object):
                 finally:
                     if os.path.exists(dst):
                         os.remove(dst)
+            if probes is not None:
+                probes[key] = True
 
 
-class DRSTree(Tree):
+class DRSTree(object):
     """
     Handler providing methods to deal with DRS tree.
+    The leaves and the dataset entries are recorded into a plan store and streamed from it.
+
+    :param esgprep.drs.plan.PlanStore store: The plan store of the run, None to only roll back
 
     """
 
-    def __init__(self, root=None, version=None, mode=None, outfile=None):
-        # Retrieve original class init
-        Tree.__init__(self)
-        # Dataset and files record
-        self.paths = dict()
+    def __init__(self, store, root=None, version=None, mode=None, outfile=None, threads=1, checksums=None,
+                 staging=False, journal=None, script=False):
+        # Plan store of the tree leaves and dataset entries
+        self.store = store
+        # Assemble the dataset versions into hidden directories before publication
+        self.staging = staging
+        # Journal of the staged dataset versions
+        self.journal = journal
+        # Version to publish by dataset root (None if already published)
+        self.staged = OrderedDict()
+        # Maximum number of simultaneous migrations per filesystem
+        self.threads = threads
+        # Writer of the checksums computed while copying files
+        self.checksums = checksums
         # Retrieve the root directory to build the DRS
         self.drs_root = root
         # Retrieve the dataset version to build the DRS
@@ -385,10 +602,8 @@ class DRSTree(Tree):
         self.d_lengths = list()
         # Output file if submitted
         self.commands_file = outfile
-        # List of duplicates to remove
-        self.duplicates = list()
-        # Dataset hash record
-        self.hash = dict()
+        # Export the command-lines as a parallel shell script
+        self.commands_script = script
 
     def get_display_lengths(self):
         """
@@ -396,14 +611,14 @@ class DRSTree(Tree):
 
         """
         self.d_lengths = [50, 20, 20, 16, 16]
-        if self.paths:
-            self.d_lengths[0] = max([len(i) for i in self.paths.keys()])
+        width = self.store.dataset_width() if self.store else None
+        if width:
+            self.d_lengths[0] = width
         self.d_lengths.append(sum(self.d_lengths) + 2)
 
-    def create_leaf(self, nodes, leaf, label, src, mode, origin=None, force=False):
+    def create_leaf(self, nodes, leaf, label, src, mode, origin=None, force=False, phase=None):
         """
-        Creates all upstream nodes to a DRS leaf.
-        The :func:`esgprep.drs.handler.DRSLeaf` class is added to data leaf nodes.
+        Records a DRS leaf with all upstream nodes.
 
         :param list nodes: The list of node tags to the leaf
         :param str leaf: The leaf name
@@ -412,48 +627,93 @@ class DRSTree(Tree):
         :param str mode: The migration mode (e.g., 'copy', 'move', etc.)
         :param str origin: The original file full path used for the DRSLeaf source
         :param boolean force: Overwrite node creation if True and node exists
+        :param str phase: The upgrade phase of the leaf (see :data:`esgprep.drs.constants.UPGRADE_PHASES`)
 
         """
-        nodes.append(leaf)
-        for i in range(len(nodes)):
-            node_id = os.path.join(*nodes[:i + 1])
-            try:
-                if i == 0:
-                    self.create_node(tag=nodes[i],
-                                     identifier=node_id)
-                elif i == len(nodes) - 1:
-                    if self.contains(node_id) and force:
-                        self.remove_node(node_id)
-                    parent_node_id = os.path.join(*nodes[:i])
-                    self.create_node(tag=label,
-                                     identifier=node_id,
-                                     parent=parent_node_id,
-                                     data=DRSLeaf(src=src,
-                                                  dst=node_id.split(LINK_SEPARATOR)[0],
-                                                  mode=mode,
-                                                  origin=origin))
-                else:
-                    parent_node_id = os.path.join(*nodes[:i])
-                    self.create_node(tag=nodes[i],
-                                     identifier=node_id,
-                                     parent=parent_node_id)
-            except DuplicatedNodeIdError:
-                # Mandatory to recursively generated the tree
-                pass
+        self.store.add_leaf(list(nodes) + [leaf], label, src, mode, origin, force, phase)
 
-    def leaves(self, root=None):
+    def add_entries(self, entries):
         """
-        Yield leaves of the whole DRS tree of a subtree.
+        Records the dataset entries of incoming files for :func:`esgprep.drs.handler.DRSTree.list`.
+
+        :param list entries: The dataset paths and the incoming file records
 
         """
-        if root is None:
-            for node in self._nodes.values():
-                if node.is_leaf():
-                    yield node
-        else:
-            for node in self.expand_tree(root):
-                if self[node].is_leaf():
-                    yield self[node]
+        self.store.add_entries(entries)
+
+    def add_duplicates(self, duplicates):
+        """
+        Records the duplicated incoming files to remove.
+
+        :param list duplicates: The duplicated file full paths
+
+        """
+        self.store.add_duplicates(duplicates)
+
+    def leaves(self, phase=None):
+        """
+        Yield leaves of the whole DRS tree.
+        Leaves are streamed in a depth-first order with children sorted by name.
+
+        :param str phase: The upgrade phase to restrict to
+
+        """
+        for components, label, src, mode, origin, phase in self.store.leaves(phase=phase):
+            yield DRSLeaf(dst=os.path.join(*components), label=label, src=src, mode=mode, origin=origin, phase=phase)
+
+    def walk(self, pattern=None, depth=None):
+        """
+        Yields the node labels of the tree in a depth-first order with children sorted by name.
+        Each node comes with the list of "is last child" flags along its path for display.
+        The directory nodes are deduced on the fly from the streamed leaves.
+
+        :param str pattern: The regular expression to search into the leaf paths
+        :param int depth: The maximum depth of the yielded nodes below the root
+
+        """
+        leaves = self.store.leaves(pattern=pattern)
+        # Directory nodes of the current branch and their flags (except for the root)
+        current, is_last = list(), list()
+        item = next(leaves, None)
+        while item is not None:
+            components, label = item[0], item[1]
+            if depth is not None and len(components) - 1 > depth:
+                # Skip the hidden subtree of the deepest displayed node
+                leaves = self.store.leaves(pattern=pattern, after=components[:depth + 1])
+            item = next(leaves, None)
+            # Yield the directory nodes not shared with the previous leaf
+            shared = 0
+            while shared < min(len(current), len(components) - 1) and current[shared] == components[shared]:
+                shared += 1
+            current = components[:-1]
+            del is_last[max(shared - 1, 0):]
+            for idx in range(shared, len(current) if depth is None else min(len(current), depth + 1)):
+                if idx:
+                    is_last.append(not self.store.has_next_sibling(current[:idx + 1], pattern))
+                yield current[idx], list(is_last)
+            # The next streamed leaf is a sibling or in a sibling subtree unless the leaf is the last child
+            if depth is None or len(components) - 1 <= depth:
+                yield label, is_last + [item is None or item[0][:len(current)] != current]
+
+    def show(self, pattern=None, depth=None):
+        """
+        Prints the tree with the same layout as ``treelib``.
+
+        :param str pattern: The regular expression to search into the leaf paths
+        :param int depth: The maximum depth of the printed nodes below the root
+
+        """
+        empty = True
+        for label, is_last in self.walk(pattern, depth):
+            empty = False
+            prefix = ''
+            if is_last:
+                prefix = ''.join([u'    ' if last else u'\u2502   ' for last in is_last[:-1]])
+                prefix += u'\u2514\u2500\u2500 ' if is_last[-1] else u'\u251c\u2500\u2500 '
+            print(u'{}{}'.format(prefix, label.decode('utf-8')).encode('utf-8'))
+        if empty:
+            print('Tree is empty')
+        print('')
 
     def check_uniqueness(self):
         """
@@ -461,22 +721,15 @@ class DRSTree(Tree):
         Each data version to upgrade has to be stricly different from the latest version if exists.
 
         """
-        for dset_path, incomings in self.paths.items():
-            incoming_filenames = [incoming['filename'] for incoming in incomings]
-            duplicates = [incoming['is_duplicate'] for incoming in incomings]
-            latests = [incoming['latest'] for incoming in incomings]
-            roots = [incoming['dset_root'] for incoming in incomings]
-            assert latests.count(latests[0]) == len(latests)
-            latest_version = latests[0]
-            assert roots.count(roots[0]) == len(roots)
-            dset_root = roots[0]
-            latest_filenames = list()
-            for _, _, filenames in os.walk(os.path.join(dset_root, latest_version)):
-                latest_filenames.extend(filenames)
+        for dset_path, latest_version, last, _, _, all_duplicates, dset_root, root in self.store.datasets():
+            assert latest_version == last
+            assert dset_root == root
             # An upgrade version is different if it contains at least one file with is_duplicate = False
             # And it has the same number of files than the "latest" version
-            if all(duplicates) and set(latest_filenames) == set(incoming_filenames):
-                raise DuplicatedDataset(dset_path, latest_version)
+            if all_duplicates:
+                latest_filenames = [filename for filename, _, _ in DatasetState.get(dset_root).files(latest_version)]
+                if set(latest_filenames) == set(self.store.filenames(dset_path)):
+                    raise DuplicatedDataset(dset_path, latest_version)
 
     def list(self):
         """
@@ -490,30 +743,30 @@ class DRSTree(Tree):
                                     'Files to upgrade'.rjust(self.d_lengths[3]),
                                     'Upgrade size'.rjust(self.d_lengths[4])))
         print(''.center(self.d_lengths[-1], '-'))
-        for dset_path, incomings in self.paths.items():
+        for dset_path, latest_version, last, files_number, total_size, _, _, _ in self.store.datasets():
             dset_dir, dset_version = os.path.dirname(dset_path), os.path.basename(dset_path)
             publication_level = os.path.normpath(dset_dir)
-            files_number = len(incomings)
-            latests = [incoming['latest'] for incoming in incomings]
-            assert latests.count(latests[0]) == len(latests)
-            latest_version = latests[0]
-            total_size = size(sum([incoming['size'] for incoming in incomings]))
+            assert latest_version == last
             print('{}{}->{}{}{}'.format(publication_level.ljust(self.d_lengths[0]),
                                         latest_version.center(self.d_lengths[1]),
                                         dset_version.center(self.d_lengths[2]),
                                         str(files_number).rjust(self.d_lengths[3]),
-                                        total_size.rjust(self.d_lengths[4])))
+                                        size(total_size).rjust(self.d_lengths[4])))
         print(''.center(self.d_lengths[-1], '='))
 
-    def tree(self):
+    def tree(self, pattern=None, depth=None):
         """
         Prints the whole DRS tree in a visual way.
+        The tree can be restricted to the leaves matching a regular expression and to a maximum depth.
+
+        :param str pattern: The regular expression to search into the leaf paths
+        :param int depth: The maximum depth of the printed nodes below the root
 
         """
         print(''.center(self.d_lengths[-1], '='))
         print('Upgrade DRS Tree'.center(self.d_lengths[-1]))
         print(''.center(self.d_lengths[-1], '-'))
-        self.show()
+        self.show(pattern, depth)
         print(''.center(self.d_lengths[-1], '='))
 
     def todo(self):
@@ -523,53 +776,392 @@ class DRSTree(Tree):
         """
         self.upgrade(todo_only=True)
 
+    def stage(self, leaf, todo_only=False):
+        """
+        Redirects a version leaf into the staging directory of its dataset version.
+        A dataset version already published by an interrupted upgrade is completed in place.
+        The current "latest" version of a dataset is journaled before its first staged leaf.
+
+        :param DRSLeaf leaf: The version leaf
+        :param boolean todo_only: True to only print Unix command-lines to apply (i.e., as dry-run)
+        :returns: The leaf to upgrade
+        :rtype: *DRSLeaf*
+
+        """
+        version = 'v{}'.format(self.drs_version)
+        components = leaf.dst.split(os.sep)
+        if version not in components[:-1]:
+            return leaf
+        # The version directory is the deepest one with the version name
+        idx = len(components) - 2 - components[-2::-1].index(version)
+        dataset = os.sep.join(components[:idx])
+        staging = os.path.join(dataset, STAGING_DIR.format(version))
+        if dataset not in self.staged:
+            published = os.path.isdir(os.path.join(dataset, version)) and not os.path.isdir(staging)
+            self.staged[dataset] = None if published else version
+            if not published and not todo_only and self.journal:
+                state = self.journal.state(dataset)
+                # Keep the previous "latest" version journaled by an interrupted upgrade
+                if not state or state[0] == 'rollback' or state[1] != version:
+                    latest = os.path.join(dataset, 'latest')
+                    previous = os.readlink(latest) if os.path.islink(latest) else None
+                    self.journal.record('stage', dataset, version, previous)
+        if not self.staged[dataset]:
+            return leaf
+        return DRSLeaf(dst=os.path.join(staging, *components[idx + 1:]), label=leaf.label, src=leaf.src,
+                       mode=leaf.mode, origin=leaf.origin, phase=leaf.phase)
+
+    def upgrade_leaves(self, phase=None, todo_only=False):
+        """
+        Yields the leaves to upgrade, with the version leaves redirected into the staging directories if enabled.
+
+        :param str phase: The upgrade phase to restrict to
+        :param boolean todo_only: True to only print Unix command-lines to apply (i.e., as dry-run)
+
+        """
+        for leaf in self.leaves(phase):
+            if self.staging and leaf.phase == 'version':
+                leaf = self.stage(leaf, todo_only)
+            yield leaf
+
+    def publish(self, todo_only=False, commands=None):
+        """
+        Publishes the staged dataset versions, each one by a single rename of its staging directory.
+
+        :param boolean todo_only: True to only print Unix command-lines to apply (i.e., as dry-run)
+        :param esgprep.drs.commands.CommandsWriter commands: The writer of the command-lines file if submitted
+        :returns: The number of published dataset versions
+        :rtype: *int*
+
+        """
+        count = 0
+        for dataset, version in self.staged.items():
+            if not version:
+                continue
+            staging = os.path.join(dataset, STAGING_DIR.format(version))
+            target = os.path.join(dataset, version)
+            line = '{} {} {}'.format('mv -T', staging, target)
+            print_cmd(line, commands, todo_only)
+            if not todo_only:
+                os.rename(staging, target)
+                if self.journal:
+                    self.journal.record('publish', dataset, version, self.journal.state(dataset)[2])
+            if commands:
+                commands.commit()
+            count += 1
+        return count
+
     def upgrade(self, todo_only=False):
         """
         Upgrades the whole DRS tree.
+        With staging, each dataset version is assembled into a hidden directory, published by a single rename and
+        the "latest" symbolic link is switched atomically.
 
         :param boolean todo_only: Only print Unix command-line to do
 
         """
+        self.staged = OrderedDict()
         # Check permissions and migration availability before upgrade
+        # Leaves already migrated by an interrupted upgrade are skipped
         if not todo_only:
-            for leaf in self.leaves():
-                leaf.data.has_permissions(self.drs_root)
-                leaf.data.migration_granted(self.drs_root)
+            # Filesystem probes shared by the leaves of the same directories
+            probes = dict()
+            # Destination directories to create
+            directories = set()
+            for leaf in self.upgrade_leaves():
+                if not leaf.migrated():
+                    leaf.has_permissions(self.drs_root, probes)
+                    leaf.migration_granted(self.drs_root, probes)
+                    directories.add(os.path.dirname(leaf.dst))
         print(''.center(self.d_lengths[-1], '='))
         if todo_only:
             print('Unix command-lines (DRY-RUN)'.center(self.d_lengths[-1]))
         else:
             print('Unix command-lines'.center(self.d_lengths[-1]))
         print(''.center(self.d_lengths[-1], '-'))
-        for leaf in self.leaves():
-            leaf.data.upgrade(todo_only, self.commands_file)
-        for duplicate in self.duplicates:
-            line = '{} {}'.format('rm -f', duplicate)
-            print_cmd(line, self.commands_file, todo_only)
+        skipped, published = 0, 0
+        handles = None if todo_only else DirectoryHandles()
+        commands = None
+        if todo_only and self.commands_file:
+            commands = CommandsScript(self.commands_file) if self.commands_script else CommandsWriter(self.commands_file)
+        try:
             if not todo_only:
-                # Check src access
-                if os.path.isabs(duplicate) and not os.access(duplicate, os.W_OK):
-                    raise WriteAccessDenied(getpass.getuser(), self.src)
-                else:
-                    # If access granted, remove file
-                    remove(duplicate)
+                # Create each destination directory once before the leaves
+                makedirs(directories)
+            with MigrationExecutor(1 if todo_only else self.threads) as executor:
+                # Wait for each phase to complete before the next one
+                for phase in UPGRADE_PHASES:
+                    if commands:
+                        commands.section('Upgrade phase: {}'.format(phase))
+                    for leaf in self.upgrade_leaves(phase, todo_only):
+                        if leaf.migrated():
+                            skipped += 1
+                        elif self.staging and phase == 'latest':
+                            executor.submit(swap_latest, leaf.dst, leaf, todo_only, commands, handles,
+                                            None if todo_only else self.journal)
+                        else:
+                            executor.submit(upgrade_leaf, leaf.dst, leaf, todo_only, commands,
+                                            None if todo_only else self.checksums, handles)
+                        # The command-lines are exported by a sequential dry-run
+                        if commands:
+                            commands.commit()
+                    executor.join()
+                    # Publish the staged versions once complete, before switching the "latest" symlinks
+                    if self.staging and phase == 'version':
+                        if commands:
+                            commands.section('Publication of the staged versions')
+                        published = self.publish(todo_only, commands)
+            if commands:
+                commands.section('Removal of the duplicated files')
+            for duplicate in self.store.duplicates():
+                if not todo_only and not os.path.lexists(duplicate):
+                    # Already removed by an interrupted upgrade
+                    continue
+                line = '{} {}'.format('rm -f', duplicate)
+                print_cmd(line, commands, todo_only)
+                if commands:
+                    commands.commit()
+                if not todo_only:
+                    # Check src access
+                    if os.path.isabs(duplicate) and not os.access(duplicate, os.W_OK):
+                        raise WriteAccessDenied(getpass.getuser(), duplicate)
+                    else:
+                        # If access granted, remove file
+                        remove(duplicate)
+        finally:
+            if commands:
+                commands.close()
+            if handles:
+                handles.close()
+            if self.journal:
+                self.journal.close()
+            # Keep the checksums of the migrated files even if the upgrade fails
+            if self.checksums:
+                self.checksums.close()
         if todo_only and self.commands_file:
             print('Command-lines to apply have been exported to {}'.format(self.commands_file))
+            if self.commands_script:
+                print('Run them in parallel with "JOBS=<N> {}"'.format(self.commands_file))
         print(''.center(self.d_lengths[-1], '='))
+        if not todo_only:
+            count, total_size, elapsed, rate, throughput = executor.throughput()
+            msg = 'Number of DRS leaves migrated: {} ({} already migrated)\n'.format(count, skipped)
+            msg += 'Migration throughput: {} in {:.1f}s -- {:.1f} leaves/s, {}/s'.format(size(total_size), elapsed, rate,
+                                                                                    size(int(throughput)))
+            if self.staging:
+                msg += '\nNumber of dataset versions published: {}'.format(published)
+                if self.journal:
+                    msg += '\nPublication journal: {}'.format(self.journal.path)
+            Print.summary(msg)
+
+    def rollback(self):
+        """
+        Rolls back the dataset versions published by the staged upgrades recorded into the journal.
+        The previous "latest" symbolic links are restored and the version directories are removed.
+        The files migrated into the "files" directories are kept for a further upgrade.
+
+        """
+        print(''.center(self.d_lengths[-1], '='))
+        print('Unix command-lines'.center(self.d_lengths[-1]))
+        print(''.center(self.d_lengths[-1], '-'))
+        count = 0
+        entries = self.journal.entries.items() if self.journal else list()
+        try:
+            for dataset, (state, version, previous) in reversed(entries):
+                if state == 'rollback':
+                    continue
+                staging = os.path.join(dataset, STAGING_DIR.format(version))
+                target = os.path.join(dataset, version)
+                latest = os.path.join(dataset, 'latest')
+                if state != 'stage':
+                    # Restore the previous "latest" symlink if switched
+                    if os.path.islink(latest) and os.readlink(latest) == version:
+                        if previous:
+                            swap_latest(DRSLeaf(dst=latest, label='latest', src=previous, mode='symlink', origin=None),
+                                        False, None)
+                        else:
+                            print_cmd('{} {}'.format('rm -f', latest), None, False)
+                            os.remove(latest)
+                    # Hide the published version
+                    if os.path.isdir(target) and not os.path.lexists(staging):
+                        print_cmd('{} {} {}'.format('mv -T', target, staging), None, False)
+                        os.rename(target, staging)
+                # The version directory only holds symbolic links
+                if os.path.lexists(staging):
+                    print_cmd('{} {}'.format('rm -rf', staging), None, False)
+                    shutil.rmtree(staging)
+                self.journal.record('rollback', dataset, version, previous)
+                count += 1
+        finally:
+            if self.journal:
+                self.journal.close()
+        print(''.center(self.d_lengths[-1], '='))
+        msg = 'Number of dataset versions rolled back: {}'.format(count)
+        if self.journal:
+            msg += '\nPublication journal: {}'.format(self.journal.path)
+        Print.summary(msg)
+
+
+def existing_parent(directory, root, probes=None):
+    """
+    Backwards a destination directory to its closest existing parent, stopping at the DRS tree root.
+
+    :param str directory: The destination directory
+    :param str root: The DRS tree root
+    :param dict probes: The cache of the filesystem probes shared by the tree leaves
+    :returns: The closest existing directory
+    :rtype: *str*
+
+    """
+    if probes is not None and ('parent', directory) in probes:
+        return probes[('parent', directory)]
+    parent = directory
+    while not os.path.exists(parent) and parent != root:
+        parent = os.path.split(parent)[0]
+    if probes is not None:
+        probes[('parent', directory)] = parent
+    return parent
+
+
+def device(path, probes=None):
+    """
+    Gets the device of the filesystem of an existing path.
+
+    :param str path: The path
+    :param dict probes: The cache of the filesystem probes shared by the tree leaves
+    :returns: The device number
+    :rtype: *int*
+
+    """
+    if probes is not None and ('device', path) in probes:
+        return probes[('device', path)]
+    st_dev = os.stat(path).st_dev
+    if probes is not None:
+        probes[('device', path)] = st_dev
+    return st_dev
 
 
-def print_cmd(line, commands_file, todo_only, mode='a'):
+def upgrade_leaf(leaf, todo_only, commands, checksums=None, handles=None):
+    """
+    Upgrades a DRS leaf, as a migration task of :class:`esgprep.drs.executor.MigrationExecutor`.
+
+    :param DRSLeaf leaf: The DRS leaf
+    :param boolean todo_only: True to only print Unix command-lines to apply (i.e., as dry-run)
+    :param esgprep.drs.commands.CommandsWriter commands: The writer of the command-lines file if submitted
+    :param esgprep.utils.checksums.ChecksumsWriter checksums: The writer of the checksums computed while copying
+    :param esgprep.utils.directories.DirectoryHandles handles: The handles of the destination directories
+    :returns: The number of migrated bytes
+    :rtype: *int*
+
+    """
+    nbytes = 0 if todo_only else leaf.size()
+    leaf.upgrade(todo_only, commands, checksums, handles)
+    return nbytes
+
+
+def migrate(src, dst, mode, checksums=None, handles=None):
+    """
+    Migrates a file into the DRS tree.
+    Files are copied or linked under a temporary name renamed once complete, so that an interrupted upgrade never
+    leaves a partial file into the DRS tree. A copy smaller than its source is never renamed into the DRS tree.
+    A moved file is only removed from the incoming directory once migrated.
+    The copied data are hashed on the fly if a checksums writer is submitted.
+    Links and renames are made relative to the destination directory if directory handles are submitted.
+
+    :param str src: The source path
+    :param str dst: The destination path
+    :param str mode: The migration mode
+    :param esgprep.utils.checksums.ChecksumsWriter checksums: The writer of the checksums computed while copying
+    :param esgprep.utils.directories.DirectoryHandles handles: The handles of the destination directories
+    :raises IncompleteCopy: If the copied file is smaller than its source
+
+    """
+    rename = handles.rename if handles else os.rename
+    if mode == 'symlink':
+        if handles:
+            handles.symlink(src, dst)
+        else:
+            UNIX_COMMAND[mode](src, dst)
+        return
+    if mode == 'move':
+        try:
+            # Atomic move within the same filesystem
+            rename(src, dst)
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+    tmp = os.path.join(os.path.dirname(dst), '.{}{}'.format(os.path.basename(dst), MIGRATION_SUFFIX))
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    if mode == 'link':
+        if handles:
+            handles.link(src, tmp)
+        else:
+            UNIX_COMMAND[mode](src, tmp)
+    else:
+        size = os.stat(src).st_size
+        checksum = UNIX_COMMAND['copy'](src, tmp, checksums.checksum_type if checksums else None)
+        copied = os.stat(tmp).st_size
+        if copied < size:
+            os.remove(tmp)
+            raise IncompleteCopy(src, dst, size, copied)
+    rename(tmp, dst)
+    if mode != 'link' and checksums:
+        checksums.write(os.path.realpath(dst), checksum)
+    if mode == 'move':
+        os.remove(src)
+
+
+def swap_latest(leaf, todo_only, commands, handles=None, journal=None):
+    """
+    Switches a "latest" symbolic link atomically, as a migration task of
+    :class:`esgprep.drs.executor.MigrationExecutor`.
+    The new symbolic link is created under a temporary name renamed over the previous one.
+
+    :param DRSLeaf leaf: The "latest" DRS leaf
+    :param boolean todo_only: True to only print Unix command-lines to apply (i.e., as dry-run)
+    :param esgprep.drs.commands.CommandsWriter commands: The writer of the command-lines file if submitted
+    :param esgprep.utils.directories.DirectoryHandles handles: The handles of the destination directories
+    :param esgprep.drs.journal.Journal journal: The journal of the staged dataset versions
+    :returns: The number of migrated bytes
+    :rtype: *int*
+
+    """
+    tmp = os.path.join(os.path.dirname(leaf.dst), '.{}{}'.format(os.path.basename(leaf.dst), MIGRATION_SUFFIX))
+    line = '{} {} {}'.format(UNIX_COMMAND_LABEL['symlink'], leaf.src, tmp)
+    print_cmd(line, commands, todo_only)
+    line = '{} {} {}'.format('mv -T', tmp, leaf.dst)
+    print_cmd(line, commands, todo_only)
+    if not todo_only:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        if handles:
+            handles.symlink(leaf.src, tmp)
+            handles.rename(tmp, leaf.dst)
+        else:
+            UNIX_COMMAND['symlink'](leaf.src, tmp)
+            os.rename(tmp, leaf.dst)
+        if journal:
+            # Only the staged dataset versions can be rolled back
+            dataset = os.path.dirname(leaf.dst)
+            state = journal.state(dataset)
+            if state and state[0] != 'rollback' and state[1] == leaf.src:
+                journal.record('latest', dataset, leaf.src, state[2])
+    return 0
+
+
+def print_cmd(line, commands, todo_only):
     """
     Print unix command-line depending on the choosen output and DRS action.
 
     :param str line: The command-line to write.
-    :param str commands_file: The output file to write command-lines, None if not.
+    :param esgprep.drs.commands.CommandsWriter commands: The writer of the command-lines file, None if not.
     :param boolean todo_only: True to only print Unix command-lines to apply (i.e., as dry-run)
-    :param str mode: File open() mode
 
     """
-    if commands_file and todo_only:
-        with open(commands_file, mode) as f:
-            f.write('{}\n'.format(line))
+    if commands and todo_only:
+        commands.write(line)
     else:
-        print(line)
+        with PRINT_LOCK:
+            print(line)
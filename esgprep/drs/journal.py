@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""
+    :platform: Unix
+    :synopsis: Journal of the dataset versions published by a staged esgdrs upgrade.
+
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from constants import JOURNAL, JOURNAL_STATES
+from plan import directories_key
+
+
+def journal_path(root, directories):
+    """
+    Returns the journal path of the staged upgrades of incoming directories.
+    The journal is kept under the DRS root to survive the temporary files and to be found by a rollback
+    whatever the other arguments.
+
+    :param str root: The DRS root directory
+    :param list directories: The incoming directories
+    :returns: The journal path
+    :rtype: *str*
+
+    """
+    return os.path.join(root, JOURNAL.format(directories_key(directories)))
+
+
+class Journal(object):
+    """
+    Append-only journal of the dataset versions published by a staged upgrade.
+
+    Each line records the new state of a dataset version publication (see :data:`esgprep.drs.constants.JOURNAL_STATES`)
+    with the previous target of the "latest" symbolic link, to roll the publication back. Each line is flushed to disk
+    before the next publication step. The last recorded state of a dataset wins.
+
+    :param str path: The journal path
+    :returns: The journal
+    :rtype: *Journal*
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Last state, version and previous latest version by dataset root
+        self.entries = OrderedDict()
+        if os.path.isfile(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    state, dataset, version, previous = line.rstrip('\n').split('\t')
+                    self.entries[dataset] = (state, version, previous or None)
+        self._file = None
+        self._lock = threading.Lock()
+
+    def record(self, state, dataset, version, previous=None):
+        """
+        Records the new publication state of a dataset version.
+
+        :param str state: The publication state
+        :param str dataset: The dataset root directory
+        :param str version: The published version
+        :param str previous: The previous target of the "latest" symbolic link, None if not exists
+
+        """
+        assert state in JOURNAL_STATES
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a')
+            self._file.write('{}\t{}\t{}\t{}\n'.format(state, dataset, version, previous or ''))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.entries[dataset] = (state, version, previous)
+
+    def state(self, dataset):
+        """
+        Gets the last recorded state of a dataset.
+
+        :param str dataset: The dataset root directory
+        :returns: The publication state, version and previous latest version, None if not recorded
+        :rtype: *tuple*
+
+        """
+        return self.entries.get(dataset)
+
+    def close(self):
+        """
+        Closes the journal if opened.
+
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
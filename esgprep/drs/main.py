@@ -8,14 +8,41 @@
 
 import itertools
 import traceback
-from multiprocessing import Pool
+from collections import OrderedDict
 
 from constants import *
 from context import ProcessingContext
 from custom_exceptions import *
+from esgprep.utils.checksums import ChecksumsWriter
 from esgprep.utils.custom_print import *
-from esgprep.utils.misc import load, store, evaluate, ProcessContext, get_tracking_id, get_checksum
-from handler import File, DRSPath, DRSTree
+from esgprep.utils.misc import evaluate, ProcessContext, get_tracking_id, check_tracking_id, \
+    identical_files
+from handler import File, DRSPath, DRSTree, DatasetState
+from journal import Journal, journal_path
+from plan import PlanStore, plan_store_path
+
+# Latest files tracking ID and size cache for the run, by latest file full path
+LATEST_FILES = dict()
+
+
+def get_latest_file(ffp, project, cache=None):
+    """
+    Gets the tracking ID and the size of a file from the latest dataset version.
+    The file is read only once per run and process whatever the number of incoming files compared to it.
+
+    :param str ffp: The latest file full path
+    :param str project: The project name
+    :param esgprep.utils.cache.AttributesCache cache: The netCDF attributes cache
+    :returns: The tracking ID and the file size, None if the file does not exist
+    :rtype: *tuple*
+
+    """
+    if ffp not in LATEST_FILES:
+        if os.path.exists(ffp):
+            LATEST_FILES[ffp] = (get_tracking_id(ffp, project, cache), os.stat(ffp).st_size)
+        else:
+            LATEST_FILES[ffp] = None
+    return LATEST_FILES[ffp]
 
 
 def process(source):
@@ -51,11 +78,13 @@ def process(source):
         # Loads attributes from filename, netCDF attributes, command-line
         fh.load_attributes(root=pctx.root,
                            pattern=pctx.pattern,
-                           set_values=pctx.set_values)
+                           set_values=pctx.set_values,
+                           cache=pctx.attributes_cache)
         # Checks the facet values provided by the loaded attributes
         fh.check_facets(facets=pctx.facets,
                         config=pctx.cfg,
-                        set_keys=pctx.set_keys)
+                        set_keys=pctx.set_keys,
+                        cache=pctx.attributes_cache)
         # Get parts of DRS path
         parts = fh.get_drs_parts(pctx.facets)
         # Instantiate file DRS path handler
@@ -63,8 +92,8 @@ def process(source):
         # Ensure that the called project section is ALWAYS part of the DRS path elements (case insensitive)
         if not fh.drs.path().lower().startswith(pctx.project.lower()):
             raise InconsistentDRSPath(pctx.project, fh.drs.path())
-        #Get tracking ID (None if not recorded into the file)
-        fh.tracking_id = get_tracking_id(fh.ffp, pctx.project)
+        # Validate tracking ID loaded with the attributes (None if not recorded into the file)
+        fh.tracking_id = check_tracking_id(fh.tracking_id, pctx.project)
         # Evaluate if processing file already exists in the latest existing dataset version (i.e., "is duplicated")
         # Default: fh.is_duplicate = False
         # 1. If a latest dataset version exists
@@ -72,22 +101,20 @@ def process(source):
             # Build corresponding latest file path
             latest_file = os.path.join(fh.drs.path(latest=True, root=True), fh.filename)
             # 2. Test if a file with the same filename exists in latest version
-            if os.path.exists(latest_file):
+            latest = get_latest_file(latest_file, pctx.project, pctx.attributes_cache)
+            if latest:
                 # Get tracking ID (None if not recorded into the file)
-                latest_tracking_id = get_tracking_id(latest_file, pctx.project)
+                latest_tracking_id, latest_size = latest
                 # 3. Test if tracking IDs are different (i.e., keep is_duplicate = False)
                 if fh.tracking_id == latest_tracking_id:
-                    latest_size = os.stat(latest_file).st_size
                     # 4. Test if file sizes are different (i.e., keep is_duplicate = False)
                     if fh.size == latest_size and not pctx.no_checksum:
-                        # Read or compute the checksums
-                        fh.checksum = get_checksum(fh.ffp, pctx.checksum_type, pctx.checksums_from)
-                        latest_checksum = get_checksum(latest_file, pctx.checksum_type, pctx.checksums_from)
-                        # store checksum
-                        if fh.checksum == latest_checksum:
+                        # Compare known checksums (including latest mapfiles), fingerprints and then contents
+                        if identical_files(fh.ffp, latest_file, pctx.checksum_type, pctx.checksums_from,
+                                           pctx.latest_checksums):
                             fh.is_duplicate = True
                         elif fh.tracking_id and latest_tracking_id:
-                            # If the checksums are different, the tracking ID must not be identical if exist.
+                            # If the contents are different, the tracking ID must not be identical if exist.
                             # If no tracking IDs keep to is_duplicate = False
                             raise UnchangedTrackingID(latest_file, latest_tracking_id,
                                                       fh.ffp, fh.tracking_id)
@@ -98,7 +125,8 @@ def process(source):
                                                   fh.ffp, fh.tracking_id)
         msg = TAGS.SUCCESS + 'Processing {}'.format(COLORS.HEADER(fh.ffp))
         Print.info(msg)
-        return fh
+        # Only send back the compact record required to build the DRS tree
+        return fh.record()
     except KeyboardInterrupt:
         raise
     except Exception:
@@ -117,116 +145,147 @@ def process(source):
             Print.progress(msg)
 
 
-def tree_builder(fh):
+def tree_planner(records):
     """
-    Builds the DRS tree accord to a source
+    Plans the DRS tree leaves of a dataset.
+    The latest dataset version is enumerated once whatever the number of incoming files.
 
-    :param esgprep.drs.handler.File fh: The file handler object
+    :param list records: The processed file records of the same dataset
+    :returns: The results, the leaves to create, the records for list() and the duplicates to remove
+    :rtype: *tuple*
 
     """
     # Get process content from process global env
     assert 'pctx' in globals().keys()
     pctx = globals()['pctx']
-    try:
-        # If a latest version already exists it should be older than upgrade version
-        if fh.drs.v_latest and int(DRSPath.TREE_VERSION[1:]) <= int(fh.drs.v_latest[1:]):
-            raise OlderUpgrade(DRSPath.TREE_VERSION, fh.drs.v_latest)
-        # Start the tree generation
-        if not fh.is_duplicate:
-            # Add the processed file to the "vYYYYMMDD" node
-            src = ['..'] * len(fh.drs.items(d_part=False))
-            src.extend(fh.drs.items(d_part=False, file_folder=True))
-            src.append(fh.filename)
-            tree.create_leaf(nodes=fh.drs.items(root=True),
-                             leaf=fh.filename,
-                             label='{}{}{}'.format(fh.filename, LINK_SEPARATOR, os.path.join(*src)),
-                             src=os.path.join(*src),
-                             mode='symlink',
-                             origin=fh.ffp,
-                             force=True)
-            # Add the "latest" node for symlink
-            tree.create_leaf(nodes=fh.drs.items(f_part=False, version=False, root=True),
-                             leaf='latest',
-                             label='{}{}{}'.format('latest', LINK_SEPARATOR, fh.drs.v_upgrade),
-                             src=fh.drs.v_upgrade,
-                             mode='symlink')
-            # Add the processed file to the "files" node
-            tree.create_leaf(nodes=fh.drs.items(file_folder=True, root=True),
-                             leaf=fh.filename,
-                             label=fh.filename,
-                             src=fh.ffp,
-                             mode=pctx.mode)
-            if fh.drs.v_latest and pctx.upgrade_from_latest:
-                # Walk through the latest dataset version and create a symlink for each file with a different
-                # filename than the processed one
-                for root, _, filenames in os.walk(fh.drs.path(f_part=False, latest=True, root=True)):
-                    for filename in filenames:
+    results, leaves, entries, duplicates = list(), list(), list(), list()
+    # Latest dataset version state, enumerated once
+    latest_files = None
+    for fh in records:
+        # Rebuild the file DRS path once
+        drs = fh.drs
+        try:
+            # If a latest version already exists it should be older than upgrade version
+            if drs.v_latest and int(DRSPath.TREE_VERSION[1:]) <= int(drs.v_latest[1:]):
+                raise OlderUpgrade(DRSPath.TREE_VERSION, drs.v_latest)
+            # Start the tree generation
+            if not fh.is_duplicate:
+                # Add the processed file to the "vYYYYMMDD" node
+                src = ['..'] * len(drs.items(d_part=False))
+                src.extend(drs.items(d_part=False, file_folder=True))
+                src.append(fh.filename)
+                leaves.append(dict(nodes=drs.items(root=True),
+                                   leaf=fh.filename,
+                                   label='{}{}{}'.format(fh.filename, LINK_SEPARATOR, os.path.join(*src)),
+                                   src=os.path.join(*src),
+                                   mode='symlink',
+                                   origin=fh.ffp,
+                                   force=True,
+                                   phase='version'))
+                # Add the "latest" node for symlink
+                leaves.append(dict(nodes=drs.items(f_part=False, version=False, root=True),
+                                   leaf='latest',
+                                   label='{}{}{}'.format('latest', LINK_SEPARATOR, drs.v_upgrade),
+                                   src=drs.v_upgrade,
+                                   mode='symlink',
+                                   phase='latest'))
+                # Add the processed file to the "files" node
+                leaves.append(dict(nodes=drs.items(file_folder=True, root=True),
+                                   leaf=fh.filename,
+                                   label=fh.filename,
+                                   src=fh.ffp,
+                                   mode=pctx.mode,
+                                   phase='files'))
+                if drs.v_latest and pctx.upgrade_from_latest and latest_files is None:
+                    # Walk through the latest dataset version once and create a symlink for each file with a
+                    # different filename than the processed one
+                    latest_files = DatasetState.get(drs.path(f_part=False, version=False, root=True))
+                    for filename, ffp, link in latest_files.files(drs.v_latest):
                         # Add latest files as tree leaves with version to upgrade instead of latest version
                         # i.e., copy latest dataset leaves to Tree
                         # Except if file has be ignored from latest version (i.e., with known issue)
                         # Except if file leaf has already been created to avoid overwriting new version
-                        # leaf will be not create if already exists
+                        # leaf will be not create if already exists and will be overwritten by the next
+                        # incoming files of the dataset
                         if filename != fh.filename and filename not in pctx.ignore_from_latest:
-                            src = os.path.join(root, filename)
-                            tree.create_leaf(nodes=fh.drs.items(root=True),
-                                             leaf=filename,
-                                             label='{}{}{}'.format(filename, LINK_SEPARATOR, os.readlink(src)),
-                                             src=os.readlink(src),
-                                             mode='symlink',
-                                             origin=os.path.realpath(src))
-
-        else:
-            # Pickup the latest file version
-            latest_file = os.path.join(fh.drs.path(latest=True, root=True), fh.filename)
-            if pctx.upgrade_from_latest:
-                # If upgrade from latest is activated, raise the error, no duplicated files allowed
-                # Because incoming must only contain modifed/corrected files
-                raise DuplicatedFile(latest_file, fh.ffp)
+                            link = link or os.readlink(ffp)
+                            leaves.append(dict(nodes=drs.items(root=True),
+                                               leaf=filename,
+                                               label='{}{}{}'.format(filename, LINK_SEPARATOR, link),
+                                               src=link,
+                                               mode='symlink',
+                                               origin=os.path.realpath(ffp),
+                                               phase='version'))
             else:
-                # If default behavior, the incoming contains all data for a new version
-                # In the case of a duplicated file, just pass to the expected symlink creation
-                # and records duplicated file for further removal only if migration mode is the
-                # default (i.e., moving files). In the case of --copy or --link, keep duplicates
-                # in place into the incoming directory
-                src = os.readlink(latest_file)
-                tree.create_leaf(nodes=fh.drs.items(root=True),
-                                 leaf=fh.filename,
-                                 label='{}{}{}'.format(fh.filename, LINK_SEPARATOR, src),
-                                 src=src,
-                                 mode='symlink',
-                                 origin=fh.ffp)
-                if pctx.mode == 'move':
-                    tree.duplicates.append(fh.ffp)
-        # Record entry for list()
-        record = {'src': fh.ffp,
-                  'dst': fh.drs.path(root=True),
-                  'dset_root': os.path.dirname(fh.drs.path(f_part=False, root=True)),
-                  'filename': fh.filename,
-                  'latest': fh.drs.v_latest or 'Initial',
-                  'size': fh.size,
-                  'is_duplicate': fh.is_duplicate}
-        if fh.drs.path(f_part=False) in tree.paths.keys():
-            tree.paths[fh.drs.path(f_part=False)].append(record)
-        else:
-            tree.paths[fh.drs.path(f_part=False)] = [record]
-        msg = TAGS.SUCCESS + 'DRS Path = {}'.format(COLORS.HEADER(fh.drs.path(f_part=False)))
-        msg += ' <-- ' + fh.filename
-        Print.info(msg)
-        return True
-    except KeyboardInterrupt:
-        raise
-    except Exception:
-        exc = traceback.format_exc().splitlines()
-        msg = TAGS.FAIL + 'Build {}'.format(COLORS.HEADER(fh.drs.path())) + '\n'
-        msg += '\n'.join(exc)
-        Print.exception(msg, buffer=True)
-        return None
-    finally:
-        pctx.progress.value += 1
-        percentage = int(pctx.progress.value * 100 / pctx.nbsources)
-        msg = COLORS.OKBLUE('\rBuilding DRS tree: ')
-        msg += '{}% | {}/{} file(s)'.format(percentage, pctx.progress.value, pctx.nbsources)
-        Print.progress(msg)
+                # Pickup the latest file version
+                latest_file = os.path.join(drs.path(latest=True, root=True), fh.filename)
+                if pctx.upgrade_from_latest:
+                    # If upgrade from latest is activated, raise the error, no duplicated files allowed
+                    # Because incoming must only contain modifed/corrected files
+                    raise DuplicatedFile(latest_file, fh.ffp)
+                else:
+                    # If default behavior, the incoming contains all data for a new version
+                    # In the case of a duplicated file, just pass to the expected symlink creation
+                    # and records duplicated file for further removal only if migration mode is the
+                    # default (i.e., moving files). In the case of --copy or --link, keep duplicates
+                    # in place into the incoming directory
+                    src = os.readlink(latest_file)
+                    leaves.append(dict(nodes=drs.items(root=True),
+                                       leaf=fh.filename,
+                                       label='{}{}{}'.format(fh.filename, LINK_SEPARATOR, src),
+                                       src=src,
+                                       mode='symlink',
+                                       origin=fh.ffp,
+                                       phase='version'))
+                    if pctx.mode == 'move':
+                        duplicates.append(fh.ffp)
+            # Record entry for list()
+            record = {'src': fh.ffp,
+                      'dst': drs.path(root=True),
+                      'dset_root': os.path.dirname(drs.path(f_part=False, root=True)),
+                      'filename': fh.filename,
+                      'latest': drs.v_latest or 'Initial',
+                      'size': fh.size,
+                      'is_duplicate': fh.is_duplicate}
+            entries.append((drs.path(f_part=False), record))
+            msg = TAGS.SUCCESS + 'DRS Path = {}'.format(COLORS.HEADER(drs.path(f_part=False)))
+            msg += ' <-- ' + fh.filename
+            Print.info(msg)
+            results.append(True)
+        except KeyboardInterrupt:
+            raise
+        except Exception:
+            exc = traceback.format_exc().splitlines()
+            msg = TAGS.FAIL + 'Build {}'.format(COLORS.HEADER(drs.path())) + '\n'
+            msg += '\n'.join(exc)
+            with pctx.lock:
+                Print.exception(msg, buffer=True)
+            results.append(None)
+        finally:
+            with pctx.lock:
+                pctx.progress.value += 1
+                percentage = int(pctx.progress.value * 100 / pctx.nbsources)
+                msg = COLORS.OKBLUE('\rBuilding DRS tree: ')
+                msg += '{}% | {}/{} file(s)'.format(percentage, pctx.progress.value, pctx.nbsources)
+                Print.progress(msg)
+    return results, leaves, entries, duplicates
+
+
+def tree_builder(plan):
+    """
+    Merges a dataset plan into the DRS tree.
+
+    :param tuple plan: The dataset plan as returned by :func:`esgprep.drs.main.tree_planner`
+    :returns: The results of the dataset files
+    :rtype: *list*
+
+    """
+    results, leaves, entries, duplicates = plan
+    for leaf in leaves:
+        tree.create_leaf(**leaf)
+    tree.add_entries(entries)
+    tree.add_duplicates(duplicates)
+    return results
 
 
 def initializer(keys, values):
@@ -242,11 +301,14 @@ def initializer(keys, values):
     pctx = ProcessContext({key: values[i] for i, key in enumerate(keys)})
 
 
-def do_scanning(ctx):
+def do_scanning(ctx, plan):
     """
-    Returns True if file scanning is necessary regarding command-line arguments
+    Returns True if file scanning is necessary regarding command-line arguments.
+    The plan store of a run is keyed by the incoming directories and the controlled arguments,
+    so that a changed argument never reuses the plan of another run.
 
     :param esgprep.drs.context.ProcessingContext ctx: New processing context to evaluate
+    :param str plan: The plan store path of the run
     :returns: True if file scanning is necessary
     :rtype: *boolean*
     """
@@ -254,23 +316,54 @@ def do_scanning(ctx):
         return True
     elif ctx.action == 'list':
         return True
-    elif os.path.isfile(TREE_FILE):
-        reader = load(TREE_FILE)
-        old_args = reader.next()
-        # Ensure that processing context is similar to previous step
-        for k in CONTROLLED_ARGS:
-            if getattr(ctx, k) != old_args[k]:
-                msg = '"{}" argument has changed: "{}" instead of "{}" -- '.format(k,
-                                                                                   getattr(ctx, k),
-                                                                                   old_args[k])
-                msg += 'Rescanning files.'
-                Print.warning(msg)
-                return True
+    elif os.path.isfile(plan):
         return False
     else:
         return True
 
 
+def get_cached_handlers(ctx, plan):
+    """
+    Returns the file records of the previous scan that can be reused for an incremental scan.
+    Previous records are discarded if "--rescan" is submitted.
+
+    :param esgprep.drs.context.ProcessingContext ctx: The processing context
+    :param str plan: The plan store path of the run
+    :returns: The previous file records and stat signatures by file path
+    :rtype: *dict*
+
+    """
+    if ctx.rescan or not os.path.isfile(plan):
+        return dict()
+    return {ffp: (signature, fh) for ffp, signature, fh in PlanStore(plan).files()}
+
+
+def get_signature(ffp):
+    """
+    Returns the stat signature of a file to detect changes between scans.
+
+    :param str ffp: The file full path
+    :returns: The file inode, size and modification time
+    :rtype: *tuple*
+
+    """
+    stat = os.stat(ffp)
+    return stat.st_ino, stat.st_size, stat.st_mtime
+
+
+def is_current(fh):
+    """
+    Returns True if the dataset latest version seen by a cached file record is still the latest one.
+
+    :param esgprep.drs.handler.FileRecord fh: The file record
+    :returns: True if the dataset versions did not change since the record
+    :rtype: *boolean*
+
+    """
+    state = DatasetState.get(fh.drs.path(f_part=False, version=False, root=True))
+    return state.latest == fh.v_latest and DRSPath.TREE_VERSION not in state.versions
+
+
 def run(args):
     """
     Main process that:
@@ -288,62 +381,115 @@ def run(args):
     with ProcessingContext(args) as ctx:
         # Init global variable
         global tree
-        # Init DRS tree
-        tree = DRSTree(ctx.root, ctx.version, ctx.mode, ctx.commands_file)
-        # Init process context
-        cctx = {name: getattr(ctx, name) for name in PROCESS_VARS}
+        # Get the plan store of the run
+        plan = plan_store_path({key: getattr(ctx, key) for key in CONTROLLED_ARGS})
+        # Writer of the checksums computed while copying files
+        checksums = ChecksumsWriter(ctx.checksums_to, ctx.checksum_type) if ctx.checksums_to else None
+        # Journal of the staged dataset versions, under the DRS root
+        journal = Journal(journal_path(ctx.root, ctx.directory)) if ctx.staging or ctx.rollback else None
+        if ctx.rollback:
+            # The journal is enough to roll back, the incoming files may have been moved by the upgrade
+            tree = DRSTree(None, ctx.root, journal=journal)
+            tree.get_display_lengths()
+            tree.rollback()
+            return
         # Disable file scan if a previous DRS tree have generated using same context and no "list" action
-        if do_scanning(ctx):
+        if do_scanning(ctx, plan):
+            # Init DRS tree into a new plan
+            tree = DRSTree(PlanStore(plan, create=True), ctx.root, ctx.version, ctx.mode, ctx.commands_file,
+                           ctx.max_threads, checksums, ctx.staging, journal, ctx.commands_script)
+            # Reuse the records of unchanged files from the previous scan
+            cached = get_cached_handlers(ctx, plan)
+            handlers, sources = OrderedDict(), list()
+            for ffp in ctx.sources:
+                signature = get_signature(ffp)
+                if ffp in cached and cached[ffp][0] == signature and is_current(cached[ffp][1]):
+                    handlers[ffp] = cached[ffp]
+                else:
+                    sources.append((ffp, signature))
+            if handlers:
+                msg = 'Reuse {} unchanged file(s) from previous scan (use "--rescan" to force it) -- '.format(
+                    len(handlers))
+                msg += 'Scanning {} new or modified file(s).'.format(len(sources))
+                Print.warning(msg)
+            # Init process context for the files to scan
+            ctx.select_executor(len(sources))
+            cctx = {name: getattr(ctx, name) for name in PROCESS_VARS}
+            cctx['progress'].value = len(handlers)
             if ctx.use_pool:
-                # Init processes pool
-                pool = Pool(processes=ctx.processes, initializer=initializer, initargs=(cctx.keys(), cctx.values()))
-                processes = pool.imap(process, ctx.sources)
+                # Init pool of workers
+                pool = ctx.pool(initializer, (cctx.keys(), cctx.values()))
+                processes = pool.imap(process, [ffp for ffp, _ in sources])
             else:
                 initializer(cctx.keys(), cctx.values())
-                processes = itertools.imap(process, ctx.sources)
+                processes = itertools.imap(process, [ffp for ffp, _ in sources])
             # Process supplied sources
-            handlers = [x for x in processes]
+            skipped = 0
+            for (ffp, signature), fh in itertools.izip(sources, processes):
+                if fh is not None:
+                    handlers[ffp] = (signature, fh)
+                elif os.path.basename(ffp) not in ctx.ignore_from_incoming:
+                    skipped += 1
+            Print.progress('\n')
+            # Partition the scanned files per dataset
+            cctx['progress'].value = 0
+            datasets = OrderedDict()
+            for _, fh in handlers.values():
+                datasets.setdefault(fh.dataset(), list()).append(fh)
+            # Plan the DRS tree leaves of each dataset in parallel
+            if ctx.use_pool:
+                plans = pool.imap(tree_planner, datasets.values())
+            else:
+                plans = itertools.imap(tree_planner, datasets.values())
+            # Merge the plans into the DRS tree
+            results = list()
+            for dataset_plan in plans:
+                results.extend(tree_builder(dataset_plan))
             # Close pool of workers if exists
             if 'pool' in locals().keys():
                 locals()['pool'].close()
                 locals()['pool'].join()
             Print.progress('\n')
-            # Build DRS tree
-            cctx['progress'].value = 0
-            initializer(cctx.keys(), cctx.values())
-            handlers = [h for h in handlers if h is not None]
-            results = [x for x in itertools.imap(tree_builder, handlers)]
-            Print.progress('\n')
+            # Backup tree context for later usage with other command lines
+            tree.store.add_files((ffp, signature, fh) for ffp, (signature, fh) in handlers.items())
+            tree.store.set('results', results)
+            if not skipped and None not in results:
+                tree.store.publish()
+                Print.info(TAGS.INFO + 'DRS tree recorded for next usage onto {}.'.format(COLORS.HEADER(plan)))
+            else:
+                # A failed scan never replaces the previous plan of the run
+                Print.warning('DRS tree not recorded for next usage because of scan errors.')
         else:
-            reader = load(TREE_FILE)
             msg = 'Skip incoming files scan (use "--rescan" to force it) -- '
-            msg += 'Using cached DRS tree from {}'.format(TREE_FILE)
+            msg += 'Using cached DRS tree from {}'.format(plan)
             Print.warning(msg)
-            _ = reader.next()
-            tree = reader.next()
-            handlers = reader.next()
-            results = reader.next()
+            tree = DRSTree(PlanStore(plan), ctx.root, ctx.version, ctx.mode, ctx.commands_file, ctx.max_threads,
+                           checksums, ctx.staging, journal, ctx.commands_script)
+            results = tree.store.get('results')
         # Flush buffer
         Print.flush()
-        # Rollback --commands-file value to command-line argument in any case
-        tree.commands_file = ctx.commands_file
         # Get number of files scanned (including errors/skipped files)
         ctx.scan_data = len(results)
         # Get number of scan errors
         ctx.scan_errors = results.count(None)
-        # Backup tree context for later usage with other command lines
-        store(TREE_FILE, data=[{key: ctx.__getattribute__(key) for key in CONTROLLED_ARGS},
-                               tree,
-                               handlers,
-                               results])
-        Print.info(TAGS.INFO + 'DRS tree recorded for next usage onto {}.'.format(COLORS.HEADER(TREE_FILE)))
-        # Evaluates the scan results to trigger the DRS tree action
-        if evaluate(results):
-            # Check upgrade uniqueness
-            tree.check_uniqueness()
-            # Apply tree action
-            tree.get_display_lengths()
-            getattr(tree, ctx.action)()
+        try:
+            # Evaluates the scan results to trigger the DRS tree action
+            if evaluate(results):
+                # Check upgrade uniqueness
+                tree.check_uniqueness()
+                # Apply tree action
+                tree.get_display_lengths()
+                if ctx.action == 'tree':
+                    tree.tree(ctx.tree_pattern, ctx.tree_depth)
+                else:
+                    getattr(tree, ctx.action)()
+                if ctx.action == 'upgrade' and ctx.attributes_cache:
+                    # The cached attributes follow the files migrated into the DRS tree
+                    ctx.attributes_cache.relocate((leaf.src, leaf.dst) for leaf in tree.leaves('files')
+                                                  if leaf.mode in ['move', 'link'])
+        finally:
+            # Remove the plan of a failed scan once used
+            tree.store.discard()
     # Evaluate errors and exit with appropriated return code
     if ctx.scan_errors > 0:
         sys.exit(ctx.scan_errors)
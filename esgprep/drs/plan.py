@@ -0,0 +1,450 @@
+# -*- coding: utf-8 -*-
+
+"""
+    :platform: Unix
+    :synopsis: On-disk store of the DRS tree planned by esgdrs.
+
+"""
+
+import getpass
+import glob
+import hashlib
+import os
+import pickle
+import re
+import sqlite3
+import tempfile
+
+from constants import PLAN_STORE, PLAN_STORE_TIMEOUT, PLAN_SEPARATOR, PLAN_SCHEMA
+from esgprep.utils.checksums import ChecksumsIndex
+
+
+def canonical(value):
+    """
+    Returns a representation of an argument value that does not depend on the dictionaries ordering.
+
+    :param object value: The argument value
+    :returns: The canonical value
+    :rtype: *object*
+
+    """
+    if isinstance(value, dict):
+        return sorted((k, canonical(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [canonical(v) for v in value]
+    if isinstance(value, ChecksumsIndex):
+        # The checksums files content is part of the plan signature (see plan_signature())
+        return value.sources or value.path
+    return value
+
+
+def plan_signature(args):
+    """
+    Returns the signature of the plan inputs other than the arguments, i.e., the plan schema and the content of the
+    checksums files. A plan with the same arguments but another signature is superseded.
+
+    :param dict args: The controlled arguments values
+    :returns: The plan signature
+    :rtype: *str*
+
+    """
+    signature = hashlib.sha1()
+    signature.update('schema={}\n'.format(PLAN_SCHEMA))
+    for name in sorted(args):
+        if isinstance(args[name], ChecksumsIndex):
+            # The index path hashes the checksums files paths, sizes and modification times
+            signature.update('{}={}\n'.format(name, args[name].path))
+    return signature.hexdigest()
+
+
+def directories_key(directories):
+    """
+    Returns a key of the incoming directories that does not depend on their ordering or symbolic links.
+
+    :param list directories: The incoming directories
+    :returns: The directories key
+    :rtype: *str*
+
+    """
+    return hashlib.sha1('\n'.join(sorted(os.path.realpath(directory) for directory in directories))).hexdigest()
+
+
+def plan_store_path(args):
+    """
+    Returns the plan store path of a run, keyed by the incoming directories, the controlled arguments and the plan
+    signature. Two runs with different incoming directories or arguments never share the same plan store.
+
+    :param dict args: The controlled arguments values, including the incoming directories
+    :returns: The plan store path
+    :rtype: *str*
+
+    """
+    args = dict(args)
+    args['directory'] = sorted(os.path.realpath(directory) for directory in args['directory'])
+    key = hashlib.sha1()
+    for name in sorted(args):
+        key.update('{}={!r}\n'.format(name, canonical(args[name])))
+    return os.path.join(tempfile.gettempdir(), PLAN_STORE.format(getpass.getuser(), directories_key(args['directory']),
+                                                                  key.hexdigest(), plan_signature(args)))
+
+
+def regexp(pattern, key):
+    """
+    Searches a regular expression into the path of a tree leaf, as the SQLite ``REGEXP`` operator.
+
+    :param str pattern: The regular expression
+    :param str key: The leaf key
+    :returns: True if the pattern is found into the leaf path
+    :rtype: *boolean*
+
+    """
+    if pattern not in PATTERNS:
+        PATTERNS[pattern] = re.compile(pattern)
+    return PATTERNS[pattern].search(os.path.join(*key.split(PLAN_SEPARATOR))) is not None
+
+
+# Compiled regular expressions of the REGEXP operator
+PATTERNS = dict()
+
+
+def merge_summaries(summary, other):
+    """
+    Merges two summaries of the same dataset.
+
+    :param tuple summary: The latest versions, number of files, size, duplicate flag and dataset roots
+    :param tuple other: The summary to merge
+    :returns: The merged summary
+    :rtype: *tuple*
+
+    """
+    return (min(summary[0], other[0]), max(summary[1], other[1]), summary[2] + other[2], summary[3] + other[3],
+            min(summary[4], other[4]), min(summary[5], other[5]), max(summary[6], other[6]))
+
+
+class PlanStore(object):
+    """
+    SQLite store of the DRS tree planned by an esgdrs run.
+
+    The tree leaves are indexed by their path components to be streamed in a depth-first order, and the dataset
+    entries are indexed by dataset to be summarized on the fly. A new plan is written into a temporary database
+    that replaces the previous plan of the same run only once complete.
+    Only the database path is pickled, each process opens its own connection on first use.
+
+    :param str path: The plan store path
+    :param boolean create: True to start a new plan replacing the existing one on :func:`publish`
+    :returns: The plan store
+    :rtype: *PlanStore*
+
+    """
+
+    def __init__(self, path, create=False):
+        self.path = os.path.abspath(path)
+        self.target = self.path
+        if create:
+            self.path = '{}.{}.tmp'.format(self.target, os.getpid())
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        self._db = None
+        self._pid = None
+
+    def __getstate__(self):
+        # Never pickle the database connection
+        return {'path': self.path, 'target': self.target}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._db = None
+        self._pid = None
+
+    def __eq__(self, other):
+        return isinstance(other, PlanStore) and self.target == other.target
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def connect(self):
+        """
+        Opens the database connection of the current process, creating the tables if needed.
+
+        :returns: The database connection
+        :rtype: *sqlite3.Connection*
+
+        """
+        if self._db is None or self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, timeout=PLAN_STORE_TIMEOUT, check_same_thread=False)
+            self._db.text_factory = str
+            self._db.execute('PRAGMA synchronous = OFF')
+            self._db.create_function('REGEXP', 2, regexp)
+            self._db.execute('CREATE TABLE IF NOT EXISTS meta ('
+                             'name TEXT PRIMARY KEY, '
+                             'value BLOB NOT NULL)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS files ('
+                             'path TEXT PRIMARY KEY, '
+                             'inode INTEGER NOT NULL, '
+                             'size INTEGER NOT NULL, '
+                             'mtime REAL NOT NULL, '
+                             'record BLOB NOT NULL)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS leaves ('
+                             'key TEXT PRIMARY KEY, '
+                             'label TEXT NOT NULL, '
+                             'src TEXT NOT NULL, '
+                             'mode TEXT NOT NULL, '
+                             'origin TEXT, '
+                             'phase TEXT NOT NULL)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                             'dataset TEXT NOT NULL, '
+                             'filename TEXT NOT NULL, '
+                             'size INTEGER NOT NULL, '
+                             'is_duplicate INTEGER NOT NULL, '
+                             'latest TEXT NOT NULL, '
+                             'dset_root TEXT NOT NULL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS entries_dataset ON entries (dataset)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS datasets ('
+                             'dataset TEXT PRIMARY KEY, '
+                             'latest_min TEXT NOT NULL, '
+                             'latest_max TEXT NOT NULL, '
+                             'files INTEGER NOT NULL, '
+                             'size INTEGER NOT NULL, '
+                             'all_duplicates INTEGER NOT NULL, '
+                             'dset_root_min TEXT NOT NULL, '
+                             'dset_root_max TEXT NOT NULL)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS duplicates ('
+                             'path TEXT NOT NULL)')
+            self._pid = os.getpid()
+        return self._db
+
+    def publish(self):
+        """
+        Commits the plan and atomically replaces the previous plan of the same run.
+        The plans of the same run with another signature are superseded and removed.
+        The new plan is discarded if it cannot be published.
+
+        """
+        if self.path != self.target:
+            try:
+                self.connect().commit()
+                os.rename(self.path, self.target)
+            except BaseException:
+                self.discard()
+                raise
+            self.path = self.target
+            self.remove_superseded()
+        else:
+            self.connect().commit()
+
+    def discard(self):
+        """
+        Removes a new plan that is not published, the previous plan of the same run is kept.
+
+        """
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        if self.path != self.target and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def remove_superseded(self):
+        """
+        Removes the plan stores of the same run with another signature (i.e., plan schema or checksums files).
+        A concurrent run still reading a removed plan keeps its open file.
+
+        """
+        prefix = self.target.rsplit('-', 1)[0]
+        for path in glob.glob('{}-*.db'.format(prefix)):
+            if path != self.target:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def get(self, name, default=None):
+        """
+        Gets a plan value.
+
+        :param str name: The value name
+        :param object default: The value returned if not recorded
+        :returns: The value
+        :rtype: *object*
+
+        """
+        row = self.connect().execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return pickle.loads(str(row[0])) if row else default
+
+    def set(self, name, value):
+        """
+        Records a plan value.
+
+        :param str name: The value name
+        :param object value: The value
+
+        """
+        self.connect().execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                               (name, sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))))
+
+    def add_files(self, files):
+        """
+        Records the scanned files.
+
+        :param iterator files: The file full paths, stat signatures and records
+
+        """
+        self.connect().executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                                   ((ffp, inode, size, mtime,
+                                     sqlite3.Binary(pickle.dumps(record, pickle.HIGHEST_PROTOCOL)))
+                                    for ffp, (inode, size, mtime), record in files))
+
+    def files(self):
+        """
+        Yields the scanned files.
+
+        :returns: The file full paths, stat signatures and records
+
+        """
+        for ffp, inode, size, mtime, record in self.connect().execute('SELECT * FROM files'):
+            yield ffp, (inode, size, mtime), pickle.loads(str(record))
+
+    def add_leaf(self, components, label, src, mode, origin=None, force=False, phase=None):
+        """
+        Records a tree leaf.
+
+        :param list components: The leaf path components
+        :param str label: The leaf label
+        :param str src: The source of the leaf
+        :param str mode: The migration mode
+        :param str origin: The original file full path used for the leaf source
+        :param boolean force: Overwrite the leaf if True and the leaf exists
+        :param str phase: The upgrade phase of the leaf
+
+        """
+        statement = 'INSERT OR {} INTO leaves VALUES (?, ?, ?, ?, ?, ?)'.format('REPLACE' if force else 'IGNORE')
+        self.connect().execute(statement, (PLAN_SEPARATOR.join(components), label, src, mode, origin, phase))
+
+    def leaves(self, prefix=None, phase=None, pattern=None, after=None):
+        """
+        Yields the tree leaves in a depth-first order with children sorted by name.
+
+        :param list prefix: The path components of the directory to restrict to
+        :param str phase: The upgrade phase to restrict to
+        :param str pattern: The regular expression to search into the leaf paths
+        :param list after: The path components of a node to start after, skipping its subtree
+        :returns: The leaf path components, label, source, migration mode, origin and upgrade phase
+
+        """
+        conditions, values = list(), list()
+        if prefix:
+            key = PLAN_SEPARATOR.join(prefix)
+            conditions.append('key > ? AND key < ?')
+            values.extend([key + PLAN_SEPARATOR, key + chr(ord(PLAN_SEPARATOR) + 1)])
+        if phase:
+            conditions.append('phase = ?')
+            values.append(phase)
+        if pattern:
+            conditions.append('key REGEXP ?')
+            values.append(pattern)
+        if after:
+            conditions.append('key >= ?')
+            values.append(PLAN_SEPARATOR.join(after) + chr(ord(PLAN_SEPARATOR) + 1))
+        statement = 'SELECT * FROM leaves'
+        if conditions:
+            statement += ' WHERE {}'.format(' AND '.join(conditions))
+        for row in self.connect().execute(statement + ' ORDER BY key', values):
+            yield (row[0].split(PLAN_SEPARATOR),) + row[1:]
+
+    def has_next_sibling(self, components, pattern=None):
+        """
+        Returns True if a node has a next sibling in the depth-first order.
+
+        :param list components: The node path components
+        :param str pattern: The regular expression to search into the leaf paths
+        :returns: True if the node is not the last child of its parent
+        :rtype: *boolean*
+
+        """
+        upper = chr(ord(PLAN_SEPARATOR) + 1)
+        statement = 'SELECT 1 FROM leaves WHERE key >= ? AND key < ?'
+        values = [PLAN_SEPARATOR.join(components) + upper, PLAN_SEPARATOR.join(components[:-1]) + upper]
+        if pattern:
+            statement += ' AND key REGEXP ?'
+            values.append(pattern)
+        row = self.connect().execute(statement + ' LIMIT 1', values).fetchone()
+        return row is not None
+
+    def add_entries(self, entries):
+        """
+        Records the dataset entries of the incoming files and updates the dataset summaries.
+
+        :param list entries: The dataset paths and the incoming file records
+
+        """
+        db = self.connect()
+        # Summarize the entries per dataset while recorded
+        summaries = dict()
+
+        def rows():
+            for dataset, record in entries:
+                summary = (record['latest'], record['latest'], 1, record['size'], int(record['is_duplicate']),
+                           record['dset_root'], record['dset_root'])
+                if dataset in summaries:
+                    summary = merge_summaries(summaries[dataset], summary)
+                summaries[dataset] = summary
+                yield (dataset, record['filename'], record['size'], record['is_duplicate'], record['latest'],
+                       record['dset_root'])
+
+        db.executemany('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)', rows())
+        for dataset, summary in summaries.items():
+            row = db.execute('SELECT latest_min, latest_max, files, size, all_duplicates, dset_root_min, '
+                             'dset_root_max FROM datasets WHERE dataset = ?', (dataset,)).fetchone()
+            if row:
+                summary = merge_summaries(row, summary)
+            db.execute('INSERT OR REPLACE INTO datasets VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (dataset,) + summary)
+
+    def datasets(self):
+        """
+        Yields the dataset summaries sorted by dataset path.
+
+        :returns: The dataset path, latest versions, number of files, size and duplicate flag and the dataset root
+
+        """
+        for row in self.connect().execute('SELECT * FROM datasets ORDER BY dataset'):
+            yield row
+
+    def filenames(self, dataset):
+        """
+        Returns the incoming filenames of a dataset.
+
+        :param str dataset: The dataset path
+        :returns: The filenames
+        :rtype: *list*
+
+        """
+        return [row[0] for row in self.connect().execute('SELECT filename FROM entries WHERE dataset = ?',
+                                                         (dataset,))]
+
+    def dataset_width(self):
+        """
+        Returns the length of the longest dataset path.
+
+        :returns: The maximum length, None if no dataset
+        :rtype: *int*
+
+        """
+        return self.connect().execute('SELECT MAX(LENGTH(dataset)) FROM datasets').fetchone()[0]
+
+    def add_duplicates(self, duplicates):
+        """
+        Records the duplicated incoming files to remove.
+
+        :param list duplicates: The file full paths
+
+        """
+        self.connect().executemany('INSERT INTO duplicates VALUES (?)', ((ffp,) for ffp in duplicates))
+
+    def duplicates(self):
+        """
+        Yields the duplicated incoming files to remove in their recording order.
+
+        :returns: The file full path
+
+        """
+        for row in self.connect().execute('SELECT path FROM duplicates ORDER BY rowid'):
+            yield row[0]
@@ -9,6 +9,7 @@
 from argparse import FileType
 
 from esgprep.checkvocab.main import run
+from esgprep.utils.cache import default_cache_path
 from esgprep.utils.help import *
 from utils.constants import *
 from utils.parser import *
@@ -90,6 +91,11 @@ def get_args():
         type=str,
         required=True,
         help=PROJECT_HELP['checkvocab'])
+    main.add_argument(
+        '--leaf-directories',
+        action='store_true',
+        default=False,
+        help=LEAF_DIRECTORIES_HELP)
     main.add_argument(
         '--set-key',
         metavar='FACET_KEY=ATTRIBUTE',
@@ -114,6 +120,18 @@ def get_args():
         type=regex_validator,
         action='append',
         help=EXCLUDE_FILE_HELP)
+    main.add_argument(
+        '--attributes-cache',
+        metavar='DB_FILE',
+        type=str,
+        nargs='?',
+        const=default_cache_path(),
+        help=ATTRIBUTES_CACHE_HELP)
+    main.add_argument(
+        '--prune-attributes-cache',
+        action='store_true',
+        default=False,
+        help=PRUNE_ATTRIBUTES_CACHE_HELP)
     main.add_argument(
         '--max-processes',
         metavar='4',
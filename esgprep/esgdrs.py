@@ -10,6 +10,7 @@
 from argparse import FileType
 
 from esgprep.drs.main import run
+from esgprep.utils.cache import default_cache_path
 from esgprep.utils.help import *
 from utils.constants import *
 from utils.parser import *
@@ -121,11 +122,21 @@ def get_args():
         action='store_true',
         default=False,
         help=OVERWRITE_COMMANDS_FILE_HELP)
+    parent.add_argument(
+        '--commands-script',
+        action='store_true',
+        default=False,
+        help=COMMANDS_SCRIPT_HELP)
     parent.add_argument(
         '--upgrade-from-latest',
         action='store_true',
         default=False,
         help=UPGRADE_FROM_LATEST_HELP)
+    parent.add_argument(
+        '--staging',
+        action='store_true',
+        default=False,
+        help=STAGING_HELP)
     parent.add_argument(
         '--ignore-from-latest',
         metavar='TXT_FILE',
@@ -162,12 +173,40 @@ def get_args():
         metavar='CHECKSUM_FILE',
         type=FileType('r'),
         help=CHECKSUMS_FROM_HELP)
+    parent.add_argument(
+        '--checksums-to',
+        metavar='CHECKSUM_FILE',
+        type=str,
+        help=CHECKSUMS_TO_HELP)
+    parent.add_argument(
+        '--latest-mapfiles',
+        metavar='MAPFILES_DIR',
+        action=DirectoryChecker,
+        help=LATEST_MAPFILES_HELP)
+    parent.add_argument(
+        '--attributes-cache',
+        metavar='DB_FILE',
+        type=str,
+        nargs='?',
+        const=default_cache_path(),
+        help=ATTRIBUTES_CACHE_HELP)
+    parent.add_argument(
+        '--prune-attributes-cache',
+        action='store_true',
+        default=False,
+        help=PRUNE_ATTRIBUTES_CACHE_HELP)
     parent.add_argument(
         '--max-processes',
         metavar='4',
         type=processes_validator,
         default=4,
         help=MAX_PROCESSES_HELP)
+    parent.add_argument(
+        '--max-threads',
+        metavar='1',
+        type=processes_validator,
+        default=1,
+        help=MAX_THREADS_HELP)
     group = parent.add_mutually_exclusive_group(required=False)
     group.add_argument(
         '--color',
@@ -199,6 +238,16 @@ def get_args():
         parents=[parent])
     tree._optionals.title = OPTIONAL
     tree._positionals.title = POSITIONAL
+    tree.add_argument(
+        '--dataset',
+        metavar='REGEX',
+        type=regex_validator,
+        help=TREE_DATASET_HELP)
+    tree.add_argument(
+        '--depth',
+        metavar='N',
+        type=depth_validator,
+        help=TREE_DEPTH_HELP)
     # Subparser for "esgdrs todo"
     todo = subparsers.add_parser(
         'todo',
@@ -221,6 +270,11 @@ def get_args():
         parents=[parent])
     upgrade._optionals.title = OPTIONAL
     upgrade._positionals.title = POSITIONAL
+    upgrade.add_argument(
+        '--rollback',
+        action='store_true',
+        default=False,
+        help=ROLLBACK_HELP)
     main.set_default_subparser('list')
     return main.prog, main.parse_args()
 
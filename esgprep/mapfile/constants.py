@@ -34,6 +34,9 @@ PROCESS_VARS = ['project',
 # Mapfile extension during processing
 WORKING_EXTENSION = '.part'
 
+# Number of files sampled to estimate the bytes to checksum
+SIZE_SAMPLE = 64
+
 # Source type label
 SOURCE_TYPE = {
     'file': 'file(s)',
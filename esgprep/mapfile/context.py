@@ -7,12 +7,13 @@
 """
 
 import fnmatch
+import itertools
 
 from constants import *
 from esgprep.utils.collectors import VersionedPathCollector, DatasetCollector
 from esgprep.utils.context import MultiprocessingContext
 from esgprep.utils.custom_print import *
-from esgprep.utils.misc import load_checksums
+from esgprep.utils.misc import load_checksums, get_known_checksum
 
 
 class ProcessingContext(MultiprocessingContext):
@@ -109,8 +110,32 @@ class ProcessingContext(MultiprocessingContext):
             self.pattern = self.cfg.translate('dataset_id', add_ending_version=True, sep='.')
         # Get number of sources
         self.nbsources = len(self.sources)
+        # Estimate the bytes to checksum
+        size = None
+        if self.source_type == 'file' and self.action == 'make' and not self.no_checksum:
+            size = self.estimate_size()
+        self.select_executor(size=size)
         return self
 
+    def estimate_size(self):
+        """
+        Estimates the bytes to checksum from the first files only, to avoid walking the whole tree again.
+        The files with a checksum submitted by "--checksums-from" are not checksummed.
+
+        :returns: The estimated bytes to checksum
+        :rtype: *int*
+
+        """
+        sizes = list()
+        for ffp in itertools.islice(self.sources, SIZE_SAMPLE):
+            if get_known_checksum(ffp, self.checksum_type, self.checksums_from):
+                sizes.append(0)
+            else:
+                sizes.append(os.path.getsize(ffp))
+        if not sizes:
+            return 0
+        return sum(sizes) * self.nbsources / len(sizes)
+
     def __exit__(self, exc_type, exc_val, traceback):
         if self.action == 'show':
             msg = 'Mapfile(s) to be generated: {}'.format(self.nbmap)
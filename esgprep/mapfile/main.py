@@ -8,7 +8,6 @@
 
 import itertools
 import traceback
-from multiprocessing import Pool
 
 from ESGConfigParser import interpolate, MissingPatternKey, BadInterpolation, InterpolationDepthError
 from lockfile import LockFile
@@ -250,8 +249,8 @@ def run(args):
         cctx = {name: getattr(ctx, name) for name in PROCESS_VARS}
         # Init progress bar
         if ctx.use_pool:
-            # Init processes pool
-            pool = Pool(processes=ctx.processes, initializer=initializer, initargs=(cctx.keys(), cctx.values()))
+            # Init pool of workers
+            pool = ctx.pool(initializer, (cctx.keys(), cctx.values()))
             processes = pool.imap(process, ctx.sources)
         else:
             initializer(cctx.keys(), cctx.values())
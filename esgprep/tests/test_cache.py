@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""
+    :platform: Unix
+    :synopsis: Tests of the persistent cache of netCDF global attributes.
+
+"""
+
+import os
+import pickle
+from collections import OrderedDict
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from esgprep.utils.cache import AttributesCache
+
+ATTRIBUTES = OrderedDict([('project', u'test'), ('frequency', u'mon'), ('realization', 1)])
+
+
+class TestAttributesCache(object):
+
+    def setup(self):
+        self.tmp = os.path.realpath(mkdtemp())
+        self.incoming = os.path.join(self.tmp, 'incoming')
+        self.root = os.path.join(self.tmp, 'root')
+        for directory in [self.incoming, self.root]:
+            os.makedirs(directory)
+        self.cache = AttributesCache(os.path.join(self.tmp, 'cache.db'))
+
+    def teardown(self):
+        rmtree(self.tmp)
+
+    def create(self, filename, content='data'):
+        path = os.path.join(self.incoming, filename)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def paths(self):
+        return sorted(row[0] for row in self.cache.connect().execute('SELECT path FROM attributes'))
+
+    def test_get_set(self):
+        path = self.create('tas.nc')
+        assert self.cache.get(path) is None
+        self.cache.set(path, ATTRIBUTES)
+        assert self.cache.get(path) == ATTRIBUTES
+        assert self.cache.get(path).keys() == ATTRIBUTES.keys()
+        # Shared with the other processes through the database
+        assert pickle.loads(pickle.dumps(self.cache)).get(path) == ATTRIBUTES
+
+    def test_modified_file(self):
+        path = self.create('tas.nc')
+        self.cache.set(path, ATTRIBUTES)
+        self.create('tas.nc', 'modified data')
+        assert self.cache.get(path) is None
+
+    def test_moved_file(self):
+        path = self.create('tas.nc')
+        self.cache.set(path, ATTRIBUTES)
+        moved = os.path.join(self.root, 'tas.nc')
+        os.rename(path, moved)
+        # Found by inode under its new path
+        assert self.cache.get(moved) == ATTRIBUTES
+        assert self.paths() == [moved]
+        assert self.cache.prune() == 0
+        assert self.cache.get(moved) == ATTRIBUTES
+
+    def test_relocate(self):
+        moved, linked = self.create('tas.nc'), self.create('pr.nc')
+        for path in [moved, linked]:
+            self.cache.set(path, ATTRIBUTES)
+        os.rename(moved, os.path.join(self.root, 'tas.nc'))
+        os.link(linked, os.path.join(self.root, 'pr.nc'))
+        os.remove(linked)
+        self.cache.relocate([(moved, os.path.join(self.root, 'tas.nc')), (linked, os.path.join(self.root, 'pr.nc'))])
+        assert self.paths() == [os.path.join(self.root, 'pr.nc'), os.path.join(self.root, 'tas.nc')]
+        assert self.cache.prune() == 0
+
+    def test_prune(self):
+        kept, deleted, modified, replaced = [self.create(filename) for filename in ['a.nc', 'b.nc', 'c.nc', 'd.nc']]
+        for path in [kept, deleted, modified, replaced]:
+            self.cache.set(path, ATTRIBUTES)
+        os.remove(deleted)
+        self.create('c.nc', 'modified data')
+        # Another file under the same path
+        os.remove(replaced)
+        os.rename(self.create('e.nc'), replaced)
+        assert self.cache.prune() == 3
+        assert self.paths() == [kept]
+        assert self.cache.get(kept) == ATTRIBUTES
+
+    def test_closest(self):
+        assert self.cache.get_closest('institute', ['institution', 'model']) is None
+        self.cache.set_closest('institute', ['model', 'institution'], ('institution', 90))
+        assert self.cache.get_closest('institute', ['institution', 'model']) == ('institution', 90)
+        assert self.cache.get_closest('institute', ['institution']) is None
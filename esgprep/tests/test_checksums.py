@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""
+    :platform: Unix
+    :synopsis: Tests of the checksums files parsing and of their index.
+
+"""
+
+import glob
+import os
+import tempfile
+from StringIO import StringIO
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from esgprep.utils.checksums import ChecksumsIndex, parse_checksum_line
+
+CHECKSUM = '9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08'
+
+
+class TestChecksumLine(object):
+
+    def test_mapfile(self):
+        line = 'test.IPSL.v1 | /data/tas.nc | 1024 | mod_time=1.0 | checksum={} | checksum_type=SHA256\n'
+        assert parse_checksum_line(line.format(CHECKSUM)) == ('/data/tas.nc', CHECKSUM)
+        assert parse_checksum_line('test.IPSL.v1 | /data/tas.nc | 1024 | mod_time=1.0\n') is None
+
+    def test_bsd(self):
+        line = 'SHA256 (/data/my tas.nc) = {}\n'.format(CHECKSUM)
+        assert parse_checksum_line(line) == ('/data/my tas.nc', CHECKSUM)
+
+    def test_sum(self):
+        assert parse_checksum_line('{}  /data/my tas.nc\n'.format(CHECKSUM)) == ('/data/my tas.nc', CHECKSUM)
+        # Binary mode
+        assert parse_checksum_line('{} */data/tas.nc\n'.format(CHECKSUM)) == ('/data/tas.nc', CHECKSUM)
+
+    def test_csv(self):
+        assert parse_checksum_line('/data/tas,v1.nc, {}\n'.format(CHECKSUM)) == ('/data/tas,v1.nc', CHECKSUM)
+        assert parse_checksum_line('/data/tas.nc,not-a-checksum\n') is None
+
+    def test_ignored(self):
+        for line in ['\n', '   \n', '# {}  /data/tas.nc\n'.format(CHECKSUM), 'no checksum here\n']:
+            assert parse_checksum_line(line) is None
+
+
+class TestChecksumsIndex(object):
+
+    def setup(self):
+        self.tmp = mkdtemp()
+        self.tempdir = tempfile.tempdir
+        tempfile.tempdir = self.tmp
+        self.source = os.path.join(self.tmp, 'checksums.txt')
+        self.write(['{}  /data/tas.nc'.format(CHECKSUM)])
+
+    def teardown(self):
+        tempfile.tempdir = self.tempdir
+        rmtree(self.tmp)
+
+    def write(self, lines, mtime=None):
+        with open(self.source, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        if mtime:
+            os.utime(self.source, (mtime, mtime))
+
+    def indexes(self):
+        return glob.glob(os.path.join(self.tmp, 'esgprep-checksums-*.db'))
+
+    def test_lookup(self):
+        self.write(['{}  /data/tas.nc'.format('0' * 64),
+                    'SHA256 (/data/pr.nc) = {}'.format(CHECKSUM.upper()),
+                    '{}  /data/tas.nc'.format(CHECKSUM)])
+        index = ChecksumsIndex([self.source])
+        # The last checksum of a path wins
+        assert index['/data/tas.nc'] == CHECKSUM
+        assert index.get('/data/pr.nc') == CHECKSUM
+        assert '/data/ta.nc' not in index
+
+    def test_reuse(self):
+        index = ChecksumsIndex([self.source])
+        inode = os.stat(index.path).st_ino
+        other = ChecksumsIndex([self.source])
+        assert other == index
+        assert os.stat(other.path).st_ino == inode
+        assert self.indexes() == [index.path]
+
+    def test_invalidation(self):
+        index = ChecksumsIndex([self.source])
+        self.write(['{}  /data/pr.nc'.format(CHECKSUM)], mtime=os.stat(self.source).st_mtime + 10)
+        other = ChecksumsIndex([self.source])
+        assert other != index
+        assert '/data/pr.nc' in other and '/data/tas.nc' not in other
+        # The superseded index of the same sources is removed
+        assert self.indexes() == [other.path]
+
+    def test_stream(self):
+        index = ChecksumsIndex([self.source])
+        first = ChecksumsIndex(stream=StringIO('{}  /data/tas.nc\n'.format(CHECKSUM)))
+        second = ChecksumsIndex(stream=StringIO('{}  /data/pr.nc\n'.format(CHECKSUM)))
+        assert first != second
+        assert '/data/tas.nc' in first and '/data/pr.nc' in second
+        # Concurrent streams never supersede each other nor the indexes of checksums files
+        assert sorted(self.indexes()) == sorted([index.path, first.path, second.path])
+        assert ChecksumsIndex(stream=StringIO('{}  /data/tas.nc\n'.format(CHECKSUM))) == first
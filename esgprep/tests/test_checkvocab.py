@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+"""
+    :platform: Unix
+    :synopsis: Tests of the facet values harvested by chunks of sources.
+
+"""
+
+import os
+import sys
+from shutil import rmtree
+from subprocess import call
+from tempfile import mkdtemp
+
+from esgprep.checkvocab import main
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+PACKAGE_DIR = os.path.dirname(os.path.dirname(TEST_DIR))
+
+PROJECT_INI = """[project:test]
+categories =
+    project | enum | true | true | 0
+    institute | enum | true | true | 1
+    model | enum | true | true | 2
+    experiment | enum | true | true | 3
+    variable | enum | true | true | 4
+project_options = test | test | 1
+institute_options = IPSL
+model_options = M1
+experiment_options =
+    test | historical | Historical
+variable_options = tas, pr
+directory_format = %(root)s/%(project)s/%(institute)s/%(model)s/%(experiment)s/%(variable)s/%(version)s
+filename_format = %(variable)s_%(model)s_%(experiment)s[_%(period_start)s-%(period_end)s].nc
+dataset_id = %(project)s.%(institute)s.%(model)s.%(experiment)s.%(variable)s
+"""
+
+# Runs esgcheckvocab with another number of sources per chunk
+CHUNKED = """
+import sys
+from esgprep.checkvocab import main as checkvocab
+checkvocab.CHUNKSIZE = int(sys.argv.pop(1))
+from esgprep.esgcheckvocab import main
+main()
+"""
+
+PATTERN = '/(?P<project>[\w]+)/(?P<institute>[\w]+)/(?P<variable>[\w]+)/(?P<filename>[\w.]+)$'
+
+
+class TestChunkedHarvest(object):
+
+    def setup(self):
+        self.tmp = mkdtemp()
+        self.ini = os.path.join(self.tmp, 'ini')
+        self.root = os.path.join(self.tmp, 'root')
+        os.makedirs(self.ini)
+        with open(os.path.join(self.ini, 'esg.ini'), 'w') as f:
+            f.write('[DEFAULT]\n')
+        with open(os.path.join(self.ini, 'esg.test.ini'), 'w') as f:
+            f.write(PROJECT_INI)
+        for variable in ['tas', 'pr', 'psl']:
+            for period in range(1, 5):
+                self.create('test/IPSL/M1/historical/{0}/v1/{0}_M1_historical_{1}0001-{1}0012.nc'.format(variable,
+                                                                                                         period))
+        # Does not match the directory format
+        self.create('test/IPSL/M1/x.nc')
+
+    def teardown(self):
+        rmtree(self.tmp)
+
+    def create(self, path):
+        path = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, 'w').close()
+
+    def esgcheckvocab(self, chunksize, processes):
+        output = os.path.join(self.tmp, 'output.txt')
+        env = dict(os.environ, PYTHONPATH=PACKAGE_DIR)
+        args = ['-i', self.ini, '-p', 'test', '--directory', self.root, '--no-color', '--max-processes', processes]
+        with open(output, 'w') as out:
+            code = call([sys.executable, '-c', CHUNKED, str(chunksize)] + args, env=env, stdout=out, stderr=out)
+        with open(output) as f:
+            return code, f.read()
+
+    def test_chunks(self):
+        for chunksize in [1, 3, main.CHUNKSIZE]:
+            for processes in ['1', '2']:
+                code, output = self.esgcheckvocab(chunksize, processes)
+                # The facet values and the errors of all the chunks are merged
+                assert code == 1
+                assert 'Number of file(s) scanned: 12' in output
+                assert 'Number of error(s): 1' in output
+                assert output.count(':: FAIL    :: ') == 1
+                assert ':: UNDECLARED VALUES :: variable :: psl' in output
+                assert ':: UPDATED VALUES    :: variable :: pr, psl, tas' in output
+                # The progress is updated once per chunk
+                assert output.count('/13 file(s)') == -(-13 // chunksize)
+
+    def test_process(self):
+        main.initializer(['directory', 'dataset_id', 'dataset_list', 'pattern', 'facets', 'set_keys',
+                          'attributes_cache'],
+                         [[self.root], None, None, PATTERN, ['institute', 'variable'], dict(), None])
+        values, succeeded, failed = main.process(['/test/IPSL/tas/tas_1.nc',
+                                                  '/test/IPSL/tas/tas_2.nc',
+                                                  '/test/tas_3.nc',
+                                                  '/test/IPSL/pr/pr_1.nc'])
+        assert values == {'institute': {'IPSL'}, 'variable': {'tas', 'pr'}}
+        assert succeeded == ['/test/IPSL/tas/tas_1.nc', '/test/IPSL/tas/tas_2.nc', '/test/IPSL/pr/pr_1.nc']
+        assert [source for source, _ in failed] == ['/test/tas_3.nc']
+        assert failed[0][1][0] == 'Traceback (most recent call last):'
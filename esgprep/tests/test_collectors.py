@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+"""
+    :platform: Unix
+    :synopsis: Tests of the data collectors.
+
+"""
+
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from esgprep.utils import collectors
+from esgprep.utils.collectors import LeafPathCollector, PathCollector
+
+DIR_FORMAT = '/(?P<project>[\w.]+)/(?P<variable>[\w.]+)/(?P<version>v[\d]+)'
+
+
+class TestLeafPathCollector(object):
+
+    def setup(self):
+        self.tmp = mkdtemp()
+        self.root = os.path.join(self.tmp, 'root')
+        for path in ['test/tas/v1/tas_2.nc',
+                     'test/tas/v1/tas_1.nc',
+                     'test/tas/v1/extra/tas_0.nc',
+                     'test/tas/v2/tas_3.nc',
+                     'test/pr/v1/.pr_0.nc',
+                     'test/pr/v1/pr_1.nc',
+                     'test/pr/v1/pr_2.nc',
+                     'test/pr/latest/pr_1.nc',
+                     'test/readme.nc',
+                     'hidden/.tas/v1/tas_1.nc']:
+            self.create(path)
+        self.walked = list()
+
+    def teardown(self):
+        rmtree(self.tmp)
+
+    def create(self, path):
+        path = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, 'w').close()
+
+    def collector(self, monkeypatch, cls=LeafPathCollector, *args):
+        walk = os.walk
+
+        def counted(top, *args, **kwargs):
+            for root, dirnames, filenames in walk(top, *args, **kwargs):
+                self.walked.append(os.path.relpath(root, self.root))
+                yield root, dirnames, filenames
+
+        monkeypatch.setattr(collectors.os, 'walk', counted)
+        return cls(*args, sources=[self.root], spinner=False)
+
+    def collect(self, sources):
+        return [os.path.relpath(ffp, self.root) for ffp in sources]
+
+    def test_leaves(self, monkeypatch):
+        sources = self.collector(monkeypatch, LeafPathCollector, DIR_FORMAT)
+        sources.FileFilter.add(regex='^\..*$', inclusive=False)
+        # Only the first file in filename order of each leaf
+        assert sorted(self.collect(sources)) == ['hidden/.tas/v1/tas_1.nc',
+                                                 'test/pr/v1/pr_1.nc',
+                                                 'test/tas/v1/tas_1.nc',
+                                                 'test/tas/v2/tas_3.nc']
+        # The walk does not go below the leaves
+        assert 'test/tas/v1/extra' not in self.walked
+        assert 'test/tas/v1' in self.walked
+
+    def test_filters(self, monkeypatch):
+        sources = self.collector(monkeypatch, LeafPathCollector, DIR_FORMAT)
+        sources.FileFilter.add(regex='_1\.nc$', inclusive=False)
+        sources.PathFilter.add(regex='/\.[\w]+', inclusive=False)
+        assert sorted(self.collect(sources)) == ['test/pr/v1/.pr_0.nc',
+                                                 'test/tas/v1/tas_2.nc',
+                                                 'test/tas/v2/tas_3.nc']
+        # The excluded leaves are still pruned
+        assert 'hidden/.tas/v1' in self.walked
+        assert len(sources) == 3
+
+    def test_files(self, monkeypatch):
+        sources = self.collector(monkeypatch, PathCollector)
+        # All the files are yielded without leaf pruning
+        assert len(self.collect(sources)) == 10
+        assert 'test/tas/v1/extra' in self.walked
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""
+    :platform: Unix
+    :synopsis: Tests of the writers of the command-lines exported by esgdrs todo.
+
+"""
+
+import os
+import stat
+import threading
+from shutil import rmtree
+from subprocess import call
+from tempfile import mkdtemp
+
+from esgprep.drs.commands import CommandsScript, CommandsWriter
+from esgprep.drs.constants import SCRIPT_HEADER
+
+
+class TestCommandsWriter(object):
+
+    def setup(self):
+        self.tmp = mkdtemp()
+        self.path = os.path.join(self.tmp, 'commands.txt')
+
+    def teardown(self):
+        rmtree(self.tmp)
+
+    def lines(self):
+        with open(self.path) as f:
+            return f.read().splitlines()
+
+    def test_write(self):
+        commands = CommandsWriter(self.path)
+        commands.close()
+        # Only opened on first write
+        assert not os.path.exists(self.path)
+        with open(self.path, 'w') as f:
+            f.write('# Previous commands\n')
+        commands.section('Upgrade phase: files')
+        commands.mkdir('/root/a')
+        commands.write('mv /incoming/a.nc /root/a/a.nc')
+        commands.commit()
+        commands.close()
+        assert self.lines() == ['# Previous commands', 'mkdir -p /root/a', 'mv /incoming/a.nc /root/a/a.nc']
+
+    def test_threads(self):
+        commands = CommandsWriter(self.path)
+
+        def write(index):
+            for line in range(100):
+                commands.write('ln -s {} {}'.format(index, line))
+
+        threads = [threading.Thread(target=write, args=(index,)) for index in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        commands.close()
+        assert sorted(self.lines()) == sorted('ln -s {} {}'.format(i, j) for i in range(8) for j in range(100))
+
+
+class TestCommandsScript(object):
+
+    def setup(self):
+        self.tmp = mkdtemp()
+        self.path = os.path.join(self.tmp, 'commands.sh')
+        self.root = os.path.join(self.tmp, 'root')
+        self.incoming = os.path.join(self.tmp, 'incoming')
+        os.makedirs(self.incoming)
+        for filename in ['a.nc', 'b.nc']:
+            open(os.path.join(self.incoming, filename), 'w').close()
+
+    def teardown(self):
+        rmtree(self.tmp)
+
+    def export(self):
+        commands = CommandsScript(self.path)
+        for phase in ['files', 'version', 'latest']:
+            commands.section('Upgrade phase: {}'.format(phase))
+            for filename in ['a.nc', 'b.nc']:
+                files = os.path.join(self.root, 'files', 'd1')
+                version = os.path.join(self.root, 'v1')
+                if phase == 'files':
+                    commands.mkdir(files)
+                    commands.write('mv {} {}'.format(os.path.join(self.incoming, filename), files))
+                elif phase == 'version':
+                    commands.mkdir(version)
+                    commands.write('rm -f {}'.format(os.path.join(version, filename)))
+                    commands.write('ln -s ../files/d1/{} {}'.format(filename, os.path.join(version, filename)))
+                commands.commit()
+            if phase == 'latest':
+                commands.write('ln -s v1 {}'.format(os.path.join(self.root, 'latest')))
+                commands.commit()
+        commands.section('Removal of the duplicated files')
+        commands.close()
+
+    def test_script(self):
+        self.export()
+        with open(self.path) as f:
+            script = f.read()
+        assert script.startswith(SCRIPT_HEADER)
+        assert os.stat(self.path).st_mode & stat.S_IXUSR
+        # The empty sections are skipped and each directory is created once per section
+        assert script[len(SCRIPT_HEADER):].count('\n# ') == 3
+        assert 'Removal of the duplicated files' not in script
+        assert script.splitlines().count(os.path.join(self.root, 'files', 'd1')) == 1
+        # The command-lines of a leaf are chained on the same line
+        assert 'rm -f {0} && ln -s ../files/d1/a.nc {0}\n'.format(os.path.join(self.root, 'v1', 'a.nc')) in script
+
+    def test_run(self):
+        self.export()
+        with open(os.devnull, 'w') as devnull:
+            assert call([self.path], env=dict(os.environ, JOBS='2'), stdout=devnull, stderr=devnull) == 0
+        assert os.listdir(self.incoming) == list()
+        assert sorted(os.listdir(os.path.join(self.root, 'files', 'd1'))) == ['a.nc', 'b.nc']
+        for filename in ['a.nc', 'b.nc']:
+            assert os.path.isfile(os.path.join(self.root, 'latest', filename))
+        assert os.readlink(os.path.join(self.root, 'latest')) == 'v1'
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+"""
+    :platform: Unix
+    :synopsis: Tests of the file copy methods and of the checksums computed while copying.
+
+"""
+
+import errno
+import hashlib
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import pytest
+
+from esgprep.drs.handler import migrate
+from esgprep.utils import copier
+from esgprep.utils.checksums import ChecksumsWriter, parse_checksum_line
+
+DATA = os.urandom(3 * 1024 * 1024 + 17)
+
+
+class TestCopier(object):
+
+    def setup(self):
+        self.tmp = mkdtemp()
+        self.src = os.path.join(self.tmp, 'src.nc')
+        self.dst = os.path.join(self.tmp, 'dst.nc')
+        with open(self.src, 'wb') as f:
+            f.write(DATA)
+        self.calls = list()
+
+    def teardown(self):
+        rmtree(self.tmp)
+
+    def content(self, path=None):
+        with open(path or self.dst, 'rb') as f:
+            return f.read()
+
+    def unsupported(self, fsrc, fdst, size):
+        self.calls.append('unsupported')
+        raise copier.Unsupported('unsupported')
+
+    def partial(self, fsrc, fdst, size):
+        self.calls.append('partial')
+        # Stops in the middle of the file
+        fdst.write(fsrc.read(size // 2))
+        raise copier.Unsupported('partial')
+
+    def failing(self, fsrc, fdst, size):
+        raise OSError(errno.EIO, 'Input/output error')
+
+    def test_copy(self, monkeypatch):
+        monkeypatch.setattr(copier, 'UNSUPPORTED', set())
+        method, checksum = copier.copyfile(self.src, self.dst)
+        assert method in [m.__name__ for m in copier.METHODS]
+        assert checksum is None
+        assert self.content() == DATA
+
+    def test_fallback(self, monkeypatch):
+        monkeypatch.setattr(copier, 'UNSUPPORTED', set())
+        monkeypatch.setattr(copier, 'METHODS', [self.unsupported, self.partial, copier.userspace])
+        assert copier.copyfile(self.src, self.dst) == ('userspace', None)
+        # The partial copy is restarted from scratch
+        assert self.content() == DATA
+        assert self.calls == ['unsupported', 'partial']
+        devices = (os.stat(self.src).st_dev, os.stat(self.tmp).st_dev)
+        assert copier.UNSUPPORTED == {('unsupported', devices), ('partial', devices)}
+        # The unsupported methods are not tried again between the same devices
+        os.remove(self.dst)
+        assert copier.copyfile(self.src, self.dst) == ('userspace', None)
+        assert self.calls == ['unsupported', 'partial']
+        assert self.content() == DATA
+
+    def test_system_calls_unavailable(self, monkeypatch):
+        monkeypatch.setattr(copier, 'UNSUPPORTED', set())
+        monkeypatch.setattr(copier, 'LIBC', None)
+        method, _ = copier.copyfile(self.src, self.dst)
+        assert method in ['reflink', 'userspace']
+        assert self.content() == DATA
+
+    def test_error(self, monkeypatch):
+        monkeypatch.setattr(copier, 'UNSUPPORTED', set())
+        monkeypatch.setattr(copier, 'METHODS', [self.failing, copier.userspace])
+        # Only the unsupported methods fall back on the next one
+        with pytest.raises(OSError) as error:
+            copier.copyfile(self.src, self.dst)
+        assert error.value.errno == errno.EIO
+        assert copier.UNSUPPORTED == set()
+
+    def test_empty_file(self, monkeypatch):
+        monkeypatch.setattr(copier, 'UNSUPPORTED', set())
+        monkeypatch.setattr(copier, 'METHODS', [self.unsupported, copier.userspace])
+        open(self.src, 'w').close()
+        assert copier.copyfile(self.src, self.dst) == ('userspace', None)
+        assert self.calls == list()
+        assert self.content() == ''
+
+    def test_checksum(self, monkeypatch):
+        monkeypatch.setattr(copier, 'UNSUPPORTED', set())
+        method, checksum = copier.copyfile(self.src, self.dst, 'sha256')
+        assert method in ['reflink', 'userspace']
+        assert checksum == hashlib.sha256(DATA).hexdigest()
+        assert self.content() == DATA
+
+    def test_copy2(self):
+        os.utime(self.src, (1000000000, 1000000000))
+        os.makedirs(os.path.join(self.tmp, 'files'))
+        # Copied into the destination directory
+        assert copier.copy2(self.src, os.path.join(self.tmp, 'files'), 'md5') == hashlib.md5(DATA).hexdigest()
+        dst = os.path.join(self.tmp, 'files', 'src.nc')
+        assert os.stat(dst).st_mtime == 1000000000
+        assert self.content(dst) == DATA
+
+    def test_migrate_checksums(self):
+        checksums = ChecksumsWriter(os.path.join(self.tmp, 'checksums.txt'), 'sha256')
+        os.makedirs(os.path.join(self.tmp, 'files'))
+        dst = os.path.join(self.tmp, 'files', 'dst.nc')
+        migrate(self.src, dst, 'copy', checksums)
+        migrate(self.src, os.path.join(self.tmp, 'files', 'link.nc'), 'link', checksums)
+        checksums.close()
+        assert self.content(dst) == DATA
+        # Only the copied files are recorded
+        with open(checksums.path) as f:
+            assert [parse_checksum_line(line) for line in f] == [(os.path.realpath(dst),
+                                                                  hashlib.sha256(DATA).hexdigest())]
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""
+    :platform: Unix
+    :synopsis: Tests of the directory creation and of the directory-relative links.
+
+"""
+
+import errno
+import os
+import threading
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import pytest
+
+from esgprep.utils import directories
+from esgprep.utils.directories import DirectoryHandles, makedirs
+
+
+class TestMakedirs(object):
+
+    def setup(self):
+        self.tmp = mkdtemp()
+        self.calls = list()
+
+    def teardown(self):
+        rmtree(self.tmp)
+
+    def test_makedirs(self, monkeypatch):
+        mkdir = os.mkdir
+
+        def counted(path, *args):
+            self.calls.append(os.path.relpath(path, self.tmp))
+            return mkdir(path, *args)
+
+        os.makedirs(os.path.join(self.tmp, 'root', 'v1'))
+        monkeypatch.setattr(directories.os, 'mkdir', counted)
+        makedirs([os.path.join(self.tmp, path) for path in ['root/files/d1', 'root/v1', 'root/files', 'root/files/d1',
+                                                            'other/v1']])
+        for path in ['root/files/d1', 'root/v1', 'other/v1']:
+            assert os.path.isdir(os.path.join(self.tmp, path))
+        # Each directory is created once from the shallowest one, the missing parents are created on demand
+        assert self.calls == ['other/v1', 'other', 'other/v1', 'root/files', 'root/v1', 'root/files/d1']
+
+    def test_error(self):
+        open(os.path.join(self.tmp, 'file'), 'w').close()
+        with pytest.raises(OSError) as error:
+            makedirs([os.path.join(self.tmp, 'file', 'v1')])
+        assert error.value.errno == errno.ENOTDIR
+
+
+class TestDirectoryHandles(object):
+
+    def setup(self):
+        self.tmp = mkdtemp()
+        self.files = os.path.join(self.tmp, 'files', 'd1')
+        self.version = os.path.join(self.tmp, 'v1')
+        makedirs([self.files, self.version])
+        self.src = os.path.join(self.files, 'tas.nc')
+        with open(self.src, 'w') as f:
+            f.write('data')
+
+    def teardown(self):
+        rmtree(self.tmp)
+
+    def links(self, handles):
+        dst = os.path.join(self.version, 'tas.nc')
+        handles.symlink('../files/d1/tas.nc', dst)
+        assert os.readlink(dst) == '../files/d1/tas.nc'
+        assert os.path.isfile(dst)
+        handles.link(self.src, os.path.join(self.version, 'tas_link.nc'))
+        assert os.stat(os.path.join(self.version, 'tas_link.nc')).st_nlink == 2
+        # Rename within the same directory
+        handles.rename(os.path.join(self.version, 'tas_link.nc'), os.path.join(self.version, 'tas_renamed.nc'))
+        # Rename from another directory
+        handles.rename(self.src, os.path.join(self.version, 'tas_moved.nc'))
+        assert sorted(os.listdir(self.version)) == ['tas.nc', 'tas_moved.nc', 'tas_renamed.nc']
+        assert os.listdir(self.files) == list()
+
+    @pytest.mark.skipif(not directories.LIBC, reason='Directory-relative system calls not available')
+    def test_links(self):
+        with DirectoryHandles() as handles:
+            self.links(handles)
+            assert len(handles.fds) == 1
+        assert not handles.fds
+
+    def test_without_libc(self, monkeypatch):
+        monkeypatch.setattr(directories, 'LIBC', None)
+        with DirectoryHandles() as handles:
+            self.links(handles)
+            assert not handles.fds
+
+    def test_errors(self):
+        with DirectoryHandles() as handles:
+            handles.symlink('../files/d1/tas.nc', os.path.join(self.version, 'tas.nc'))
+            with pytest.raises(OSError) as error:
+                handles.symlink('../files/d1/tas.nc', os.path.join(self.version, 'tas.nc'))
+            assert error.value.errno == errno.EEXIST
+            assert error.value.filename == os.path.join(self.version, 'tas.nc')
+            with pytest.raises(OSError) as error:
+                handles.link(self.src, os.path.join(self.tmp, 'missing', 'tas.nc'))
+            assert error.value.errno == errno.ENOENT
+
+    @pytest.mark.skipif(not directories.LIBC, reason='Directory-relative system calls not available')
+    def test_cache(self, monkeypatch):
+        monkeypatch.setattr(directories, 'DIRFD_CACHE', 2)
+        with DirectoryHandles() as handles:
+            for index in range(4):
+                makedirs([os.path.join(self.tmp, str(index))])
+                handles.link(self.src, os.path.join(self.tmp, str(index), 'tas.nc'))
+            # The least recently used file descriptors are closed
+            assert len(handles.fds) == 2
+            assert list(handles.local.cache) == [os.path.join(self.tmp, '2'), os.path.join(self.tmp, '3')]
+            # Each thread has its own file descriptors
+            thread = threading.Thread(target=handles.dirfd, args=(self.version,))
+            thread.start()
+            thread.join()
+            assert len(handles.fds) == 3
+        assert not handles.fds
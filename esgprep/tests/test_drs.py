@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+"""
+    :platform: Unix
+    :synopsis: Tests of the staged esgdrs upgrade, its resumption and its rollback.
+
+"""
+
+import os
+import sys
+import uuid
+from shutil import rmtree
+from subprocess import call
+from tempfile import mkdtemp
+
+from netCDF4 import Dataset
+
+from esgprep.utils.cache import AttributesCache
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+PACKAGE_DIR = os.path.dirname(os.path.dirname(TEST_DIR))
+
+INI = """[DEFAULT]
+checksum = sha256sum | SHA256
+"""
+
+PROJECT_INI = """[project:test]
+categories =
+    project | enum | true | true | 0
+    institute | enum | true | true | 1
+    model | enum | true | true | 2
+    experiment | enum | true | true | 3
+    variable | enum | true | true | 4
+project_options = test | test | 1
+institute_options = IPSL
+model_options = M1
+experiment_options =
+    test | historical | Historical
+variable_options = tas, pr
+directory_format = %(root)s/%(project)s/%(institute)s/%(model)s/%(experiment)s/%(variable)s/%(version)s
+filename_format = %(variable)s_%(model)s_%(experiment)s[_%(period_start)s-%(period_end)s].nc
+dataset_id = %(project)s.%(institute)s.%(model)s.%(experiment)s.%(variable)s
+"""
+
+VARIABLES = ['tas', 'pr']
+
+PERIODS = ['185001-189912', '190001-194912']
+
+VERSION = '20200101'
+
+# Interrupts the upgrade once the first staged dataset version is published
+INTERRUPTED = """
+from esgprep.drs.journal import Journal
+record = Journal.record
+def interrupted(self, state, *args):
+    record(self, state, *args)
+    if state == 'publish':
+        raise KeyboardInterrupt
+Journal.record = interrupted
+from esgprep.esgdrs import main
+main()
+"""
+
+
+class TestStagedUpgrade(object):
+
+    def setup(self):
+        self.tmp = mkdtemp()
+        self.ini = os.path.join(self.tmp, 'ini')
+        self.incoming = os.path.join(self.tmp, 'incoming')
+        self.root = os.path.join(self.tmp, 'root')
+        for directory in [self.ini, self.incoming, self.root]:
+            os.makedirs(directory)
+        with open(os.path.join(self.ini, 'esg.ini'), 'w') as f:
+            f.write(INI)
+        with open(os.path.join(self.ini, 'esg.test.ini'), 'w') as f:
+            f.write(PROJECT_INI)
+        for variable in VARIABLES:
+            for period in PERIODS:
+                self.create(variable, period)
+
+    def teardown(self):
+        rmtree(self.tmp)
+
+    def create(self, variable, period):
+        nc = Dataset(os.path.join(self.incoming, '{}_M1_historical_{}.nc'.format(variable, period)), 'w')
+        nc.project = 'test'
+        nc.institute = 'IPSL'
+        nc.model = 'M1'
+        nc.experiment = 'historical'
+        nc.tracking_id = str(uuid.uuid4())
+        nc.createDimension('time', None)
+        nc.createVariable(variable, 'f4', ('time',))[:] = range(10)
+        nc.close()
+
+    def esgdrs(self, args, code='from esgprep.esgdrs import main; main()', output=None):
+        env = dict(os.environ, PYTHONPATH=PACKAGE_DIR, TMPDIR=self.tmp)
+        args = args[:1] + ['-i', self.ini, '-p', 'test', '--root', self.root, self.incoming, '--no-color'] + args[1:]
+        with open(output or os.devnull, 'w') as out:
+            return call([sys.executable, '-c', code] + args, env=env, stdout=out, stderr=out)
+
+    def output(self, args):
+        output = os.path.join(self.tmp, 'output.txt')
+        assert self.esgdrs(args, output=output) == 0
+        with open(output) as f:
+            return f.read()
+
+    def tree(self, args):
+        output = self.output(['tree', '--version', VERSION] + args).decode('utf-8').splitlines()
+        start = [index for index, line in enumerate(output) if line.startswith('---')][0] + 1
+        end = [index for index, line in enumerate(output) if line.startswith('===')][-1]
+        # The node labels with their depth below the root
+        nodes = list()
+        for line in filter(None, output[start:end]):
+            label = line.lstrip(u'\u2502\u251c\u2514\u2500 ')
+            nodes.append(((len(line) - len(label)) // 4, label))
+        return nodes
+
+    def datasets(self):
+        return [os.path.join(self.root, 'test', 'IPSL', 'M1', 'historical', variable) for variable in VARIABLES]
+
+    def journal(self):
+        journals = [path for path in os.listdir(self.root) if path.startswith('.esgdrs-journal-')]
+        assert len(journals) == 1
+        with open(os.path.join(self.root, journals[0])) as f:
+            return [line.rstrip('\n').split('\t') for line in f]
+
+    def last_states(self):
+        return {dataset: state for state, dataset, _, _ in self.journal()}
+
+    def plans(self):
+        return {path: os.stat(os.path.join(self.tmp, path)).st_ino
+                for path in os.listdir(self.tmp) if path.startswith('esgdrs-plan-')}
+
+    def assert_published(self):
+        for dataset in self.datasets():
+            assert sorted(os.listdir(dataset)) == ['files', 'latest', 'v' + VERSION]
+            assert os.readlink(os.path.join(dataset, 'latest')) == 'v' + VERSION
+            assert len(os.listdir(os.path.join(dataset, 'v' + VERSION))) == len(PERIODS)
+        assert self.last_states() == {dataset: 'latest' for dataset in self.datasets()}
+
+    def test_staged_upgrade(self):
+        assert self.esgdrs(['upgrade', '--version', VERSION, '--copy', '--staging', '--max-threads', '4']) == 0
+        self.assert_published()
+        states = [state for state, _, _, _ in self.journal()]
+        assert states == ['stage'] * 2 + ['publish'] * 2 + ['latest'] * 2
+
+    def test_rollback(self):
+        assert self.esgdrs(['upgrade', '--version', VERSION, '--copy', '--staging', '--max-threads', '4']) == 0
+        # The journal is found whatever the other arguments
+        assert self.esgdrs(['upgrade', '--version', '20991231', '--rollback']) == 0
+        for dataset in self.datasets():
+            assert os.listdir(dataset) == ['files']
+            assert len(os.listdir(os.path.join(dataset, 'files', 'd' + VERSION))) == len(PERIODS)
+        assert self.last_states() == {dataset: 'rollback' for dataset in self.datasets()}
+
+    def test_resume_interrupted_upgrade(self):
+        args = ['upgrade', '--version', VERSION, '--copy', '--staging', '--max-threads', '4']
+        assert self.esgdrs(args, code=INTERRUPTED) != 0
+        states = self.last_states()
+        assert sorted(states.values()) == ['publish', 'stage']
+        for dataset in self.datasets():
+            assert not os.path.lexists(os.path.join(dataset, 'latest'))
+            staged = os.path.isdir(os.path.join(dataset, '.v{}.staging'.format(VERSION)))
+            assert staged == (states[dataset] == 'stage')
+        # Rolls forward with the same arguments
+        assert self.esgdrs(args) == 0
+        self.assert_published()
+        # The versions published before and after the interruption are rolled back
+        assert self.esgdrs(['upgrade', '--rollback']) == 0
+        assert self.last_states() == {dataset: 'rollback' for dataset in self.datasets()}
+
+    def test_rescan_interrupted_upgrade(self):
+        args = ['upgrade', '--version', VERSION, '--copy', '--staging', '--max-threads', '4']
+        assert self.esgdrs(args, code=INTERRUPTED) != 0
+        plans = self.plans()
+        # The files of the published dataset version are skipped, the plan of the interrupted upgrade is kept
+        assert self.esgdrs(['list', '--version', VERSION, '--copy', '--rescan']) == 0
+        assert self.plans() == plans
+        # Rolls forward with the same arguments
+        assert self.esgdrs(args) == 0
+        self.assert_published()
+
+    def test_attributes_cache(self):
+        cache = os.path.join(self.tmp, 'cache.db')
+        assert self.esgdrs(['upgrade', '--version', VERSION, '--attributes-cache', cache]) == 0
+        # The cached attributes follow the files moved into the DRS tree
+        cache = AttributesCache(cache)
+        paths = [row[0] for row in cache.connect().execute('SELECT path FROM attributes')]
+        assert len(paths) == len(VARIABLES) * len(PERIODS)
+        assert all(path.startswith(os.path.join(os.path.realpath(self.root), '')) for path in paths)
+        assert cache.prune() == 0
+
+    def test_incremental_scan(self):
+        args = ['list', '--version', VERSION]
+        assert 'Reuse' not in self.output(args)
+        assert 'Reuse 4 unchanged file(s)' in self.output(args)
+        # A modified file and a new file are scanned, the others are reused
+        nc = Dataset(os.path.join(self.incoming, 'tas_M1_historical_{}.nc'.format(PERIODS[0])), 'a')
+        nc.history = 'modified'
+        nc.close()
+        self.create('tas', '195001-199912')
+        output = self.output(args)
+        assert 'Reuse 3 unchanged file(s)' in output
+        assert 'Scanning 2 new or modified file(s)' in output
+        assert 'Reuse' not in self.output(args + ['--rescan'])
+        # The reused results are the ones of a full scan
+        assert self.output(['tree', '--version', VERSION]).count('.nc') == self.output(
+            ['tree', '--version', VERSION, '--rescan']).count('.nc') == 5 * 3
+
+    def test_tree_filters(self):
+        tree = self.tree(list())
+        assert len(tree) == 1 + 4 + 2 * (1 + 8)
+        assert self.tree(['--depth', '1']) == tree[:2]
+        # The branches below the maximum depth are skipped, the siblings are kept
+        assert self.tree(['--depth', '5'])[-3:] == [(4, 'historical'), (5, 'pr'), (5, 'tas')]
+        assert max(depth for depth, _ in self.tree(['--depth', '6'])) == 6
+        assert len(self.tree(['--depth', '6'])) == 1 + 4 + 2 * (1 + 3)
+        # Only the leaves matching the regular expression
+        assert self.tree(['--dataset', '/tas/']) == tree[:5] + tree[tree.index((5, 'tas')):]
+        assert self.tree(['--dataset', '/tas/', '--depth', '6'])[-3:] == [(6, 'files'),
+                                                                         (6, 'latest --> v' + VERSION),
+                                                                         (6, 'v' + VERSION)]
+        files = [label for _, label in self.tree(['--dataset', '_190001-194912\\.nc$']) if '.nc' in label]
+        assert len(files) == 2 * 2
+        assert all('_190001-194912.nc' in label for label in files)
+        assert self.tree(['--dataset', 'unknown']) == [(0, 'Tree is empty')]
+        assert self.esgdrs(['tree', '--depth', '0']) != 0
+        assert self.esgdrs(['tree', '--dataset', '(']) != 0
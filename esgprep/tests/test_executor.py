@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+"""
+    :platform: Unix
+    :synopsis: Tests of the parallel migration of the DRS leaves.
+
+"""
+
+import os
+import threading
+import time
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import pytest
+
+from esgprep.drs.executor import MigrationExecutor
+
+
+class MigrationError(Exception):
+    pass
+
+
+class TestMigrationExecutor(object):
+
+    def setup(self):
+        self.tmp = mkdtemp()
+        self.events = list()
+        self.lock = threading.Lock()
+
+    def teardown(self):
+        rmtree(self.tmp)
+
+    def migrate(self, phase, index, size=1, delay=0, fail=False):
+        with self.lock:
+            self.events.append(('start', phase, index))
+        time.sleep(delay)
+        if fail:
+            raise MigrationError('Leaf {} failed'.format(index))
+        with self.lock:
+            self.events.append(('end', phase, index))
+        return size
+
+    def dst(self, index):
+        return os.path.join(self.tmp, 'dataset', 'v1', '{}.nc'.format(index))
+
+    def test_serial(self):
+        with MigrationExecutor(1) as executor:
+            for index in range(5):
+                executor.submit(self.migrate, self.dst(index), 'files', index, 10)
+            executor.join()
+        # Applied in the submission order
+        assert self.events == [(event, 'files', index) for index in range(5) for event in ['start', 'end']]
+        assert executor.throughput()[:2] == (5, 50)
+        assert not executor.pools
+
+    def test_phases(self):
+        with MigrationExecutor(4) as executor:
+            for phase, delay in [('files', 0.02), ('version', 0), ('latest', 0)]:
+                for index in range(8):
+                    executor.submit(self.migrate, self.dst(index), phase, index, 1, delay * (index % 2))
+                executor.join()
+        # Each phase completes before the next one starts
+        phases = [phase for _, phase, _ in self.events]
+        assert phases == sorted(phases, key=['files', 'version', 'latest'].index)
+        assert len(self.events) == 3 * 8 * 2
+        assert executor.throughput()[:2] == (24, 24)
+        # One pool for the filesystem of the destinations
+        assert len(executor.pools) == 1
+
+    def test_error(self):
+        with MigrationExecutor(4) as executor:
+            for index in range(4):
+                executor.submit(self.migrate, self.dst(index), 'files', index, 1, 0.01, index == 1)
+            with pytest.raises(MigrationError) as error:
+                executor.join()
+            assert 'Leaf 1 failed' in str(error.value)
+            # No more migration is started after a failure
+            executor.submit(self.migrate, self.dst(4), 'files', 4)
+            with pytest.raises(MigrationError):
+                executor.join()
+        # The other pending migrations are completed
+        assert sorted(index for event, _, index in self.events if event == 'end') == [0, 2, 3]
+
+    def test_serial_error(self):
+        with MigrationExecutor(1) as executor:
+            for index in range(3):
+                executor.submit(self.migrate, self.dst(index), 'files', index, 1, 0, index == 1)
+            with pytest.raises(MigrationError):
+                executor.join()
+        assert self.events == [('start', 'files', 0), ('end', 'files', 0), ('start', 'files', 1)]
+        assert executor.throughput()[0] == 1
+
+    def test_device(self):
+        executor = MigrationExecutor(2)
+        # The destination directories do not exist yet
+        assert executor.device(self.dst(0)) == os.stat(self.tmp).st_dev
+        assert executor.devices == {os.path.dirname(self.dst(0)): os.stat(self.tmp).st_dev}
@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+
+"""
+    :platform: Unix
+    :synopsis: Tests of the file handlers and of the DRS tree planning of esgdrs.
+
+"""
+
+import errno
+import os
+import pickle
+import threading
+import uuid
+from collections import OrderedDict
+from multiprocessing import Value
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import pytest
+from netCDF4 import Dataset
+
+from esgprep.drs import handler, main
+from esgprep.drs.custom_exceptions import CrossMigrationDenied, DuplicatedDataset, WriteAccessDenied
+from esgprep.drs.handler import DatasetState, DRSLeaf, DRSPath, File, FileRecord, existing_parent
+
+TRACKING_ID = str(uuid.uuid4())
+
+VERSION = 'v20200101'
+
+FACETS = ['root', 'project', 'model', 'experiment', 'variable']
+
+PATTERN = r'^(?P<variable>[\w-]+)_(?P<model>[\w-]+)_(?P<experiment>[\w-]+)\.nc$'
+
+
+def create(path, **attributes):
+    nc = Dataset(path, 'w')
+    nc.setncatts(attributes)
+    nc.close()
+
+
+class TestFile(object):
+
+    def setup(self):
+        self.tmp = mkdtemp()
+        self.path = os.path.join(self.tmp, 'tas_M1_historical.nc')
+        create(self.path, project='test', institute='IPSL  LSCE', tracking_id=TRACKING_ID)
+
+    def teardown(self):
+        rmtree(self.tmp)
+        main.LATEST_FILES.clear()
+
+    def test_load_attributes(self, monkeypatch):
+        reads, handler_get_ncattrs = list(), handler.get_ncattrs
+
+        def get_ncattrs(path, cache=None):
+            reads.append(path)
+            return handler_get_ncattrs(path, cache)
+
+        monkeypatch.setattr(handler, 'get_ncattrs', get_ncattrs)
+        fh = File(self.path)
+        fh.load_attributes(root='/root', pattern=PATTERN, set_values={'model': 'M2'})
+        # The tracking ID is kept from the attributes read once
+        assert reads == [self.path]
+        assert fh.tracking_id == TRACKING_ID
+        assert fh.attributes['institute'] == 'IPSL'
+        assert fh.attributes['variable'] == 'tas'
+        assert fh.attributes['model'] == 'M2'
+        assert (fh.attributes['root'], fh.attributes['version']) == ('/root', None)
+
+    def test_latest_file(self, monkeypatch):
+        reads, main_get_tracking_id = list(), main.get_tracking_id
+
+        def get_tracking_id(path, project, cache=None):
+            reads.append(path)
+            return main_get_tracking_id(path, project, cache)
+
+        monkeypatch.setattr(main, 'get_tracking_id', get_tracking_id)
+        missing = os.path.join(self.tmp, 'pr_M1_historical.nc')
+        for _ in range(3):
+            assert main.get_latest_file(self.path, 'test') == (TRACKING_ID, os.stat(self.path).st_size)
+            assert main.get_latest_file(missing, 'test') is None
+        # A latest file is read once per run
+        assert reads == [self.path]
+
+
+class TestFileRecord(object):
+
+    def setup(self):
+        self.tmp = mkdtemp()
+        self.path = os.path.join(self.tmp, 'tas_M1_historical.nc')
+        create(self.path, project='test', tracking_id=TRACKING_ID)
+        self.root = os.path.join(self.tmp, 'root')
+
+    def teardown(self):
+        rmtree(self.tmp)
+
+    def parts(self, fh):
+        parts = fh.get_drs_parts(FACETS)
+        # The dataset directory is followed by the version and the variable directory
+        return OrderedDict(parts.items()[:-1] + [('version', None)] + parts.items()[-1:])
+
+    def test_record(self, monkeypatch):
+        monkeypatch.setattr(DRSPath, 'TREE_VERSION', VERSION)
+        fh = File(self.path)
+        fh.load_attributes(root=self.root, pattern=PATTERN, set_values={})
+        fh.drs = DRSPath(self.parts(fh))
+        fh.is_duplicate = True
+        record = pickle.loads(pickle.dumps(fh.record(), pickle.HIGHEST_PROTOCOL))
+        assert isinstance(record, FileRecord)
+        assert not hasattr(record, 'attributes')
+        assert (record.ffp, record.filename, record.size) == (fh.ffp, fh.filename, fh.size)
+        assert (record.v_latest, record.is_duplicate) == (None, True)
+        assert record.dataset() == (self.root, 'test', 'M1', 'historical')
+        # The DRS path is rebuilt as processed
+        for kwargs in [dict(root=True), dict(f_part=False), dict(file_folder=True, root=True)]:
+            assert record.drs.path(**kwargs) == fh.drs.path(**kwargs)
+
+    def test_no_latest_lookup(self, monkeypatch):
+        monkeypatch.setattr(DRSPath, 'TREE_VERSION', VERSION)
+        record = FileRecord(ffp=self.path, filename=os.path.basename(self.path), size=0,
+                            parts=(('root', self.root), ('project', 'test'), ('version', None), ('variable', 'tas')),
+                            v_latest='v20191231', is_duplicate=False)
+        # The upgrade version already exists, but the latest version known by the worker is kept
+        os.makedirs(os.path.join(self.root, 'test', VERSION))
+        assert record.drs.v_latest == 'v20191231'
+        assert record.drs.path(latest=True) == os.path.join('test', 'v20191231', 'tas')
+
+
+class TestTreePlanner(object):
+
+    def setup(self):
+        self.tmp = mkdtemp()
+        self.root = os.path.join(self.tmp, 'root')
+        self.dataset = os.path.join(self.root, 'test', 'M1', 'tas')
+        # Latest dataset version with two files
+        os.makedirs(os.path.join(self.dataset, 'v20191231'))
+        for filename in ['a.nc', 'b.nc']:
+            os.symlink(os.path.join('..', 'files', 'd20191231', filename),
+                       os.path.join(self.dataset, 'v20191231', filename))
+
+    def teardown(self):
+        rmtree(self.tmp)
+        DatasetState.CACHE.clear()
+
+    def planner(self, records, **kwargs):
+        pctx = dict(mode='move', upgrade_from_latest=False, ignore_from_latest=list(), lock=threading.Lock(),
+                    progress=Value('i', 0), nbsources=len(records))
+        pctx.update(kwargs)
+        main.initializer(pctx.keys(), pctx.values())
+        return main.tree_planner(records)
+
+    def record(self, filename, v_latest='v20191231', is_duplicate=False):
+        return FileRecord(ffp=os.path.join(self.tmp, filename), filename=filename, size=1,
+                          parts=(('root', self.root), ('project', 'test'), ('model', 'M1'), ('variable', 'tas'),
+                                 ('version', None)),
+                          v_latest=v_latest, is_duplicate=is_duplicate)
+
+    def test_plan(self, monkeypatch):
+        monkeypatch.setattr(DRSPath, 'TREE_VERSION', VERSION)
+        results, leaves, entries, duplicates = self.planner([self.record('a.nc')])
+        assert results == [True]
+        assert [(leaf['phase'], leaf['leaf'], leaf['mode']) for leaf in leaves] == [('version', 'a.nc', 'symlink'),
+                                                                                     ('latest', 'latest', 'symlink'),
+                                                                                     ('files', 'a.nc', 'move')]
+        assert leaves[0]['src'] == os.path.join('..', 'files', 'd20200101', 'a.nc')
+        assert leaves[1]['src'] == VERSION
+        assert leaves[2]['nodes'] == [self.root, 'test', 'M1', 'tas', 'files', 'd20200101']
+        assert [(path, entry['filename'], entry['latest']) for path, entry in entries] == [
+            (os.path.join('test', 'M1', 'tas', VERSION), 'a.nc', 'v20191231')]
+        assert duplicates == list()
+
+    def test_upgrade_from_latest(self, monkeypatch):
+        monkeypatch.setattr(DRSPath, 'TREE_VERSION', VERSION)
+        listed, files = list(), DatasetState.files
+
+        def listing(self, version):
+            listed.append(version)
+            return files(self, version)
+
+        monkeypatch.setattr(DatasetState, 'files', listing)
+        results, leaves, _, _ = self.planner([self.record('a.nc'), self.record('c.nc')], upgrade_from_latest=True)
+        assert results == [True, True]
+        # The latest version is enumerated once for the dataset
+        assert listed == ['v20191231']
+        assert sorted(leaf['leaf'] for leaf in leaves if leaf['phase'] == 'version') == ['a.nc', 'b.nc', 'c.nc']
+
+    def test_duplicate(self, monkeypatch):
+        monkeypatch.setattr(DRSPath, 'TREE_VERSION', VERSION)
+        os.symlink('v20191231', os.path.join(self.dataset, 'latest'))
+        results, leaves, _, duplicates = self.planner([self.record('b.nc', is_duplicate=True)])
+        assert results == [True]
+        assert [(leaf['leaf'], leaf['src']) for leaf in leaves] == [('b.nc', os.path.join('..', 'files', 'd20191231',
+                                                                                          'b.nc'))]
+        assert duplicates == [os.path.join(self.tmp, 'b.nc')]
+        # A duplicated file is an error when upgrading from the latest version
+        assert self.planner([self.record('b.nc', is_duplicate=True)], upgrade_from_latest=True)[0] == [None]
+
+    def test_older_upgrade(self, monkeypatch):
+        monkeypatch.setattr(DRSPath, 'TREE_VERSION', 'v20190101')
+        results, leaves, entries, _ = self.planner([self.record('a.nc'), self.record('c.nc')])
+        # Each file of the dataset fails on its own
+        assert results == [None, None]
+        assert leaves == entries == list()
+
+
+class TestDatasetState(object):
+
+    def setup(self):
+        self.tmp = mkdtemp()
+        self.root = os.path.join(self.tmp, 'root')
+        self.dataset = os.path.join(self.root, 'test', 'M1', 'tas')
+        for version in ['v20190101', 'v20191231', '.v20200101.staging', 'files']:
+            os.makedirs(os.path.join(self.dataset, version))
+        os.makedirs(os.path.join(self.dataset, 'v20191231', 'day'))
+        for filename in ['a.nc', os.path.join('day', 'b.nc')]:
+            os.symlink(os.path.join('..', 'files', 'd20191231', os.path.basename(filename)),
+                       os.path.join(self.dataset, 'v20191231', filename))
+        self.listed = list()
+
+    def teardown(self):
+        rmtree(self.tmp)
+        DatasetState.CACHE.clear()
+
+    def count_listings(self, monkeypatch):
+        listdir = os.listdir
+
+        def counted(path):
+            self.listed.append(path)
+            return listdir(path)
+
+        monkeypatch.setattr(os, 'listdir', counted)
+
+    def test_versions(self, monkeypatch):
+        self.count_listings(monkeypatch)
+        state = DatasetState.get(self.dataset)
+        assert DatasetState.get(self.dataset) is state
+        for _ in range(3):
+            assert state.versions == ['v20190101', 'v20191231']
+            assert state.latest == 'v20191231'
+        # The dataset directory is listed once
+        assert self.listed == [self.dataset]
+        assert DatasetState.get(os.path.join(self.root, 'test', 'M1', 'pr')).latest is None
+
+    def test_files(self, monkeypatch):
+        walked, walk = list(), os.walk
+
+        def counted(top, *args):
+            # Only the top directory of a walk, not its recursive calls
+            if not args:
+                walked.append(top)
+            return walk(top, *args)
+
+        monkeypatch.setattr(os, 'walk', counted)
+        state = DatasetState.get(self.dataset)
+        for _ in range(3):
+            assert sorted(state.files('v20191231')) == [
+                ('a.nc', os.path.join(self.dataset, 'v20191231', 'a.nc'),
+                 os.path.join('..', 'files', 'd20191231', 'a.nc')),
+                ('b.nc', os.path.join(self.dataset, 'v20191231', 'day', 'b.nc'),
+                 os.path.join('..', 'files', 'd20191231', 'b.nc'))]
+        assert walked == [os.path.join(self.dataset, 'v20191231')]
+
+    def test_latest_version(self, monkeypatch):
+        self.count_listings(monkeypatch)
+        parts = OrderedDict([('root', self.root), ('project', 'test'), ('model', 'M1'), ('variable', 'tas'),
+                             ('version', None)])
+        monkeypatch.setattr(DRSPath, 'TREE_VERSION', VERSION)
+        for _ in range(3):
+            assert DRSPath(parts).v_latest == 'v20191231'
+        # Looked up once for all the files of the dataset
+        assert self.listed == [self.dataset]
+        monkeypatch.setattr(DRSPath, 'TREE_VERSION', 'v20191231')
+        with pytest.raises(DuplicatedDataset):
+            DRSPath(parts)
+
+
+class TestPermissionProbes(object):
+
+    def setup(self):
+        self.tmp = mkdtemp()
+        self.incoming = os.path.join(self.tmp, 'incoming')
+        self.root = os.path.join(self.tmp, 'root')
+        for directory in [self.incoming, os.path.join(self.root, 'test')]:
+            os.makedirs(directory)
+        self.leaves = list()
+        for filename in ['a.nc', 'b.nc', 'c.nc']:
+            create(os.path.join(self.incoming, filename))
+            self.leaves.append(DRSLeaf(dst=os.path.join(self.root, 'test', 'M1', 'tas', 'files', 'd1', filename),
+                                       label=filename, src=os.path.join(self.incoming, filename), mode='link',
+                                       origin=None, phase='files'))
+        self.probed = list()
+
+    def teardown(self):
+        rmtree(self.tmp)
+
+    def count_access(self, monkeypatch, denied=None):
+        access = os.access
+
+        def counted(path, mode):
+            if mode == os.W_OK:
+                self.probed.append(path)
+            return path != denied and access(path, mode)
+
+        monkeypatch.setattr(os, 'access', counted)
+
+    def test_existing_parent(self):
+        probes = dict()
+        directory = os.path.dirname(self.leaves[0].dst)
+        assert existing_parent(directory, self.root, probes) == os.path.join(self.root, 'test')
+        assert probes == {('parent', directory): os.path.join(self.root, 'test')}
+        # Never backwards above the DRS tree root
+        assert existing_parent(os.path.join(self.tmp, 'other', 'dir'), self.tmp) == self.tmp
+
+    def test_permissions(self, monkeypatch):
+        self.count_access(monkeypatch)
+        probes = dict()
+        for leaf in self.leaves:
+            leaf.has_permissions(self.root, probes)
+        # The destination directory is probed once for all its leaves
+        assert self.probed == [os.path.join(self.root, 'test')]
+        del self.probed[:]
+        for leaf in self.leaves:
+            leaf.has_permissions(self.root)
+        assert self.probed == [os.path.join(self.root, 'test')] * 3
+
+    def test_permission_denied(self, monkeypatch):
+        self.count_access(monkeypatch, denied=os.path.join(self.root, 'test'))
+        probes = dict()
+        # A denied access is never cached
+        for leaf in self.leaves[:2]:
+            with pytest.raises(WriteAccessDenied):
+                leaf.has_permissions(self.root, probes)
+        assert self.probed == [os.path.join(self.root, 'test')] * 2
+
+    def test_migration_granted(self, monkeypatch):
+        links, link = list(), handler.UNIX_COMMAND['link']
+
+        def counted(src, dst):
+            links.append(dst)
+            return link(src, dst)
+
+        monkeypatch.setitem(handler.UNIX_COMMAND, 'link', counted)
+        probes = dict()
+        for leaf in self.leaves:
+            leaf.migration_granted(self.root, probes)
+        # The hard link is attempted once per devices and destination directory, and removed
+        assert len(links) == 1
+        assert os.path.dirname(links[0]) == os.path.join(self.root, 'test')
+        assert os.listdir(os.path.join(self.root, 'test')) == list()
+
+    def test_cross_device(self, monkeypatch):
+        def cross_device(src, dst):
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+        monkeypatch.setitem(handler.UNIX_COMMAND, 'link', cross_device)
+        probes = dict()
+        for leaf in self.leaves[:2]:
+            with pytest.raises(CrossMigrationDenied):
+                leaf.migration_granted(self.root, probes)
+        assert not [key for key in probes if key[0] == 'link']
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""
+    :platform: Unix
+    :synopsis: Tests of the miscellaneous utilities.
+
+"""
+
+import os
+import uuid
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import pytest
+from netCDF4 import Dataset
+
+from esgprep.utils import misc
+from esgprep.utils.cache import AttributesCache
+from esgprep.utils.misc import check_tracking_id, closest_attribute, get_tracking_id
+
+TRACKING_ID = str(uuid.uuid4())
+
+
+class TestTrackingID(object):
+
+    def setup(self):
+        self.tmp = mkdtemp()
+        self.path = os.path.join(self.tmp, 'tas.nc')
+
+    def teardown(self):
+        rmtree(self.tmp)
+
+    def test_check(self):
+        assert check_tracking_id(None, 'test') is None
+        assert check_tracking_id(TRACKING_ID, 'test') == TRACKING_ID
+        assert check_tracking_id('hdl:21.14100/' + TRACKING_ID, 'cmip6') == 'hdl:21.14100/' + TRACKING_ID
+
+    def test_invalid(self):
+        for tracking_id, project in [('not-a-uuid', 'test'),
+                                     (TRACKING_ID, 'cmip6'),
+                                     ('hdl:21.14103/' + TRACKING_ID, 'cmip6'),
+                                     (str(uuid.uuid1()), 'test')]:
+            with pytest.raises(AssertionError):
+                check_tracking_id(tracking_id, project)
+
+    def test_read(self):
+        nc = Dataset(self.path, 'w')
+        nc.close()
+        assert get_tracking_id(self.path, 'test') is None
+        nc = Dataset(self.path, 'w')
+        nc.tracking_id = TRACKING_ID
+        nc.close()
+        assert get_tracking_id(self.path, 'test') == TRACKING_ID
+
+
+class TestClosestAttribute(object):
+
+    def setup(self):
+        self.tmp = mkdtemp()
+        self.calls = list()
+
+    def teardown(self):
+        rmtree(self.tmp)
+
+    def patch(self, monkeypatch):
+        extract = misc.extractOne
+
+        def counted(facet, attributes, **kwargs):
+            self.calls.append(facet)
+            return extract(facet, attributes, **kwargs)
+
+        monkeypatch.setattr(misc, 'CLOSEST_ATTRIBUTES', dict())
+        monkeypatch.setattr(misc, 'extractOne', counted)
+
+    def test_schema(self, monkeypatch):
+        self.patch(monkeypatch)
+        attributes = ['source_id', 'experiment_id', 'variable_id']
+        assert closest_attribute('experiment', attributes)[0] == 'experiment_id'
+        # The same attributes schema in another order is resolved once
+        assert closest_attribute('experiment', reversed(attributes))[0] == 'experiment_id'
+        assert closest_attribute('source', attributes)[0] == 'source_id'
+        assert self.calls == ['experiment', 'source']
+        # Another attributes schema is resolved again
+        assert closest_attribute('experiment', attributes + ['member_id'])[0] == 'experiment_id'
+        assert self.calls == ['experiment', 'source', 'experiment']
+
+    def test_cache(self, monkeypatch):
+        self.patch(monkeypatch)
+        attributes = ['source_id', 'experiment_id']
+        cache = AttributesCache(os.path.join(self.tmp, 'cache.db'))
+        closest = closest_attribute('experiment', attributes, cache)
+        assert self.calls == ['experiment']
+        assert cache.get_closest('experiment', reversed(attributes)) == closest
+        # Shared with the other processes or runs through the cache
+        monkeypatch.setattr(misc, 'CLOSEST_ATTRIBUTES', dict())
+        assert closest_attribute('experiment', attributes, AttributesCache(cache.path)) == closest
+        assert self.calls == ['experiment']
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+"""
+    :platform: Unix
+    :synopsis: Tests of the netCDF header reader against the netCDF library.
+
+"""
+
+import os
+import struct
+from collections import OrderedDict
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import numpy
+import pytest
+from netCDF4 import Dataset
+
+from esgprep.utils import ncheader
+from esgprep.utils.custom_exceptions import InvalidNetCDFFile
+from esgprep.utils.misc import get_ncattrs
+from esgprep.utils.ncheader import HDF5Header, HDF5_ATTRIBUTE, NETCDF4_HIDDEN_ATTRIBUTES, UnsupportedHeader, \
+    read_ncattrs
+
+# Global attributes of each type
+ATTRIBUTES = [('tracking_id', u'hdl:21.14100/0b0e2b7a-7c4b-4bb5-9d7b-6a1f1c1a2c3d'),
+              ('realization', 1),
+              ('frequency', 'mon'),
+              ('branch_time', 365.25),
+              ('levels', numpy.array([1000, 850, 500], 'i4')),
+              ('weights', numpy.array([0.25, 0.5], 'f8'))]
+
+
+def layout(path):
+    """
+    Returns the number of continuation blocks and fractal heaps read to get the attributes of a netCDF-4 file.
+
+    """
+    with open(path, 'rb') as f:
+        header = HDF5Header(f, path)
+        signatures = list()
+        read = header.read
+
+        def tracked_read(size, offset=None):
+            data = read(size, offset)
+            signatures.append(data[:4])
+            return data
+
+        header.read = tracked_read
+        try:
+            header.attributes()
+        except UnsupportedHeader:
+            pass
+    return signatures.count('OCHK'), signatures.count('FRHP')
+
+
+def swap_messages(path, first, second):
+    """
+    Swaps two attribute messages within the first chunk of the root group object header of a netCDF-4 file.
+    The header checksum is not updated, so that only :func:`read_ncattrs` can read the file afterwards.
+
+    """
+    with open(path, 'r+b') as f:
+        header = HDF5Header(f, path)
+        address = header.root_object_header()
+        data = header.read(16, address)
+        flags = ord(data[5])
+        pos = 6 + (16 if flags & 0x20 else 0) + (4 if flags & 0x10 else 0)
+        chunk_size_length = 1 << (flags & 0x03)
+        chunk_size = header.unpack_int(header.read(pos + chunk_size_length, address), pos, chunk_size_length)
+        start = address + pos + chunk_size_length
+        chunk = header.read(chunk_size, start)
+        prefix_size = 6 if flags & 0x04 else 4
+        positions, pos = dict(), 0
+        while pos + prefix_size <= len(chunk):
+            msg_type, size = ord(chunk[pos]), header.unpack_int(chunk, pos + 1, 2)
+            end = pos + prefix_size + size
+            if msg_type == HDF5_ATTRIBUTE:
+                positions[header.parse_attribute(chunk[pos + prefix_size:end])[0]] = (pos, end)
+            pos = end
+        (start1, end1), (start2, end2) = sorted([positions[first], positions[second]])
+        chunk = chunk[:start1] + chunk[start2:end2] + chunk[end1:start2] + chunk[start1:end1] + chunk[end2:]
+        f.seek(start)
+        f.write(chunk)
+
+
+class TestNcHeader(object):
+
+    def setup(self):
+        self.tmp = mkdtemp()
+        self.path = os.path.join(self.tmp, 'test.nc')
+
+    def teardown(self):
+        rmtree(self.tmp)
+
+    def create(self, attributes, fmt='NETCDF4', appended=None):
+        nc = Dataset(self.path, 'w', format=fmt)
+        nc.setncatts(OrderedDict(attributes))
+        if appended:
+            # Data written after the header, to be extended by continuation blocks in append mode
+            nc.createDimension('time', 100)
+            nc.createVariable('tas', 'f4', ('time',))[:] = range(100)
+        nc.close()
+        if appended:
+            nc = Dataset(self.path, 'a')
+            for name, value in appended:
+                nc.setncattr(name, value)
+            nc.close()
+
+    def assert_same_attributes(self, attributes):
+        nc = Dataset(self.path)
+        try:
+            assert list(attributes) == nc.ncattrs()
+            for name, value in attributes.items():
+                expected = nc.getncattr(name)
+                assert type(value) == type(expected)
+                assert numpy.array_equal(value, expected)
+        finally:
+            nc.close()
+
+    def test_classic(self):
+        for fmt, version in [('NETCDF3_CLASSIC', 1), ('NETCDF3_64BIT_OFFSET', 2), ('NETCDF3_64BIT_DATA', 5)]:
+            self.create(ATTRIBUTES, fmt)
+            with open(self.path, 'rb') as f:
+                assert ord(f.read(4)[3]) == version
+            self.assert_same_attributes(read_ncattrs(self.path))
+
+    def test_compact_storage(self):
+        for fmt in ['NETCDF4', 'NETCDF4_CLASSIC']:
+            self.create(ATTRIBUTES, fmt)
+            assert layout(self.path) == (0, 0)
+            self.assert_same_attributes(read_ncattrs(self.path))
+
+    def test_continuation_blocks(self):
+        for fmt in ['NETCDF4', 'NETCDF4_CLASSIC']:
+            self.create(ATTRIBUTES[:1], fmt, [('history', 'h' * 5000)] + ATTRIBUTES[1:4])
+            assert layout(self.path)[0] > 0
+            self.assert_same_attributes(read_ncattrs(self.path))
+
+    def test_creation_order(self):
+        self.create(ATTRIBUTES[:4])
+        expected = read_ncattrs(self.path)
+        # Message moved after the next attribute message, as HDF5 does when it does not fit anymore
+        swap_messages(self.path, 'realization', 'frequency')
+        with open(self.path, 'rb') as f:
+            header = HDF5Header(f, self.path)
+            names = [header.parse_attribute(msg)[0] for msg_type, msg, _ in header.messages(header.root_object_header())
+                     if msg_type == HDF5_ATTRIBUTE]
+        assert names.index('frequency') < names.index('realization')
+        assert read_ncattrs(self.path).keys() == expected.keys()
+
+    def test_dense_storage(self):
+        attributes = ATTRIBUTES + [('attribute_{:03d}'.format(i), 'v' * i) for i in range(50)]
+        for fmt in ['NETCDF4', 'NETCDF4_CLASSIC']:
+            self.create(attributes, fmt)
+            assert layout(self.path)[1] == 1
+            self.assert_same_attributes(read_ncattrs(self.path))
+
+    def test_huge_heap_object(self):
+        self.create(ATTRIBUTES + [('history', 'h' * 70000)])
+        with pytest.raises(UnsupportedHeader) as error:
+            read_ncattrs(self.path)
+        assert 'Huge fractal heap object' in str(error.value)
+        self.assert_same_attributes(get_ncattrs(self.path))
+
+    def test_btree_depth_2(self):
+        self.create(ATTRIBUTES + [('attribute_{:04d}'.format(i), i) for i in range(1000)])
+        with pytest.raises(UnsupportedHeader) as error:
+            read_ncattrs(self.path)
+        assert 'B-tree depth 2' in str(error.value)
+        self.assert_same_attributes(get_ncattrs(self.path))
+
+    def test_truncated_header(self):
+        self.create(ATTRIBUTES)
+        with open(self.path, 'r+b') as f:
+            f.truncate(300)
+        with pytest.raises(UnsupportedHeader) as error:
+            read_ncattrs(self.path)
+        assert 'Truncated header' in str(error.value)
+        # The netCDF library is the one to reject the file
+        with pytest.raises(InvalidNetCDFFile):
+            get_ncattrs(self.path)
+
+    def test_odd_header(self):
+        self.create(ATTRIBUTES, 'NETCDF3_CLASSIC')
+        with open(self.path, 'r+b') as f:
+            header = f.read().replace('frequency', 'freq\xe9ency')
+            f.seek(0)
+            f.write(header)
+        with pytest.raises(UnsupportedHeader) as error:
+            read_ncattrs(self.path)
+        assert 'UnicodeDecodeError' in str(error.value)
+
+    def test_parse_error_fallback(self, monkeypatch):
+        for error in [struct.error, IndexError, TypeError, ValueError]:
+            def decode_values(data, dtype):
+                raise error('Unexpected value')
+
+            monkeypatch.setattr(ncheader, 'decode_values', decode_values)
+            for fmt in ['NETCDF3_CLASSIC', 'NETCDF4']:
+                self.create(ATTRIBUTES, fmt)
+                with pytest.raises(UnsupportedHeader) as exc:
+                    read_ncattrs(self.path)
+                assert error.__name__ in str(exc.value)
+                self.assert_same_attributes(get_ncattrs(self.path))
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+"""
+    :platform: Unix
+    :synopsis: Persistent cache of netCDF global attributes shared by esgdrs and esgcheckvocab.
+
+"""
+
+import getpass
+import os
+import pickle
+import sqlite3
+import tempfile
+
+# Default attributes cache filename template
+ATTRIBUTES_CACHE = 'esgprep-attributes-{}.db'
+
+# Seconds to wait for a concurrent writer to release the database
+ATTRIBUTES_CACHE_TIMEOUT = 60
+
+
+def default_cache_path():
+    """
+    Returns the default attributes cache path of the user in the temporary directory.
+
+    :returns: The cache path
+    :rtype: *str*
+
+    """
+    return os.path.join(tempfile.gettempdir(), ATTRIBUTES_CACHE.format(getpass.getuser()))
+
+
+class AttributesCache(object):
+    """
+    SQLite cache of the netCDF global attributes.
+
+    Entries are keyed by the file device and inode and are valid as long as the file size and modification time are
+    unchanged. Consequently, a file moved or hard-linked into the DRS tree is not read again. The recorded path of an
+    entry follows the file each time it is looked up under another path, so that pruning only drops the files gone.
+    Only the database path is pickled, each process opens its own connection on first use.
+
+    :param str path: The cache database path
+    :returns: The attributes cache
+    :rtype: *AttributesCache*
+
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self._db = None
+        self._pid = None
+        self.connect()
+
+    def __getstate__(self):
+        # Never pickle the database connection
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._db = None
+        self._pid = None
+
+    def __eq__(self, other):
+        return isinstance(other, AttributesCache) and self.path == other.path
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def connect(self):
+        """
+        Opens the database connection of the current process, creating the tables if needed.
+
+        :returns: The database connection
+        :rtype: *sqlite3.Connection*
+
+        """
+        if self._db is None or self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, timeout=ATTRIBUTES_CACHE_TIMEOUT, isolation_level=None,
+                                       check_same_thread=False)
+            self._db.text_factory = str
+            self._db.execute('PRAGMA journal_mode = WAL')
+            # No synchronization on each autocommitted entry, the WAL is only synchronized on checkpoints
+            self._db.execute('PRAGMA synchronous = NORMAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS attributes ('
+                             'device INTEGER NOT NULL, '
+                             'inode INTEGER NOT NULL, '
+                             'size INTEGER NOT NULL, '
+                             'mtime REAL NOT NULL, '
+                             'path TEXT NOT NULL, '
+                             'attributes BLOB NOT NULL, '
+                             'PRIMARY KEY (device, inode))')
+            self._db.execute('CREATE INDEX IF NOT EXISTS attributes_path ON attributes (path)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS closest ('
+                             'facet TEXT NOT NULL, '
+                             'attributes TEXT NOT NULL, '
+                             'key TEXT NOT NULL, '
+                             'score INTEGER NOT NULL, '
+                             'PRIMARY KEY (facet, attributes))')
+            self._pid = os.getpid()
+        return self._db
+
+    def get(self, ffp, stat=None):
+        """
+        Looks up the global attributes of a file.
+        The recorded path is updated if the file is found under another path (e.g., moved or hard-linked).
+
+        :param str ffp: The file full path
+        :param posix.stat_result stat: The file status if already known
+        :returns: The global attributes, None if not cached or if the file changed
+        :rtype: *OrderedDict*
+
+        """
+        stat = stat or os.stat(ffp)
+        db = self.connect()
+        row = db.execute('SELECT size, mtime, path, attributes FROM attributes WHERE device = ? AND inode = ?',
+                         (stat.st_dev, stat.st_ino)).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            path = os.path.realpath(ffp)
+            if row[2] != path:
+                db.execute('UPDATE attributes SET path = ? WHERE device = ? AND inode = ?',
+                           (path, stat.st_dev, stat.st_ino))
+            return pickle.loads(str(row[3]))
+        return None
+
+    def set(self, ffp, attributes, stat=None):
+        """
+        Records the global attributes of a file.
+
+        :param str ffp: The file full path
+        :param OrderedDict attributes: The global attributes
+        :param posix.stat_result stat: The file status if already known
+
+        """
+        stat = stat or os.stat(ffp)
+        self.connect().execute('INSERT OR REPLACE INTO attributes VALUES (?, ?, ?, ?, ?, ?)',
+                               (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime, os.path.realpath(ffp),
+                                sqlite3.Binary(pickle.dumps(attributes, pickle.HIGHEST_PROTOCOL))))
+
+    def relocate(self, moves):
+        """
+        Updates the recorded paths of files moved or hard-linked to another path.
+
+        :param iterable moves: The (source path, destination path) pairs
+
+        """
+        db = self.connect()
+        db.execute('BEGIN')
+        db.executemany('UPDATE attributes SET path = ? WHERE path = ?',
+                       ((os.path.realpath(dst), os.path.realpath(src)) for src, dst in moves))
+        db.execute('COMMIT')
+
+    def get_closest(self, facet, attributes):
+        """
+        Looks up the closest attribute name of a facet among a set of attribute names.
+
+        :param str facet: The facet name
+        :param iterable attributes: The attribute names
+        :returns: The closest attribute name and its score, None if not cached
+        :rtype: *tuple*
+
+        """
+        row = self.connect().execute('SELECT key, score FROM closest WHERE facet = ? AND attributes = ?',
+                                     (facet, '\n'.join(sorted(attributes)))).fetchone()
+        return tuple(row) if row else None
+
+    def set_closest(self, facet, attributes, closest):
+        """
+        Records the closest attribute name of a facet among a set of attribute names.
+
+        :param str facet: The facet name
+        :param iterable attributes: The attribute names
+        :param tuple closest: The closest attribute name and its score
+
+        """
+        self.connect().execute('INSERT OR REPLACE INTO closest VALUES (?, ?, ?, ?)',
+                               (facet, '\n'.join(sorted(attributes))) + tuple(closest))
+
+    def prune(self):
+        """
+        Removes the entries of files that no longer exist or changed since they were cached.
+        A file is looked for under its last recorded path (see :func:`AttributesCache.get`).
+
+        :returns: The number of removed entries
+        :rtype: *int*
+
+        """
+        db = self.connect()
+        stale = list()
+        for device, inode, size, mtime, path in db.execute('SELECT device, inode, size, mtime, path FROM attributes'):
+            try:
+                stat = os.stat(path)
+                if (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime) == (device, inode, size, mtime):
+                    continue
+            except OSError:
+                pass
+            stale.append((device, inode))
+        db.execute('BEGIN')
+        db.executemany('DELETE FROM attributes WHERE device = ? AND inode = ?', stale)
+        db.execute('COMMIT')
+        db.execute('VACUUM')
+        return len(stale)
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+
+"""
+    :platform: Unix
+    :synopsis: Indexed checksums store used by the "--checksums-from" flag.
+
+"""
+
+import getpass
+import glob
+import hashlib
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+
+# Checksum index filename template (user, sources key and sources signature)
+CHECKSUMS_INDEX = 'esgprep-checksums-{}-{}-{}.db'
+
+# Signature of a checksums file read from a stream (e.g., the standard input), keyed by its content
+STREAM_SIGNATURE = 'stream'
+
+# Number of entries inserted into the index at once
+CHECKSUMS_BATCH = 10000
+
+# BSD-style checksum line (e.g., "SHA256 (path) = checksum")
+BSD_CHECKSUM_LINE = re.compile(r'^[\w-]+ \((?P<path>.+)\) = (?P<checksum>[0-9a-fA-F]+)$')
+
+# Hexadecimal checksum
+HEX_CHECKSUM = re.compile(r'^[0-9a-fA-F]+$')
+
+
+def parse_checksum_line(line):
+    """
+    Parses a line of a checksums file into a (path, checksum) pair.
+    Supported formats are:
+
+     * the output of the UNIX command-lines "\*sum" (i.e., "<checksum>  <path>"),
+     * the BSD-style output of the same command-lines (i.e., "<ALGO> (<path>) = <checksum>"),
+     * an ESGF mapfile line (i.e., "<dataset_id> | <path> | <size> | ... | checksum=<checksum> | ..."),
+     * a CSV line (i.e., "<path>,<checksum>").
+
+    :param str line: The line to parse
+    :returns: The file path and its checksum, None if the line does not record any checksum
+    :rtype: *tuple*
+
+    """
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    if '|' in line:
+        # ESGF mapfile entry
+        fields = [field.strip() for field in line.split('|')]
+        for field in fields[3:]:
+            if field.startswith('checksum='):
+                return fields[1], field.split('=', 1)[1]
+        return None
+    match = BSD_CHECKSUM_LINE.match(line)
+    if match:
+        return match.group('path'), match.group('checksum')
+    fields = line.split(None, 1)
+    if len(fields) == 2 and HEX_CHECKSUM.match(fields[0]):
+        # "*sum" output, the path can be prefixed with "*" in binary mode
+        checksum, path = fields
+        if path.startswith('*'):
+            path = path[1:]
+        return path, checksum
+    path, _, checksum = line.rpartition(',')
+    if path and HEX_CHECKSUM.match(checksum.strip()):
+        return path.strip(), checksum.strip()
+    return None
+
+
+def hashed_lines(lines, signature):
+    """
+    Yields the lines of a file while hashing them.
+
+    :param iterable lines: The file lines
+    :param hashlib.md5 signature: The hash to update
+    :returns: The lines
+    :rtype: *iter*
+
+    """
+    for line in lines:
+        signature.update(line)
+        yield line
+
+
+class ChecksumsIndex(object):
+    """
+    Read-only index of checksums compiled from one or several checksums files.
+
+    The submitted files are parsed once into an SQLite database stored in the temporary directory.
+    The index is reused as long as the source files are unchanged. Once the source files changed, the new index
+    replaces the previous one of the same source files.
+    A checksums file without path (e.g., the standard input or a pipe) is read once while compiled, its index is keyed
+    by its content and never supersedes another index.
+    Only the index path is pickled, each process opens its own connection on first lookup.
+
+    :param list sources: The list of checksums files paths
+    :param file stream: An open checksums file without path, instead of the sources
+    :returns: The checksums index
+    :rtype: *ChecksumsIndex*
+
+    """
+
+    def __init__(self, sources=None, stream=None):
+        self.sources = sorted([os.path.realpath(source) for source in sources or list()])
+        self._db = None
+        self._pid = None
+        if stream is not None:
+            self.path = None
+            self.compile(stream)
+        else:
+            self.path = self.index_path(self.signature())
+            if not os.path.isfile(self.path):
+                self.compile()
+
+    def __getstate__(self):
+        # Never pickle the database connection
+        return {'sources': self.sources, 'path': self.path}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._db = None
+        self._pid = None
+
+    def __eq__(self, other):
+        return isinstance(other, ChecksumsIndex) and self.path == other.path
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __contains__(self, ffp):
+        return self.get(ffp) is not None
+
+    def __getitem__(self, ffp):
+        checksum = self.get(ffp)
+        if checksum is None:
+            raise KeyError(ffp)
+        return checksum
+
+    def key(self):
+        """
+        Hashes the sources paths.
+
+        :returns: The sources key
+        :rtype: *str*
+
+        """
+        return hashlib.md5('\n'.join(self.sources)).hexdigest()
+
+    def index_path(self, signature, key=None):
+        """
+        Returns the index path of the sources.
+
+        :param str signature: The sources signature
+        :param str key: The sources key, the key of the sources paths by default
+        :returns: The index path
+        :rtype: *str*
+
+        """
+        return os.path.join(tempfile.gettempdir(),
+                            CHECKSUMS_INDEX.format(getpass.getuser(), key or self.key(), signature))
+
+    def signature(self):
+        """
+        Hashes the sources paths, sizes and modification times.
+
+        :returns: The sources signature
+        :rtype: *str*
+
+        """
+        signature = hashlib.md5()
+        for source in self.sources:
+            stat = os.stat(source)
+            signature.update('{}:{}:{}\n'.format(source, stat.st_size, stat.st_mtime))
+        return signature.hexdigest()
+
+    def compile(self, stream=None):
+        """
+        Parses the checksums files into a path-indexed table.
+        The index is written under a temporary name and renamed in the end to be safely shared.
+        The superseded indexes of the same sources are removed, except for a stream.
+
+        :param file stream: An open checksums file without path, instead of the sources
+
+        """
+        fd, tmp = tempfile.mkstemp(prefix='.', suffix='.db', dir=tempfile.gettempdir())
+        os.close(fd)
+        try:
+            db = sqlite3.connect(tmp)
+            db.text_factory = str
+            db.execute('PRAGMA journal_mode = OFF')
+            db.execute('PRAGMA synchronous = OFF')
+            db.execute('CREATE TABLE checksums (path TEXT PRIMARY KEY, checksum TEXT NOT NULL)')
+            if stream is not None:
+                # The stream can only be read once, hash its content while inserting it
+                signature = hashlib.md5()
+                self.insert(db, hashed_lines(stream, signature))
+                self.path = self.index_path(STREAM_SIGNATURE, key=signature.hexdigest())
+            else:
+                for source in self.sources:
+                    with open(source, 'r') as f:
+                        self.insert(db, f)
+            db.commit()
+            db.close()
+            os.rename(tmp, self.path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        if stream is None:
+            self.remove_superseded()
+
+    def remove_superseded(self):
+        """
+        Removes the previous indexes of the same sources.
+
+        """
+        for path in glob.glob(self.index_path('*')):
+            if path != self.path:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def insert(db, lines):
+        """
+        Inserts the entries of a checksums file by batch.
+        The last checksum wins if a path is listed several times.
+
+        :param sqlite3.Connection db: The index database
+        :param iterable lines: The checksums file lines
+
+        """
+        entries = list()
+        for line in lines:
+            entry = parse_checksum_line(line)
+            if entry:
+                path, checksum = entry
+                entries.append((os.path.abspath(os.path.normpath(path)), checksum.lower()))
+            if len(entries) >= CHECKSUMS_BATCH:
+                db.executemany('INSERT OR REPLACE INTO checksums VALUES (?, ?)', entries)
+                entries = list()
+        db.executemany('INSERT OR REPLACE INTO checksums VALUES (?, ?)', entries)
+
+    def get(self, ffp):
+        """
+        Looks up the checksum of a file.
+
+        :param str ffp: The file full path
+        :returns: The checksum, None if not found
+        :rtype: *str*
+
+        """
+        if self._db is None or self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.text_factory = str
+            self._pid = os.getpid()
+        row = self._db.execute('SELECT checksum FROM checksums WHERE path = ?', (ffp,)).fetchone()
+        return row[0] if row else None
+
+
+class ChecksumsWriter(object):
+    """
+    Thread-safe writer of a checksums file in the UNIX "\*sum" format (i.e., "<checksum>  <path>").
+    The file is opened in append mode on first write, it can be submitted to the "--checksums-from" flag.
+
+    :param str path: The checksums file path
+    :param str checksum_type: The checksum type of the recorded checksums
+    :returns: The checksums writer
+    :rtype: *ChecksumsWriter*
+
+    """
+
+    def __init__(self, path, checksum_type):
+        self.path = path
+        self.checksum_type = checksum_type
+        self._file = None
+        self._lock = threading.Lock()
+
+    def write(self, ffp, checksum):
+        """
+        Records the checksum of a file.
+
+        :param str ffp: The file full path
+        :param str checksum: The checksum
+
+        """
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a')
+            self._file.write('{}  {}\n'.format(checksum, ffp))
+
+    def close(self):
+        """
+        Closes the checksums file if opened.
+
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
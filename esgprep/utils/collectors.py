@@ -116,6 +116,41 @@ class PathCollector(Collector):
                             yield ffp
 
 
+class LeafPathCollector(PathCollector):
+    """
+    Collector class to yield one file per leaf directory from a list of directories to parse.
+    A leaf directory matches the whole directory format. The files of a leaf directory share the same directory
+    facets, so only the first file (in filename order) is yielded and the walk does not go deeper.
+
+    :param str dir_format: The regular expression of the directory format
+
+    """
+
+    def __init__(self, dir_format, *args, **kwargs):
+        super(LeafPathCollector, self).__init__(*args, **kwargs)
+        self.format = re.compile('{}$'.format(dir_format))
+
+    def __iter__(self):
+        """
+        Yields one file full path per leaf directory according to filters on path and filename.
+
+        :returns: The collected file full paths
+        :rtype: *iter*
+
+        """
+        for source in self.sources:
+            for root, dirnames, filenames in os.walk(source, followlinks=True):
+                if self.format.search(root):
+                    # Do not walk below a leaf directory
+                    del dirnames[:]
+                    if self.PathFilter(root.split(source)[1]):
+                        for filename in sorted(filenames):
+                            ffp = os.path.join(root, filename)
+                            if os.path.isfile(ffp) and self.FileFilter(filename):
+                                yield ffp
+                                break
+
+
 class VersionedPathCollector(PathCollector):
     """
     Collector class to yield files from a list of versioned directories to parse.
@@ -25,3 +25,18 @@ SHELL_COLORS = {'red': 1,
 
 # GitHub API parameter for references
 GITHUB_API_PARAMETER = '?{}={}'
+
+# Size of the blocks read to fingerprint a file
+FINGERPRINT_BLOCKSIZE = 65536
+
+# Number of blocks sampled between the head and the tail of a file to fingerprint it
+FINGERPRINT_SAMPLES = 8
+
+# Maximum number of sources processed in the main process, without pool of workers
+SERIAL_MAX_SOURCES = 16
+
+# Maximum number of bytes to checksum in the main process, without pool of workers
+SERIAL_MAX_BYTES = 256 * 1024 * 1024
+
+# Minimum average number of bytes to checksum per source to process the sources with threads
+THREAD_MIN_BYTES = 64 * 1024 * 1024
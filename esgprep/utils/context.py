@@ -7,13 +7,17 @@
 """
 
 import getpass
-from multiprocessing import cpu_count, Lock
+import time
+from multiprocessing import cpu_count, Lock, Pool
 from multiprocessing.managers import SyncManager
+from multiprocessing.pool import ThreadPool
 
 from ESGConfigParser import SectionParser
 from ESGConfigParser.custom_exceptions import NoConfigOption, NoConfigSection
 from requests.auth import HTTPBasicAuth
 
+from esgprep.utils.cache import AttributesCache, default_cache_path
+from esgprep.utils.constants import SERIAL_MAX_SOURCES, SERIAL_MAX_BYTES, THREAD_MIN_BYTES
 from esgprep.utils.custom_print import *
 
 
@@ -117,19 +121,18 @@ class MultiprocessingContext(BaseContext):
         else:
             # an operation which does not support --max_processes is defined as serial
             self.processes = 1
-        self.use_pool = (self.processes != 1)
+        # Executor of the sources processing (see select_executor())
+        self.executor = 'serial'
+        self.use_pool = False
+        # Seconds spent to start the process manager and the pool of workers
+        self.startup = 0
         # Scan counters
         self.scan_errors = 0
         self.scan_data = 0
         self.nbsources = 0
-        # Process manager
-        if self.use_pool:
-            self.manager = SyncManager()
-            self.manager.start()
-            self.progress = self.manager.Value('i', 0)
-            Print.BUFFER = self.manager.Value(c_char_p, '')
-        else:
-            self.progress = Value('i', 0)
+        # Process manager only started for a processes pool
+        self.manager = None
+        self.progress = Value('i', 0)
         # Stdout lock
         self.lock = Lock()
         # Directory filter (esgmapfile + esgcheckvocab)
@@ -156,6 +159,16 @@ class MultiprocessingContext(BaseContext):
         self.set_keys = {}
         if hasattr(args, 'set_key') and args.set_key:
             self.set_keys = dict(args.set_key)
+        # NetCDF attributes cache (esgcheckvocab + esgdrs)
+        self.attributes_cache = None
+        if hasattr(args, 'attributes_cache'):
+            if args.prune_attributes_cache and not args.attributes_cache:
+                args.attributes_cache = default_cache_path()
+            if args.attributes_cache:
+                self.attributes_cache = AttributesCache(args.attributes_cache)
+                if args.prune_attributes_cache:
+                    pruned = self.attributes_cache.prune()
+                    Print.info('{} stale entries pruned from {}'.format(pruned, self.attributes_cache.path))
 
     def __enter__(self):
         super(MultiprocessingContext, self).__enter__()
@@ -168,6 +181,10 @@ class MultiprocessingContext(BaseContext):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.use_pool and self.nbsources:
+            msg = 'Executor startup: {:.3f}s ({:.3f}ms per source)'.format(self.startup,
+                                                                         self.startup * 1000 / self.nbsources)
+            Print.info(msg)
         # Decline outputs depending on the scan results
         msg = 'Number of file(s) scanned: {}\n'.format(self.scan_data)
         msg += 'Number of error(s): {}'.format(self.scan_errors)
@@ -184,6 +201,66 @@ class MultiprocessingContext(BaseContext):
         Print.summary(msg)
         super(MultiprocessingContext, self).__exit__(exc_type, exc_val, exc_tb)
 
+    def select_executor(self, nbsources=None, size=None):
+        """
+        Selects how to process the sources depending on the estimated work:
+
+         * "serial" in the main process for a few sources, where starting workers costs more than the job,
+         * "thread" for large files to checksum, where the hashing and the reading release the GIL,
+         * "process" otherwise, with a process manager to share the progress and the print buffer.
+
+        :param int nbsources: The number of sources to process, default is all the sources
+        :param int size: The total bytes to checksum, None if unknown
+        :returns: The selected executor
+        :rtype: *str*
+
+        """
+        nbsources = self.nbsources if nbsources is None else nbsources
+        if self.processes == 1:
+            self.executor, reason = 'serial', 'one process'
+        elif nbsources <= 1:
+            self.executor, reason = 'serial', 'nothing to parallelize'
+        elif size is not None and size <= SERIAL_MAX_BYTES and nbsources <= SERIAL_MAX_SOURCES:
+            self.executor, reason = 'serial', 'few sources and bytes to checksum'
+        elif size is None and nbsources <= SERIAL_MAX_SOURCES:
+            self.executor, reason = 'serial', 'few sources'
+        elif size is not None and size >= THREAD_MIN_BYTES * nbsources:
+            self.executor, reason = 'thread', 'checksum-bound'
+        else:
+            self.executor, reason = 'process', 'CPU-bound'
+        self.use_pool = (self.executor != 'serial')
+        if self.executor == 'process' and self.manager is None:
+            start = time.time()
+            self.manager = SyncManager()
+            self.manager.start()
+            self.progress = self.manager.Value('i', self.progress.value)
+            Print.BUFFER = self.manager.Value(c_char_p, Print.BUFFER.value)
+            self.startup += time.time() - start
+        msg = 'Executor: {} ({} source(s)'.format(self.executor, nbsources)
+        if size is not None:
+            msg += ', {} byte(s) to checksum'.format(size)
+        msg += ', {})'.format(reason)
+        Print.info(msg)
+        return self.executor
+
+    def pool(self, initializer, initargs):
+        """
+        Starts the pool of workers of the selected executor.
+
+        :param callable initializer: The workers initializer
+        :param tuple initargs: The initializer arguments
+        :returns: The pool of workers
+        :rtype: *multiprocessing.pool.Pool*
+
+        """
+        start = time.time()
+        if self.executor == 'thread':
+            pool = ThreadPool(processes=self.processes, initializer=initializer, initargs=initargs)
+        else:
+            pool = Pool(processes=self.processes, initializer=initializer, initargs=initargs)
+        self.startup += time.time() - start
+        return pool
+
     def get_checksum_type(self):
         """
         Gets the checksum type to use.
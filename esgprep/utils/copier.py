@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+"""
+    :platform: Unix
+    :synopsis: File copy performed by the kernel, with reflinks on supporting filesystems.
+
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+
+# FICLONE ioctl request to share the source extents with the destination (e.g., XFS, Btrfs)
+FICLONE = 0x40049409
+
+# Size of the blocks copied through userspace while hashing
+COPY_BLOCKSIZE = 1 << 20
+
+# Maximum number of bytes copied by the kernel per system call
+KERNEL_CHUNK = 1 << 30
+
+# Errors meaning that a copy method is not supported for a pair of files
+UNSUPPORTED_ERRORS = (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY)
+
+# Copy methods not supported between two devices
+UNSUPPORTED = set()
+
+
+def load_libc():
+    """
+    Loads the C library to call the copy system calls.
+
+    :returns: The C library, None if not available
+    :rtype: *ctypes.CDLL*
+
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except OSError:
+        return None
+    for name, argtypes in [('copy_file_range', [ctypes.c_int, ctypes.POINTER(ctypes.c_int64), ctypes.c_int,
+                                                ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t, ctypes.c_uint]),
+                           ('sendfile', [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_int64),
+                                         ctypes.c_size_t])]:
+        if hasattr(libc, name):
+            getattr(libc, name).argtypes = argtypes
+            getattr(libc, name).restype = ctypes.c_ssize_t
+    return libc
+
+
+LIBC = load_libc()
+
+
+class Unsupported(Exception):
+    """
+    Raised when a copy method is not supported for a pair of files.
+
+    """
+    pass
+
+
+def syscall_error(function):
+    """
+    Raises the error of a failed system call.
+
+    :param str function: The system call name
+    :raises Unsupported: If the system call is not supported for the files
+    :raises OSError: Otherwise
+
+    """
+    code = ctypes.get_errno()
+    if code in UNSUPPORTED_ERRORS:
+        raise Unsupported(function)
+    raise OSError(code, '{}: {}'.format(function, os.strerror(code)))
+
+
+def reflink(fsrc, fdst, size):
+    """
+    Clones the source file extents into the destination file.
+
+    :param file fsrc: The source file object
+    :param file fdst: The destination file object
+    :param int size: The source file size
+    :raises Unsupported: If the filesystem does not support reflinks
+
+    """
+    try:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except (IOError, OSError) as e:
+        if e.errno in UNSUPPORTED_ERRORS:
+            raise Unsupported('FICLONE')
+        raise
+
+
+def copy_file_range(fsrc, fdst, size):
+    """
+    Copies the source file into the destination file with the ``copy_file_range`` system call.
+    The data never leaves the kernel and can be copied by the filesystem or the storage server.
+
+    :param file fsrc: The source file object
+    :param file fdst: The destination file object
+    :param int size: The source file size
+    :raises Unsupported: If the system call is not supported for the files or stopped before the end of the file
+
+    """
+    if not LIBC or not hasattr(LIBC, 'copy_file_range'):
+        raise Unsupported('copy_file_range')
+    copied = 0
+    while copied < size:
+        n = LIBC.copy_file_range(fsrc.fileno(), None, fdst.fileno(), None, min(size - copied, KERNEL_CHUNK), 0)
+        if n < 0:
+            syscall_error('copy_file_range')
+        if n == 0:
+            break
+        copied += n
+    if copied < size:
+        # The remaining data are copied from scratch by the next method
+        raise Unsupported('copy_file_range')
+
+
+def sendfile(fsrc, fdst, size):
+    """
+    Copies the source file into the destination file with the ``sendfile`` system call.
+
+    :param file fsrc: The source file object
+    :param file fdst: The destination file object
+    :param int size: The source file size
+    :raises Unsupported: If the system call is not supported for the files or stopped before the end of the file
+
+    """
+    if not LIBC or not hasattr(LIBC, 'sendfile'):
+        raise Unsupported('sendfile')
+    copied = 0
+    while copied < size:
+        n = LIBC.sendfile(fdst.fileno(), fsrc.fileno(), None, min(size - copied, KERNEL_CHUNK))
+        if n < 0:
+            syscall_error('sendfile')
+        if n == 0:
+            break
+        copied += n
+    if copied < size:
+        # The remaining data are copied from scratch by the next method
+        raise Unsupported('sendfile')
+
+
+def userspace(fsrc, fdst, size):
+    """
+    Copies the source file into the destination file through userspace buffers, as :func:`shutil.copyfile`.
+
+    :param file fsrc: The source file object
+    :param file fdst: The destination file object
+    :param int size: The source file size
+
+    """
+    shutil.copyfileobj(fsrc, fdst)
+
+
+# Copy methods from the fastest to the always supported one
+METHODS = [reflink, copy_file_range, sendfile, userspace]
+
+
+def attempt(method, fsrc, fdst, size, devices):
+    """
+    Attempts to copy a file with a method, unless known as unsupported between the source and destination devices.
+
+    :param callable method: The copy method
+    :param file fsrc: The source file object
+    :param file fdst: The destination file object
+    :param int size: The source file size
+    :param tuple devices: The source and destination devices
+    :returns: True if the file has been copied
+    :rtype: *boolean*
+
+    """
+    if (method.__name__, devices) in UNSUPPORTED:
+        return False
+    try:
+        method(fsrc, fdst, size)
+        return True
+    except Unsupported:
+        UNSUPPORTED.add((method.__name__, devices))
+        # Restart from scratch in case of partial copy
+        fsrc.seek(0)
+        fdst.seek(0)
+        fdst.truncate()
+        return False
+
+
+def copyfile(src, dst, checksum_type=None):
+    """
+    Copies the data of a file using the fastest method supported by the source and destination filesystems.
+    A method unsupported between two devices is not tried again for the next files.
+    If a checksum is requested, the data are hashed while copied through userspace buffers, unless reflinked.
+    A file reporting a null size (e.g., a pseudo-file) is always copied through userspace buffers.
+
+    :param str src: The source file path
+    :param str dst: The destination file path
+    :param str checksum_type: The checksum type to compute while copying (e.g., "sha256")
+    :returns: The name of the copy method used and the checksum (None if not requested)
+    :rtype: *tuple*
+
+    """
+    with open(src, 'rb') as fsrc:
+        with open(dst, 'wb') as fdst:
+            size = os.fstat(fsrc.fileno()).st_size
+            devices = (os.fstat(fsrc.fileno()).st_dev, os.fstat(fdst.fileno()).st_dev)
+            if checksum_type:
+                # The source data are read once, to be hashed and written if not reflinked
+                hash_algo = getattr(hashlib, checksum_type)()
+                cloned = size > 0 and attempt(reflink, fsrc, fdst, size, devices)
+                for block in iter(lambda: fsrc.read(COPY_BLOCKSIZE), b''):
+                    hash_algo.update(block)
+                    if not cloned:
+                        fdst.write(block)
+                return 'reflink' if cloned else 'userspace', hash_algo.hexdigest()
+            for method in METHODS if size > 0 else [userspace]:
+                if attempt(method, fsrc, fdst, size, devices):
+                    return method.__name__, None
+
+
+def copy2(src, dst, checksum_type=None):
+    """
+    Copies a file with its permission bits and timestamps, as :func:`shutil.copy2`.
+
+    :param str src: The source file path
+    :param str dst: The destination file path, or its directory
+    :param str checksum_type: The checksum type to compute while copying (e.g., "sha256")
+    :returns: The checksum of the copied data, None if not requested
+    :rtype: *str*
+
+    """
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    _, checksum = copyfile(src, dst, checksum_type)
+    shutil.copystat(src, dst)
+    return checksum
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+"""
+    :platform: Unix
+    :synopsis: Directory creation and links made relative to open directory file descriptors.
+
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+# Special file descriptor value to resolve a path from the current working directory
+AT_FDCWD = -100
+
+# Maximum number of directory file descriptors kept open per thread
+DIRFD_CACHE = 64
+
+
+def load_libc():
+    """
+    Loads the C library to call the directory-relative system calls.
+
+    :returns: The C library, None if not available
+    :rtype: *ctypes.CDLL*
+
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except OSError:
+        return None
+    for name, argtypes in [('symlinkat', [ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p]),
+                           ('linkat', [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_int]),
+                           ('renameat', [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p])]:
+        if not hasattr(libc, name):
+            return None
+        getattr(libc, name).argtypes = argtypes
+        getattr(libc, name).restype = ctypes.c_int
+    return libc
+
+
+LIBC = load_libc()
+
+
+def encode(path):
+    """
+    Encodes a path for the C library.
+
+    :param str path: The path
+    :returns: The encoded path
+    :rtype: *str*
+
+    """
+    if isinstance(path, unicode):
+        return path.encode(sys.getfilesystemencoding() or 'utf-8')
+    return path
+
+
+def check_call(result, path):
+    """
+    Raises the error of a failed system call, as the :mod:`os` functions.
+
+    :param int result: The system call result
+    :param str path: The path to report
+    :raises OSError: If the system call failed
+
+    """
+    if result != 0:
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code), path)
+
+
+def makedirs(directories):
+    """
+    Creates a set of directories once, from the shallowest to the deepest ones.
+    Existing directories are skipped without walking up their parents.
+
+    :param iterable directories: The directories to create
+
+    """
+    for directory in sorted(set(directories), key=lambda d: (d.count(os.sep), d)):
+        try:
+            os.mkdir(directory)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                # Missing parent outside of the submitted directories
+                os.makedirs(directory)
+            elif e.errno != errno.EEXIST:
+                raise
+
+
+class DirectoryHandles(object):
+    """
+    Directory file descriptors to create links relative to their directory.
+    The kernel only resolves the full directory path once, then each link is created by its name, which saves a lookup
+    per path component on network filesystems (e.g., Lustre).
+    Each thread keeps its own most recently used file descriptors, all closed on exit.
+    Without the directory-relative system calls, the links are created from their full path.
+
+    :returns: The directory handles
+    :rtype: *DirectoryHandles*
+
+    """
+
+    def __init__(self):
+        # Most recently used file descriptors of the current thread by directory
+        self.local = threading.local()
+        # All open file descriptors
+        self.fds = set()
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Closes all the directory file descriptors.
+
+        """
+        with self.lock:
+            for fd in self.fds:
+                os.close(fd)
+            self.fds.clear()
+        self.local = threading.local()
+
+    def dirfd(self, directory):
+        """
+        Gets a file descriptor of a directory for the current thread.
+
+        :param str directory: The directory path
+        :returns: The directory file descriptor
+        :rtype: *int*
+
+        """
+        directory = directory or os.curdir
+        cache = getattr(self.local, 'cache', None)
+        if cache is None:
+            cache = self.local.cache = OrderedDict()
+        if directory in cache:
+            fd = cache.pop(directory)
+        else:
+            fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+            with self.lock:
+                self.fds.add(fd)
+            if len(cache) >= DIRFD_CACHE:
+                _, oldest = cache.popitem(last=False)
+                with self.lock:
+                    self.fds.discard(oldest)
+                os.close(oldest)
+        cache[directory] = fd
+        return fd
+
+    def symlink(self, src, dst):
+        """
+        Creates a symbolic link, as :func:`os.symlink`.
+
+        :param str src: The link target
+        :param str dst: The link path
+
+        """
+        if not LIBC:
+            return os.symlink(src, dst)
+        directory, name = os.path.split(dst)
+        check_call(LIBC.symlinkat(encode(src), self.dirfd(directory), encode(name)), dst)
+
+    def link(self, src, dst):
+        """
+        Creates a hard link, as :func:`os.link`.
+
+        :param str src: The linked file path
+        :param str dst: The link path
+
+        """
+        if not LIBC:
+            return os.link(src, dst)
+        directory, name = os.path.split(dst)
+        check_call(LIBC.linkat(AT_FDCWD, encode(src), self.dirfd(directory), encode(name), 0), dst)
+
+    def rename(self, src, dst):
+        """
+        Renames a file, as :func:`os.rename`.
+        The source is resolved from the destination directory if both are in the same directory.
+
+        :param str src: The file path
+        :param str dst: The new file path
+
+        """
+        if not LIBC:
+            return os.rename(src, dst)
+        directory, name = os.path.split(dst)
+        fd = self.dirfd(directory)
+        if os.path.dirname(src) == directory:
+            check_call(LIBC.renameat(fd, encode(os.path.basename(src)), fd, encode(name)), dst)
+        else:
+            check_call(LIBC.renameat(AT_FDCWD, encode(src), fd, encode(name)), dst)
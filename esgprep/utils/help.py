@@ -181,6 +181,13 @@ DIRECTORY_HELP = {
 """
 }
 
+LEAF_DIRECTORIES_HELP = """Only reads one file per leaf directory matching the
+"directory_format" of the project (e.g., per version).
+The directories below a leaf directory are not walked.
+Only relevant with "--directory".
+
+"""
+
 DATASET_LIST_HELP = """File containing list of dataset IDs.
 If not, the standard input is used.
 
@@ -314,6 +321,17 @@ NO_CHECKSUM_HELP = {
 """
 }
 
+TREE_DATASET_HELP = """Only shows the DRS tree branches leading to the paths matching the regular expression
+(e.g., a dataset path as printed by "esgdrs list").
+Default is to show the whole DRS tree.
+
+"""
+
+TREE_DEPTH_HELP = """Only shows the N first levels of the DRS tree below the root.
+Default is to show the whole DRS tree.
+
+"""
+
 COMMANDS_FILE_HELP = """Writes Unix command-line statements only in the submitted file.
 Default is the standard output (requires "todo" action).
 
@@ -323,12 +341,34 @@ OVERWRITE_COMMANDS_FILE_HELP = """Allow overwriting of existing file specified b
 
 """
 
+COMMANDS_SCRIPT_HELP = """Writes the file submitted to "--commands-file" as a shell script applying the upgrade in parallel.
+The command-lines are grouped per DRS leaf into sections run one after the other (files, version and "latest"
+symbolic links, duplicates removal). Each section creates its directories at once and runs its lines with
+"xargs -P $JOBS" (default is 8 jobs).
+
+"""
+
 UPGRADE_FROM_LATEST_HELP = """The upgraded version of the dataset is based primarily on the previous (latest) version.
 Default is to consider the incoming files as the complete content of the new version of the dataset.
 See the full documentation to get details on this method.
 
 """
 
+STAGING_HELP = """Assembles each dataset version into a hidden ".vYYYYMMDD.staging" directory during upgrade.
+Once complete, the version is published by a single rename and the "latest" symbolic link is switched atomically.
+The publication steps are journaled into a hidden file under the DRS root to roll forward by running the upgrade
+again, or to roll back with "esgdrs upgrade --rollback".
+Default is to build the version directory in place.
+
+"""
+
+ROLLBACK_HELP = """Rolls back the dataset versions published by the staged upgrades of the same incoming directories
+into the same DRS root, whatever the other arguments. The incoming files are not scanned.
+The previous "latest" symbolic links are restored and the version directories are removed.
+The files migrated into the "files" directories are kept.
+
+"""
+
 IGNORE_FROM_LATEST_HELP = """A list of filename to ignore for version upgrade from the latest dataset version.
 Default is to consider the incoming files as the complete content of the new version of the dataset.
 It overwrites default behavior by enabling "--upgrade-from-latest". 
@@ -342,8 +382,9 @@ It allows to filter incoming files to consider.
 
 """
 
-RESCAN_HELP = """Force incoming files rescan.
+RESCAN_HELP = """Force a full incoming files rescan.
 Default is to scan incoming files with "list" action, or if no cached scan results exist, or if the changed arguments between two runs do not require to rescan the incoming files.
+Otherwise, a scan only processes the new or modified incoming files and those of datasets with a new latest version.
 
 """
 
@@ -365,6 +406,14 @@ Default is moving files.
 MAX_PROCESSES_HELP = """Number of maximal processes to simultaneously treat several files (useful if checksum calculation is enabled).
 Set to "1" seems sequential processing.
 Set to "-1" seems all available resources as returned by "multiprocessing.cpu_count()".
+A few sources are processed sequentially anyway and large files to checksum with threads.
+
+"""
+
+MAX_THREADS_HELP = """Number of maximal threads per target filesystem to simultaneously migrate files during upgrade (useful with "--copy").
+Files are migrated before the version symbolic links, and the "latest" symbolic links are switched last.
+Set to "1" seems sequential migration.
+Set to "-1" seems as many threads as available CPUs as returned by "multiprocessing.cpu_count()".
 
 """
 
@@ -437,11 +486,38 @@ Default is to build output directory as: "<TABLES_DIR>/<PROJECT>-cmor-table/<GH_
 """
 
 CHECKSUMS_FROM_HELP = """Get the checksums from an submitted file.
-This checksum file must have the same format as the output of the UNIX command-lines "*sum".
+This checksum file can be the output of the UNIX command-lines "*sum", an ESGF mapfile or a "path,checksum" CSV file.
+It is compiled once into an index shared by all processes.
 In the case of unfound checksums, it falls back to compute the checksum as normal.
 
 """
 
+CHECKSUMS_TO_HELP = """Append the checksums of the files copied during upgrade to the submitted file (with "--copy" or when moving files across filesystems).
+The data are hashed while copied, so that the copied files are never read again to be checksummed.
+This checksum file is in the format of the UNIX command-lines "*sum" and can be submitted to "esgmapfile --checksums-from".
+
+"""
+
+LATEST_MAPFILES_HELP = """Directory of the mapfiles published for the latest dataset versions (recursively scanned).
+The recorded checksums are used to detect duplicated files without reading the latest files.
+In the case of unfound checksums, it falls back to read the latest files as normal.
+
+"""
+
+ATTRIBUTES_CACHE_HELP = """SQLite file caching the netCDF global attributes between runs
+(default is "esgprep-attributes-$USER.db" into the temporary directory).
+Files are only read if their size or modification time changed since they were cached.
+The cache is shared by "esgcheckvocab" and "esgdrs".
+It also records the closest attribute names of the facets
+missing from the attributes.
+
+"""
+
+PRUNE_ATTRIBUTES_CACHE_HELP = """Removes the cached attributes of deleted or modified files before processing.
+It enables "--attributes-cache".
+
+"""
+
 ALL_VERSIONS_HELP = """Generates mapfile(s) with all versions found in the directory recursively scanned (default is to pick up only the latest one).
 It disables "--no-version".
 
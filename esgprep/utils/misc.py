@@ -8,12 +8,24 @@
 
 import hashlib
 import pickle
+from collections import OrderedDict
 from uuid import UUID
 
+from fuzzywuzzy.fuzz import partial_ratio
+from fuzzywuzzy.process import extractOne
 from netCDF4 import Dataset
 
 from custom_print import *
 from esgprep.drs.constants import PID_PREFIXES
+from esgprep.utils.checksums import ChecksumsIndex
+from esgprep.utils.constants import FINGERPRINT_BLOCKSIZE, FINGERPRINT_SAMPLES
+from esgprep.utils.ncheader import UnsupportedHeader, read_ncattrs
+
+# Checksum patterns cache by checksum type
+CHECKSUM_PATTERNS = dict()
+
+# Closest attribute name and score by facet and set of attribute names, for the process
+CLOSEST_ATTRIBUTES = dict()
 
 
 class ProcessContext(object):
@@ -58,6 +70,58 @@ class ncopen(object):
         self.nc.close()
 
 
+def get_ncattrs(path, cache=None):
+    """
+    Gets the netCDF global attributes.
+    The file header is parsed directly without loading the netCDF library.
+    Falls back on the netCDF library for any header layout not supported by the lightweight reader.
+    If an attributes cache is submitted, the file is only read if it changed since it was cached.
+
+    :param str path: The netCDF file full path
+    :param esgprep.utils.cache.AttributesCache cache: The attributes cache
+    :returns: The global attributes
+    :rtype: *OrderedDict*
+    :raises Error: If invalid NetCDF file
+
+    """
+    if cache:
+        stat = os.stat(path)
+        attributes = cache.get(path, stat)
+        if attributes is None:
+            attributes = get_ncattrs(path)
+            cache.set(path, attributes, stat)
+        return attributes
+    try:
+        return read_ncattrs(path)
+    except (UnsupportedHeader, IOError):
+        with ncopen(path) as nc:
+            return OrderedDict((attr, nc.getncattr(attr)) for attr in nc.ncattrs())
+
+
+def closest_attribute(facet, attributes, cache=None):
+    """
+    Gets the closest attribute name of a facet in terms of partial string comparison.
+    The fuzzy matching only runs once per process for each distinct set of attribute names (i.e., per attributes
+    schema). If an attributes cache is submitted, the resolution is also shared between processes and runs.
+
+    :param str facet: The facet name
+    :param iterable attributes: The attribute names
+    :param esgprep.utils.cache.AttributesCache cache: The attributes cache
+    :returns: The closest attribute name and its score
+    :rtype: *tuple*
+
+    """
+    key = (facet, frozenset(attributes))
+    if key not in CLOSEST_ATTRIBUTES:
+        closest = cache.get_closest(facet, key[1]) if cache else None
+        if closest is None:
+            closest = extractOne(facet, list(attributes), scorer=partial_ratio)
+            if cache and closest:
+                cache.set_closest(facet, key[1], closest)
+        CLOSEST_ATTRIBUTES[key] = closest
+    return CLOSEST_ATTRIBUTES[key]
+
+
 def remove(pattern, string):
     """
     Removes a substring catched by a regular expression.
@@ -182,32 +246,145 @@ def get_checksum_pattern(checksum_type):
     :rtype: *re.Object*
 
     """
-    hash_algo = getattr(hashlib, checksum_type)()
-    checksum_length = len(hash_algo.hexdigest())
-    return re.compile('^[0-9a-f]{{{}}}$'.format(checksum_length))
+    if checksum_type not in CHECKSUM_PATTERNS:
+        hash_algo = getattr(hashlib, checksum_type)()
+        checksum_length = len(hash_algo.hexdigest())
+        CHECKSUM_PATTERNS[checksum_type] = re.compile('^[0-9a-f]{{{}}}$'.format(checksum_length))
+    return CHECKSUM_PATTERNS[checksum_type]
+
+
+def fingerprint(ffp, blocksize=FINGERPRINT_BLOCKSIZE, samples=FINGERPRINT_SAMPLES):
+    """
+    Builds a cheap file fingerprint from its size, head, tail and some evenly spaced blocks.
+    Two different fingerprints guarantee different contents, the reverse is not true.
+
+    :param str ffp: The file full path
+    :param int blocksize: The size of each block to read
+    :param int samples: The number of blocks sampled between head and tail
+    :returns: The fingerprint
+    :rtype: *str*
+
+    """
+    size = os.stat(ffp).st_size
+    fp = hashlib.md5(str(size))
+    with open(ffp, 'rb') as f:
+        if size <= blocksize * (samples + 2):
+            fp.update(f.read())
+        else:
+            step = (size - blocksize) / (samples + 1)
+            for i in range(samples + 2):
+                f.seek(min(i * step, size - blocksize))
+                fp.update(f.read(blocksize))
+    return fp.digest()
 
 
-def get_tracking_id(ffp, project):
+def same_content(ffp, other_ffp, blocksize=None):
+    """
+    Compares two files block by block and stops at the first difference.
+
+    :param str ffp: The file full path
+    :param str other_ffp: The other file full path
+    :param int blocksize: The size of each block to read, default is the filesystem block size
+    :returns: True if both files have the same content
+    :rtype: *boolean*
+
+    """
+    if not blocksize:
+        blocksize = max(os.stat(ffp).st_blksize, FINGERPRINT_BLOCKSIZE)
+    with open(ffp, 'rb') as f, open(other_ffp, 'rb') as other:
+        while True:
+            block = f.read(blocksize)
+            if block != other.read(blocksize):
+                return False
+            if not block:
+                return True
+
+
+def get_known_checksum(ffp, checksum_type, checksums_from_file):
+    """
+    Get a file checksum from submitted checksums only, without computing it.
+    The path pointed by a symbolic link is also considered.
+
+    :param str ffp: The file full path
+    :param str checksum_type: Checksum type
+    :param esgprep.utils.checksums.ChecksumsIndex checksums_from_file: Checksums from file
+    :returns: The checksum, None if unknown
+    :rtype: *str*
+
+    """
+    if checksums_from_file:
+        pattern = get_checksum_pattern(checksum_type)
+        for path in set([ffp, os.path.realpath(ffp)]):
+            checksum_from_file = checksums_from_file.get(path)
+            if checksum_from_file and pattern.match(checksum_from_file):
+                return checksum_from_file
+    return None
+
+
+def identical_files(ffp, other_ffp, checksum_type, checksums_from_file=None, other_checksums_from_file=None):
+    """
+    Evaluates if two files with the same size have the same content by successive steps:
+
+     1. Compares the checksums if both are known from the submitted checksums,
+     2. Compares the files fingerprints,
+     3. Compares the checksum of the first file to the known checksum of the other one,
+     4. Otherwise compares the files contents block by block.
+
+    The other file is never fully read if its checksum is known.
+
+    :param str ffp: The file full path
+    :param str other_ffp: The other file full path
+    :param str checksum_type: Checksum type
+    :param esgprep.utils.checksums.ChecksumsIndex checksums_from_file: Checksums from file
+    :param esgprep.utils.checksums.ChecksumsIndex other_checksums_from_file: Additional checksums for the other file
+    :returns: True if both files have the same content
+    :rtype: *boolean*
+
+    """
+    known_checksum = get_known_checksum(ffp, checksum_type, checksums_from_file)
+    other_known_checksum = get_known_checksum(other_ffp, checksum_type, other_checksums_from_file) or \
+                           get_known_checksum(other_ffp, checksum_type, checksums_from_file)
+    if known_checksum and other_known_checksum:
+        return known_checksum == other_known_checksum
+    if fingerprint(ffp) != fingerprint(other_ffp):
+        return False
+    if other_known_checksum:
+        return checksum(ffp, checksum_type) == other_known_checksum
+    return same_content(ffp, other_ffp)
+
+
+def get_tracking_id(ffp, project, cache=None):
     """
     Get and validate tracking_id/PID string from netCDF global attributes of file
 
     :param str ffp: The file full path
     :param str project: The project name
+    :param esgprep.utils.cache.AttributesCache cache: The attributes cache
     :returns: THe tracking_id string
     """
-    with ncopen(ffp) as f:
-        if 'tracking_id' in f.ncattrs():
-            id = f.getncattr('tracking_id')
-            try:
-                prefix, uid = id.split('/')
-                assert prefix == PID_PREFIXES[project]
-            except ValueError:
-                uid = id
-                assert project not in PID_PREFIXES.keys()
-            assert is_uuid(uid)
-            return id
-        else:
-            return None
+    return check_tracking_id(get_ncattrs(ffp, cache).get('tracking_id'), project)
+
+
+def check_tracking_id(id, project):
+    """
+    Validates a tracking_id/PID string already read from the netCDF global attributes.
+
+    :param str id: The tracking_id string, None if not recorded into the file
+    :param str project: The project name
+    :returns: The tracking_id string
+    :rtype: *str*
+
+    """
+    if id is None:
+        return None
+    try:
+        prefix, uid = id.split('/')
+        assert prefix == PID_PREFIXES[project]
+    except ValueError:
+        uid = id
+        assert project not in PID_PREFIXES.keys()
+    assert is_uuid(uid)
+    return id
 
 
 def is_uuid(uuid_string, version=4):
@@ -229,35 +406,50 @@ def is_uuid(uuid_string, version=4):
 
 def load_checksums(checksum_file):
     """
-    Convert checksums file input as dictionary where (key: value) pairs respectively
-    are the file path and its checksum.
+    Compiles the checksums file input into an index where the file paths are the keys.
+    See :func:`esgprep.utils.checksums.parse_checksum_line` for the supported formats.
+    A checksums file without path (e.g., the standard input or a pipe) is read from the submitted file object.
 
     :param FileObject checksum_file: The submitted checksum file
     :returns: The loaded checksums
-    :rtype: *dict*
+    :rtype: *esgprep.utils.checksums.ChecksumsIndex*
+
+    """
+    if os.path.isfile(checksum_file.name):
+        checksum_file.close()
+        return ChecksumsIndex(sources=[checksum_file.name])
+    return ChecksumsIndex(stream=checksum_file)
+
 
+def load_mapfiles_checksums(directory):
     """
-    checksums = dict()
-    for checksum, path in [entry.split() for entry in checksum_file.read().splitlines()]:
-        path = os.path.abspath(os.path.normpath(path))
-        checksums[path] = checksum
-    return checksums
+    Compiles the checksums recorded into the mapfiles of a directory into an index where the file paths are the keys.
+    The directory is recursively scanned to also support mapfiles trees (i.e., "mapfile_drs").
+
+    :param str directory: The mapfiles directory
+    :returns: The loaded checksums, None if no mapfile found
+    :rtype: *esgprep.utils.checksums.ChecksumsIndex*
+
+    """
+    mapfiles = list()
+    for root, _, filenames in os.walk(directory, followlinks=True):
+        mapfiles.extend([os.path.join(root, filename) for filename in filenames if filename.endswith('.map')])
+    if not mapfiles:
+        Print.warning('No mapfile found in {} -- Latest files will be read to detect duplicates.'.format(directory))
+        return None
+    return ChecksumsIndex(sources=mapfiles)
 
 
 def get_checksum(ffp, checksum_type='sha256', checksums_from_file=None):
     """
     Get file checksum.
-    Allows to submit a list of checksums in a dictionary way {file: checksum}, to be used by --checksums-from flag.
+    Allows to submit an index of checksums {file: checksum}, to be used by --checksums-from flag.
 
     :param str checksum_type: Checksum type
-    :param dict checksums_from_file: Checksums from file
+    :param esgprep.utils.checksums.ChecksumsIndex checksums_from_file: Checksums from file
     :returns: The checksum
     :rtype: *str*
     :raises Error: If the checksum fails
 
     """
-    if checksums_from_file:
-        if ffp in checksums_from_file:
-            if re.match(get_checksum_pattern(checksum_type), checksums_from_file[ffp]):
-                return checksums_from_file[ffp]
-    return checksum(ffp, checksum_type)
+    return get_known_checksum(ffp, checksum_type, checksums_from_file) or checksum(ffp, checksum_type)
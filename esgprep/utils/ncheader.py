@@ -0,0 +1,552 @@
+# -*- coding: utf-8 -*-
+
+"""
+    :platform: Unix
+    :synopsis: Lightweight reader of netCDF global attributes parsing the file header only.
+
+"""
+
+import struct
+from collections import OrderedDict
+
+import numpy
+
+# Classic netCDF signature (followed by the format version byte)
+CDF_SIGNATURE = 'CDF'
+
+# Classic netCDF header tags
+NC_DIMENSION = 10
+NC_ATTRIBUTE = 12
+
+# Classic netCDF types as (numpy type, size in bytes)
+NC_TYPES = {1: ('i1', 1),
+            2: ('S1', 1),
+            3: ('>i2', 2),
+            4: ('>i4', 4),
+            5: ('>f4', 4),
+            6: ('>f8', 8),
+            7: ('u1', 1),
+            8: ('>u2', 2),
+            9: ('>u4', 4),
+            10: ('>i8', 8),
+            11: ('>u8', 8)}
+
+# HDF5 signature
+HDF5_SIGNATURE = '\x89HDF\r\n\x1a\n'
+
+# HDF5 header message types
+HDF5_ATTRIBUTE = 0x000C
+HDF5_CONTINUATION = 0x0010
+HDF5_ATTRIBUTE_INFO = 0x0015
+
+# HDF5 datatype classes
+HDF5_FIXED_POINT = 0
+HDF5_FLOATING_POINT = 1
+HDF5_STRING = 3
+
+# HDF5 v2 B-tree record type for attribute name index in dense storage
+HDF5_ATTRIBUTE_NAME_INDEX = 8
+
+# Errors raised by parsing an unexpected or corrupted header
+PARSE_ERRORS = (struct.error, IndexError, KeyError, TypeError, ValueError, OverflowError, MemoryError)
+
+# Hidden attributes written by the netCDF-4 library
+NETCDF4_HIDDEN_ATTRIBUTES = ['_NCProperties', '_IsNetcdf4', '_SuperblockVersion', '_nc3_strict',
+                             '_Netcdf4Dimid', '_Netcdf4Coordinates']
+
+
+class UnsupportedHeader(Exception):
+    """
+    Raised when the file header cannot be parsed by this module.
+    The caller is expected to fall back on the netCDF library.
+
+    """
+
+    def __init__(self, path, reason):
+        self.msg = "Unsupported netCDF header."
+        self.msg += "\n<file: '{}'>".format(path)
+        self.msg += "\n<reason: '{}'>".format(reason)
+        super(self.__class__, self).__init__(self.msg)
+
+
+def decode_text(data):
+    """
+    Decodes a character attribute the same way as the netCDF4 Python library.
+
+    :param str data: The raw bytes
+    :returns: The decoded string
+    :rtype: *unicode*
+
+    """
+    return data.decode('utf-8', 'replace').replace(u'\x00', u'')
+
+
+def decode_values(data, dtype):
+    """
+    Decodes a numeric attribute the same way as the netCDF4 Python library.
+
+    :param str data: The raw bytes
+    :param numpy.dtype dtype: The values type
+    :returns: The scalar if only one value, the array otherwise
+    :rtype: *numpy.generic* or *numpy.ndarray*
+
+    """
+    values = numpy.frombuffer(data, dtype=dtype).astype(dtype.newbyteorder('='))
+    if len(values) == 1:
+        return values[0]
+    return values
+
+
+class Header(object):
+    """
+    Base class to read a file header.
+
+    :param file f: The opened file
+    :param str path: The file full path
+
+    """
+
+    def __init__(self, f, path):
+        self.f = f
+        self.path = path
+
+    def read(self, size, offset=None):
+        """
+        Reads bytes from the file, at the current position if no offset.
+
+        :param int size: The number of bytes to read
+        :param int offset: The absolute offset to read from
+        :returns: The read bytes
+        :rtype: *str*
+        :raises Error: If the file is truncated
+
+        """
+        if offset is not None:
+            self.f.seek(offset)
+        data = self.f.read(size)
+        if len(data) != size:
+            raise UnsupportedHeader(self.path, 'Truncated header')
+        return data
+
+    def attributes(self):
+        """
+        Returns the global attributes.
+
+        :returns: The global attributes
+        :rtype: *OrderedDict*
+
+        """
+        raise NotImplementedError
+
+
+class ClassicHeader(Header):
+    """
+    Reads global attributes from CDF-1, CDF-2 and CDF-5 headers.
+
+    """
+
+    def __init__(self, f, path, version):
+        super(ClassicHeader, self).__init__(f, path)
+        if version not in (1, 2, 5):
+            raise UnsupportedHeader(path, 'Unknown CDF version {}'.format(version))
+        # CDF-5 uses 64-bit integers for sizes
+        self.non_neg = '>q' if version == 5 else '>i'
+
+    def read_non_neg(self):
+        return struct.unpack(self.non_neg, self.read(struct.calcsize(self.non_neg)))[0]
+
+    def read_tag(self):
+        return struct.unpack('>i', self.read(4))[0]
+
+    def read_name(self):
+        size = self.read_non_neg()
+        return self.read(size + (-size % 4))[:size].decode('utf-8')
+
+    def attributes(self):
+        # Skip number of records
+        self.read_non_neg()
+        # Skip dimensions list
+        tag, nelems = self.read_tag(), self.read_non_neg()
+        if tag == NC_DIMENSION:
+            for _ in range(nelems):
+                self.read_name()
+                self.read_non_neg()
+        elif tag != 0 or nelems != 0:
+            raise UnsupportedHeader(self.path, 'Invalid dimensions list')
+        # Read global attributes list
+        attributes = OrderedDict()
+        tag, nelems = self.read_tag(), self.read_non_neg()
+        if tag == NC_ATTRIBUTE:
+            for _ in range(nelems):
+                name = self.read_name()
+                nc_type, nvalues = self.read_tag(), self.read_non_neg()
+                if nc_type not in NC_TYPES:
+                    raise UnsupportedHeader(self.path, 'Unknown type {}'.format(nc_type))
+                dtype, size = NC_TYPES[nc_type]
+                data = self.read(nvalues * size + (-nvalues * size % 4))[:nvalues * size]
+                if nc_type == 2:
+                    attributes[name] = decode_text(data)
+                else:
+                    attributes[name] = decode_values(data, numpy.dtype(dtype))
+        elif tag != 0 or nelems != 0:
+            raise UnsupportedHeader(self.path, 'Invalid attributes list')
+        return attributes
+
+
+class HDF5Header(Header):
+    """
+    Reads the attributes of the root group from netCDF-4 (i.e., HDF5) files.
+    Attributes stored in the object header (compact storage) or in a fractal heap indexed by name (dense storage)
+    are supported. Shared or variable-length datatypes, huge heap objects and deep B-trees are not.
+    Attributes are returned in creation order when tracked (as netCDF-4 does), in header message order otherwise.
+
+    """
+
+    def __init__(self, f, path):
+        super(HDF5Header, self).__init__(f, path)
+        self.base = 0
+        self.offset_size = 8
+        self.length_size = 8
+        # True if the root group tracks the attributes creation order
+        self.tracked = False
+
+    def unpack_int(self, data, pos, size):
+        """
+        Unpacks a little-endian unsigned integer of any size.
+
+        """
+        return sum([ord(byte) << (8 * i) for i, byte in enumerate(data[pos:pos + size])])
+
+    def is_undefined(self, address):
+        return address == (1 << (8 * self.offset_size)) - 1
+
+    def root_object_header(self):
+        """
+        Reads the superblock to get the root group object header address.
+
+        :returns: The root group object header address
+        :rtype: *int*
+
+        """
+        data = self.read(64, 0)
+        version = ord(data[8])
+        if version in (0, 1):
+            self.offset_size, self.length_size = ord(data[13]), ord(data[14])
+            pos = 24 if version == 0 else 28
+            self.base = self.unpack_int(data, pos, self.offset_size)
+            # Skip free-space, end of file and driver info addresses, then link name offset of root entry
+            pos += 5 * self.offset_size
+            data = self.read(self.offset_size, pos)
+            return self.base + self.unpack_int(data, 0, self.offset_size)
+        elif version in (2, 3):
+            self.offset_size, self.length_size = ord(data[9]), ord(data[10])
+            self.base = self.unpack_int(data, 12, self.offset_size)
+            return self.base + self.unpack_int(data, 12 + 3 * self.offset_size, self.offset_size)
+        raise UnsupportedHeader(self.path, 'Unknown superblock version {}'.format(version))
+
+    def messages(self, address):
+        """
+        Yields the (type, data, creation order) header messages of an object header following continuation blocks.
+        The creation order is None if not tracked.
+
+        :param int address: The object header address
+
+        """
+        blocks = list()
+        data = self.read(16, address)
+        if data[:4] == 'OHDR':
+            # Version 2 object header
+            flags = ord(data[5])
+            pos = 6 + (16 if flags & 0x20 else 0) + (4 if flags & 0x10 else 0)
+            chunk_size_length = 1 << (flags & 0x03)
+            header = self.read(pos + chunk_size_length, address)
+            chunk_size = self.unpack_int(header, pos, chunk_size_length)
+            blocks.append((2, self.read(chunk_size, address + pos + chunk_size_length)))
+            creation_order = 2 if flags & 0x04 else 0
+            self.tracked = bool(creation_order)
+        elif ord(data[0]) == 1:
+            # Version 1 object header, messages start after alignment padding
+            chunk_size = self.unpack_int(data, 8, 4)
+            blocks.append((1, self.read(chunk_size, address + 16)))
+            creation_order = 0
+        else:
+            raise UnsupportedHeader(self.path, 'Unknown object header version')
+        while blocks:
+            version, block = blocks.pop(0)
+            pos = 0
+            while pos < len(block):
+                if version == 1:
+                    if pos + 8 > len(block):
+                        break
+                    msg_type, size, msg_flags = self.unpack_int(block, pos, 2), self.unpack_int(block, pos + 2, 2), \
+                                                ord(block[pos + 4])
+                    order = None
+                    pos += 8
+                else:
+                    if pos + 4 + creation_order > len(block):
+                        break
+                    msg_type, size, msg_flags = ord(block[pos]), self.unpack_int(block, pos + 1, 2), \
+                                                ord(block[pos + 3])
+                    order = self.unpack_int(block, pos + 4, 2) if creation_order else None
+                    pos += 4 + creation_order
+                msg = block[pos:pos + size]
+                pos += size
+                if msg_type == HDF5_CONTINUATION:
+                    offset = self.base + self.unpack_int(msg, 0, self.offset_size)
+                    length = self.unpack_int(msg, self.offset_size, self.length_size)
+                    if version == 1:
+                        blocks.append((1, self.read(length, offset)))
+                    else:
+                        # Skip "OCHK" signature and checksum
+                        blocks.append((2, self.read(length, offset)[4:-4]))
+                elif msg_type in (HDF5_ATTRIBUTE, HDF5_ATTRIBUTE_INFO):
+                    if msg_flags & 0x02:
+                        raise UnsupportedHeader(self.path, 'Shared header message')
+                    yield msg_type, msg, order
+
+    def parse_attribute(self, msg):
+        """
+        Parses an attribute message.
+
+        :param str msg: The attribute message
+        :returns: The attribute name and value
+        :rtype: *tuple*
+
+        """
+        version, flags = ord(msg[0]), ord(msg[1])
+        if flags & 0x03:
+            raise UnsupportedHeader(self.path, 'Shared attribute datatype or dataspace')
+        name_size, datatype_size, dataspace_size = [self.unpack_int(msg, pos, 2) for pos in (2, 4, 6)]
+        if version == 1:
+            pad = lambda x: x + (-x % 8)
+            pos = 8
+        elif version in (2, 3):
+            pad = lambda x: x
+            pos = 8 if version == 2 else 9
+        else:
+            raise UnsupportedHeader(self.path, 'Unknown attribute message version {}'.format(version))
+        name = msg[pos:pos + name_size].rstrip('\x00').decode('utf-8')
+        pos += pad(name_size)
+        datatype = msg[pos:pos + datatype_size]
+        pos += pad(datatype_size)
+        dataspace = msg[pos:pos + dataspace_size]
+        pos += pad(dataspace_size)
+        # Parse dataspace
+        ds_version, rank, ds_flags = ord(dataspace[0]), ord(dataspace[1]), ord(dataspace[2])
+        if ds_version == 1:
+            dims_pos = 8
+        elif ds_version == 2:
+            dims_pos = 4
+            if ord(dataspace[3]) == 2:
+                # Null dataspace
+                rank = None
+        else:
+            raise UnsupportedHeader(self.path, 'Unknown dataspace version {}'.format(ds_version))
+        nvalues = 0
+        if rank is not None:
+            nvalues = 1
+            for i in range(rank):
+                nvalues *= self.unpack_int(dataspace, dims_pos + i * self.length_size, self.length_size)
+        # Parse datatype
+        dt_class, dt_flags = ord(datatype[0]) & 0x0F, ord(datatype[1])
+        size = self.unpack_int(datatype, 4, 4)
+        data = msg[pos:pos + nvalues * size]
+        if len(data) != nvalues * size:
+            raise UnsupportedHeader(self.path, 'Truncated attribute {}'.format(name))
+        if dt_class == HDF5_STRING:
+            return name, decode_text(data)
+        elif dt_class in (HDF5_FIXED_POINT, HDF5_FLOATING_POINT):
+            kind = 'f' if dt_class == HDF5_FLOATING_POINT else ('i' if dt_flags & 0x08 else 'u')
+            if dt_class == HDF5_FLOATING_POINT and dt_flags & 0x40:
+                raise UnsupportedHeader(self.path, 'VAX floating point')
+            dtype = numpy.dtype('{}{}{}'.format('>' if dt_flags & 0x01 else '<', kind, size))
+            return name, decode_values(data, dtype)
+        raise UnsupportedHeader(self.path, 'Unsupported datatype class {}'.format(dt_class))
+
+    def dense_attributes(self, msg):
+        """
+        Yields the (creation order, attribute message) stored in a fractal heap indexed by a v2 B-tree.
+
+        :param str msg: The attribute info message
+
+        """
+        flags = ord(msg[1])
+        pos = 4 if flags & 0x01 else 2
+        heap_address = self.unpack_int(msg, pos, self.offset_size)
+        btree_address = self.unpack_int(msg, pos + self.offset_size, self.offset_size)
+        if self.is_undefined(heap_address):
+            return
+        heap = FractalHeap(self, self.base + heap_address)
+        records = list()
+        for record in self.btree_records(self.base + btree_address):
+            # Record is heap ID, message flags, creation order and name hash
+            records.append((self.unpack_int(record, 8 + 1, 4), record[:8]))
+        for order, heap_id in sorted(records):
+            yield order, heap.get(heap_id)
+
+    def btree_records(self, address):
+        """
+        Yields the records of a v2 B-tree of depth 0 or 1.
+
+        :param int address: The B-tree header address
+
+        """
+        header = self.read(16 + self.offset_size + 2 + self.length_size, address)
+        if header[:4] != 'BTHD':
+            raise UnsupportedHeader(self.path, 'Invalid B-tree header')
+        if ord(header[5]) != HDF5_ATTRIBUTE_NAME_INDEX:
+            raise UnsupportedHeader(self.path, 'Unexpected B-tree type')
+        node_size = self.unpack_int(header, 6, 4)
+        record_size = self.unpack_int(header, 10, 2)
+        depth = self.unpack_int(header, 12, 2)
+        root_address = self.unpack_int(header, 16, self.offset_size)
+        nrecords = self.unpack_int(header, 16 + self.offset_size, 2)
+        if self.is_undefined(root_address) or not nrecords:
+            return
+        if depth > 1:
+            raise UnsupportedHeader(self.path, 'B-tree depth {}'.format(depth))
+        node = self.read(node_size, self.base + root_address)
+        for i in range(nrecords):
+            yield node[6 + i * record_size:6 + (i + 1) * record_size]
+        if depth == 1:
+            # Child pointers are the address and the number of records of each leaf
+            max_leaf_records = (node_size - 10) / record_size
+            nrecords_size = (max_leaf_records.bit_length() - 1) / 8 + 1
+            pos = 6 + nrecords * record_size
+            for _ in range(nrecords + 1):
+                child_address = self.unpack_int(node, pos, self.offset_size)
+                child_nrecords = self.unpack_int(node, pos + self.offset_size, nrecords_size)
+                pos += self.offset_size + nrecords_size
+                leaf = self.read(node_size, self.base + child_address)
+                if leaf[:4] != 'BTLF':
+                    raise UnsupportedHeader(self.path, 'Invalid B-tree leaf node')
+                for i in range(child_nrecords):
+                    yield leaf[6 + i * record_size:6 + (i + 1) * record_size]
+
+    def attributes(self):
+        messages = list()
+        for msg_type, msg, order in self.messages(self.root_object_header()):
+            if msg_type == HDF5_ATTRIBUTE:
+                messages.append((order, msg))
+            else:
+                messages.extend(self.dense_attributes(msg))
+        # A message can be moved within the object header (e.g., to a continuation block) when resized
+        if self.tracked:
+            messages.sort(key=lambda message: message[0])
+        attributes = OrderedDict()
+        for _, msg in messages:
+            name, value = self.parse_attribute(msg)
+            if name not in NETCDF4_HIDDEN_ATTRIBUTES:
+                attributes[name] = value
+        return attributes
+
+
+class FractalHeap(object):
+    """
+    Minimal HDF5 fractal heap reader to get managed and tiny objects.
+    Only the direct blocks of the root block are supported.
+
+    :param HDF5Header header: The HDF5 header reader
+    :param int address: The fractal heap header address
+
+    """
+
+    def __init__(self, header, address):
+        self.header = header
+        o, l = header.offset_size, header.length_size
+        data = header.read(22 + 3 * o + 12 * l + 12, address)
+        if data[:4] != 'FRHP':
+            raise UnsupportedHeader(header.path, 'Invalid fractal heap header')
+        unpack = header.unpack_int
+        self.heap_id_length = unpack(data, 5, 2)
+        if unpack(data, 7, 2):
+            raise UnsupportedHeader(header.path, 'Filtered fractal heap')
+        self.checksummed = ord(data[9]) & 0x02
+        max_managed_size = unpack(data, 10, 4)
+        pos = 14 + l + o + l + o + 8 * l
+        self.width = unpack(data, pos, 2)
+        self.start_size = unpack(data, pos + 2, l)
+        self.max_direct_size = unpack(data, pos + 2 + l, l)
+        max_heap_bits = unpack(data, pos + 2 + 2 * l, 2)
+        self.root_address = unpack(data, pos + 6 + 2 * l, o)
+        self.root_rows = unpack(data, pos + 6 + 2 * l + o, 2)
+        self.offset_length = (max_heap_bits + 7) / 8
+        self.length_length = min((self.max_direct_size.bit_length() + 6) / 8,
+                                 (max_managed_size.bit_length() + 6) / 8)
+        self.blocks = None
+
+    def direct_blocks(self):
+        """
+        Returns the (heap offset, size, address) of the root direct blocks.
+
+        """
+        if self.blocks is None:
+            self.blocks = list()
+            if self.root_rows == 0:
+                self.blocks.append((0, self.start_size, self.root_address))
+            else:
+                max_direct_rows = len(bin(self.max_direct_size)) - len(bin(self.start_size)) + 2
+                if self.root_rows > max_direct_rows:
+                    raise UnsupportedHeader(self.header.path, 'Fractal heap with indirect blocks')
+                o = self.header.offset_size
+                nblocks = self.root_rows * self.width
+                data = self.header.read(5 + o + self.offset_length + nblocks * o,
+                                        self.header.base + self.root_address)
+                if data[:4] != 'FHIB':
+                    raise UnsupportedHeader(self.header.path, 'Invalid fractal heap indirect block')
+                pos = 5 + o + self.offset_length
+                offset = 0
+                for row in range(self.root_rows):
+                    size = self.start_size * (1 << max(row - 1, 0))
+                    for _ in range(self.width):
+                        address = self.header.unpack_int(data, pos, o)
+                        pos += o
+                        if not self.header.is_undefined(address):
+                            self.blocks.append((offset, size, address))
+                        offset += size
+        return self.blocks
+
+    def get(self, heap_id):
+        """
+        Returns a heap object from its ID.
+
+        :param str heap_id: The heap ID
+        :returns: The object data
+        :rtype: *str*
+
+        """
+        id_type = (ord(heap_id[0]) >> 4) & 0x03
+        if id_type == 2:
+            # Tiny object stored in the ID itself
+            return heap_id[1:1 + (ord(heap_id[0]) & 0x0F) + 1]
+        elif id_type != 0:
+            raise UnsupportedHeader(self.header.path, 'Huge fractal heap object')
+        offset = self.header.unpack_int(heap_id, 1, self.offset_length)
+        length = self.header.unpack_int(heap_id, 1 + self.offset_length, self.length_length)
+        for block_offset, size, address in self.direct_blocks():
+            if block_offset <= offset < block_offset + size:
+                return self.header.read(length, self.header.base + address + offset - block_offset)
+        raise UnsupportedHeader(self.header.path, 'Fractal heap object not found')
+
+
+def read_ncattrs(path):
+    """
+    Reads the netCDF global attributes from the file header only.
+
+    :param str path: The netCDF file full path
+    :returns: The global attributes
+    :rtype: *OrderedDict*
+    :raises Error: If the header is not supported or cannot be parsed
+
+    """
+    with open(path, 'rb') as f:
+        signature = f.read(8)
+        try:
+            if signature[:3] == CDF_SIGNATURE and len(signature) > 3:
+                f.seek(4)
+                return ClassicHeader(f, path, ord(signature[3])).attributes()
+            elif signature == HDF5_SIGNATURE:
+                return HDF5Header(f, path).attributes()
+        except PARSE_ERRORS as e:
+            raise UnsupportedHeader(path, '{}: {}'.format(e.__class__.__name__, e))
+    raise UnsupportedHeader(path, 'Unknown file signature')
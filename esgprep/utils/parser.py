@@ -157,6 +157,23 @@ def processes_validator(value):
         return pnum
 
 
+def depth_validator(value):
+    """
+    Validates the tree depth.
+
+    :param str value: The tree depth submitted
+    :returns: The tree depth
+    :rtype: *int*
+    :raises Error: If invalid tree depth
+
+    """
+    depth = int(value)
+    if depth < 1:
+        msg = 'Invalid tree depth. Should be a positive integer.'
+        raise ArgumentTypeError(msg)
+    return depth
+
+
 class CustomArgumentParser(ArgumentParser):
     def error(self, message):
         """
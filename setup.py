@@ -71,8 +71,7 @@ else:
                             'requests==2.20.0',
                             'fuzzywuzzy==0.16.0',
                             'netCDF4==1.4.0',
-                            'hurry.filesize==0.9',
-                            'treelib==1.4.0'],
+                            'hurry.filesize==0.9'],
           platforms=['Unix'],
           zip_safe=False,
           entry_points={'console_scripts': ['esgmapfile=esgprep.esgmapfile:main',